@@ -105,21 +105,66 @@ def create_app():
 
         app.config['SQLALCHEMY_DATABASE_URI'] = database_url
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        
+
+        # Realtime Inbox - 'memory' for single node, 'postgres' (LISTEN/NOTIFY) for multi-instance,
+        # 'auto' = postgres whenever the database is PostgreSQL. Both need a long-lived process, so on
+        # serverless the default is 'memory' with long-poll only (no SSE) plus the inbox polling
+        serverless = bool(os.environ.get('VERCEL'))
+        app.config['REALTIME_BACKEND'] = os.environ.get('REALTIME_BACKEND', 'memory' if serverless else 'auto')
+        app.config['REALTIME_SSE'] = os.environ.get('REALTIME_SSE', 'false' if serverless else 'true').lower() == 'true'
+        app.config['REALTIME_STREAM_SECONDS'] = int(os.environ.get('REALTIME_STREAM_SECONDS', 300))
+
+        # WhatsApp outgoing media: uploaded to storage and sent to Z-API by URL
+        app.config['WHATSAPP_MEDIA_MAX_MB'] = int(os.environ.get('WHATSAPP_MEDIA_MAX_MB', 16))
+
+        # WhatsApp broadcast campaigns (rate is per Z-API instance)
+        app.config['BROADCAST_RATE_PER_MINUTE'] = int(os.environ.get('BROADCAST_RATE_PER_MINUTE', 20))
+        app.config['BROADCAST_CONCURRENCY'] = int(os.environ.get('BROADCAST_CONCURRENCY', 3))
+        app.config['BROADCAST_MAX_RETRIES'] = int(os.environ.get('BROADCAST_MAX_RETRIES', 3))
+
+        # Asaas boleto generation (rate is per tenant API key)
+        app.config['ASAAS_RATE_PER_MINUTE'] = int(os.environ.get('ASAAS_RATE_PER_MINUTE', 60))
+        app.config['ASAAS_CONCURRENCY'] = int(os.environ.get('ASAAS_CONCURRENCY', 4))
+        app.config['ASAAS_MAX_RETRIES'] = int(os.environ.get('ASAAS_MAX_RETRIES', 3))
+
+        # Cron endpoints drain their queues inside the request (serverless threads freeze after the
+        # response); keep below the function's max duration
+        app.config['CRON_TIME_BUDGET_SECONDS'] = int(os.environ.get('CRON_TIME_BUDGET_SECONDS', 45))
+
+        # NFS-e issuance queue fed by the Asaas webhook (batch = invoices per tenant per round)
+        app.config['NFSE_BATCH_SIZE'] = int(os.environ.get('NFSE_BATCH_SIZE', 20))
+        app.config['NFSE_MAX_ATTEMPTS'] = int(os.environ.get('NFSE_MAX_ATTEMPTS', 5))
+
+        # Contract PDF bulk export: render processes (fpdf is CPU-bound); 0 = render in the job thread
+        app.config['PDF_EXPORT_WORKERS'] = int(os.environ.get('PDF_EXPORT_WORKERS', min(os.cpu_count() or 1, 4)))
+        # Serverless: threads freeze once the response is sent, so the cron builds exports in its own request
+        app.config['PDF_EXPORT_INLINE'] = os.environ.get('PDF_EXPORT_INLINE', 'true' if os.environ.get('VERCEL') else 'false').lower() == 'true'
+
+        # Goals dashboard: keep a per-user/month revenue rollup table instead of aggregating per request
+        app.config['GOALS_REVENUE_ROLLUP'] = os.environ.get('GOALS_REVENUE_ROLLUP', 'false').lower() == 'true'
+
         # Folders
         app.config['UPLOAD_FOLDER'] = 'static/uploads/profiles'
         app.config['COMPANY_UPLOAD_FOLDER'] = 'static/uploads/company'
+        app.config['WHATSAPP_MEDIA_FOLDER'] = 'static/uploads/whatsapp'
+        app.config['PDF_CACHE_FOLDER'] = os.environ.get('PDF_CACHE_FOLDER', 'instance/pdf_cache') # Private: rendered contract PDFs
         
         # Check for read-only filesystem (Vercel)
         try:
             os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
             os.makedirs(app.config['COMPANY_UPLOAD_FOLDER'], exist_ok=True)
+            os.makedirs(app.config['WHATSAPP_MEDIA_FOLDER'], exist_ok=True)
+            os.makedirs(app.config['PDF_CACHE_FOLDER'], exist_ok=True)
         except OSError:
             app.config['UPLOAD_FOLDER'] = '/tmp/uploads/profiles'
             app.config['COMPANY_UPLOAD_FOLDER'] = '/tmp/uploads/company'
+            app.config['WHATSAPP_MEDIA_FOLDER'] = '/tmp/uploads/whatsapp'
+            app.config['PDF_CACHE_FOLDER'] = '/tmp/pdf_cache'
             try:
                 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
                 os.makedirs(app.config['COMPANY_UPLOAD_FOLDER'], exist_ok=True)
+                os.makedirs(app.config['WHATSAPP_MEDIA_FOLDER'], exist_ok=True)
+                os.makedirs(app.config['PDF_CACHE_FOLDER'], exist_ok=True)
             except: pass
 
         # Supabase Setup
@@ -499,7 +544,8 @@ def create_app():
             ('routes.roles', 'roles_bp', 'roles_bp', None),
             ('routes.billing', 'billing_bp', 'billing_bp', None),
             ('routes.service_orders', 'service_orders_bp', 'service_orders_bp', None),
-            ('routes.pdf_routes', 'pdf_bp', 'pdf_bp', None)
+            ('routes.pdf_routes', 'pdf_bp', 'pdf_bp', None),
+            ('routes.branding', 'branding_bp', 'branding_bp', None)
         ]
 
         import importlib
@@ -561,7 +607,8 @@ def create_app():
                                 ('features', 'JSONB DEFAULT \'{}\''),
                                 ('allowed_global_template_ids', 'JSONB DEFAULT \'[]\''),
                                 ('default_template_id', 'INTEGER'),
-                                ('auto_create_subfolders', 'BOOLEAN DEFAULT TRUE')
+                                ('auto_create_subfolders', 'BOOLEAN DEFAULT TRUE'),
+                                ('logo_key', 'VARCHAR(80)')
                             ]:
                                 if col not in columns:
                                     try:
@@ -662,7 +709,9 @@ def create_app():
                                 ('emit_nfse', "BOOLEAN DEFAULT TRUE"),
                                 ('nfse_service_code', "VARCHAR(20)"),
                                 ('nfse_iss_rate', "FLOAT"),
-                                ('nfse_desc', "VARCHAR(255)")
+                                ('nfse_desc', "VARCHAR(255)"),
+                                ('installment_value', "NUMERIC(12,2)"),
+                                ('pdf_key', "VARCHAR(64)")
                             ]
                             for col, dtype in repairs:
                                 if col not in ctr_cols:
@@ -670,6 +719,70 @@ def create_app():
                                     except: pass
                             conn.commit()
 
+                        # Typed MRR column: parse existing form_data once
+                        if 'installment_value' not in ctr_cols:
+                            from maintenance.backfill_installment_values import backfill as backfill_installments
+                            backfill_installments()
+
+                    # 6.0 CONTRACT TEMPLATE REPAIR (Compiled template cache version)
+                    if inspector.has_table("contract_template"):
+                        with db.engine.connect() as conn:
+                            tpl_cols = [c['name'] for c in inspector.get_columns("contract_template")]
+                            if 'updated_at' not in tpl_cols:
+                                try: conn.execute(text("ALTER TABLE contract_template ADD COLUMN updated_at TIMESTAMP"))
+                                except: pass
+                            conn.commit()
+
+                    # 6.1 TRANSACTION REPAIR (Background boleto generation)
+                    if inspector.has_table("transaction"):
+                        with db.engine.connect() as conn:
+                            tx_cols = [c['name'] for c in inspector.get_columns("transaction")]
+                            repairs = [
+                                ('billing_status', "VARCHAR(20)"),
+                                ('billing_error', "TEXT"),
+                                ('nfse_attempts', "INTEGER DEFAULT 0"),
+                                ('nfse_error', "TEXT"),
+                                ('nfse_next_attempt_at', "TIMESTAMP")
+                            ]
+                            for col, dtype in repairs:
+                                if col not in tx_cols:
+                                    # QUOTE "transaction" because it is a reserved keyword!
+                                    try: conn.execute(text(f'ALTER TABLE "transaction" ADD COLUMN {col} {dtype}'))
+                                    except: pass
+                            conn.commit()
+
+                    # 6.2 BILLING EVENT REPAIR (Asynchronous webhook processing)
+                    if inspector.has_table("billing_event"):
+                        with db.engine.connect() as conn:
+                            ev_cols = [c['name'] for c in inspector.get_columns("billing_event")]
+                            repairs = [
+                                # Events stored before the queue existed were already handled inline
+                                ('status', "VARCHAR(20) DEFAULT 'processed'"),
+                                ('attempts', "INTEGER DEFAULT 0"),
+                                ('last_error', "TEXT"),
+                                ('locked_at', "TIMESTAMP")
+                            ]
+                            for col, dtype in repairs:
+                                if col not in ev_cols:
+                                    try: conn.execute(text(f"ALTER TABLE billing_event ADD COLUMN {col} {dtype}"))
+                                    except: pass
+                            conn.commit()
+
+                    # 6.3 CONTRACT EXPORT REPAIR (ZIP in storage, runner lease)
+                    if inspector.has_table("contract_export_job"):
+                        with db.engine.connect() as conn:
+                            export_cols = [c['name'] for c in inspector.get_columns("contract_export_job")]
+                            repairs = [
+                                ('storage_path', "VARCHAR(255)"),
+                                ('locked_by', "VARCHAR(100)"),
+                                ('locked_at', "TIMESTAMP")
+                            ]
+                            for col, dtype in repairs:
+                                if col not in export_cols:
+                                    try: conn.execute(text(f"ALTER TABLE contract_export_job ADD COLUMN {col} {dtype}"))
+                                    except: pass
+                            conn.commit()
+
                     # 7. DRIVE TEMPLATE REPAIR
                     if inspector.has_table("drive_folder_template"):
                         with db.engine.connect() as conn:
@@ -715,6 +828,56 @@ def create_app():
                 except Exception as task_mig_e:
                     print(f"⚠️ Task Migration Error: {task_mig_e}")
 
+                # 9. WHATSAPP REPAIR (Broadcast campaigns)
+                try:
+                    if inspector.has_table("whats_app_message"):
+                        with db.engine.connect() as conn:
+                            msg_cols = [c['name'] for c in inspector.get_columns("whats_app_message")]
+                            repairs = [
+                                ('campaign_id', "INTEGER REFERENCES whats_app_campaign(id)"),
+                                ('attempts', "INTEGER DEFAULT 0")
+                            ]
+                            for col, dtype in repairs:
+                                if col not in msg_cols:
+                                    try: conn.execute(text(f"ALTER TABLE whats_app_message ADD COLUMN {col} {dtype}"))
+                                    except: pass
+                            conn.commit()
+                    if inspector.has_table("whats_app_campaign"):
+                        with db.engine.connect() as conn:
+                            campaign_cols = [c['name'] for c in inspector.get_columns("whats_app_campaign")]
+                            for col, dtype in [('locked_by', "VARCHAR(100)"), ('locked_at', "TIMESTAMP")]:
+                                if col not in campaign_cols:
+                                    try: conn.execute(text(f"ALTER TABLE whats_app_campaign ADD COLUMN {col} {dtype}"))
+                                    except: pass
+                            conn.commit()
+                    if inspector.has_table("contact"):
+                        contact_cols = [c['name'] for c in inspector.get_columns("contact")]
+                        if 'unread_count' not in contact_cols:
+                            with db.engine.connect() as conn:
+                                try:
+                                    conn.execute(text("ALTER TABLE contact ADD COLUMN unread_count INTEGER DEFAULT 0"))
+                                    conn.execute(text("ALTER TABLE contact ADD COLUMN unread_tab VARCHAR(20)"))
+                                    conn.commit()
+                                except: pass
+                            # Seed the incremental counters once from existing messages
+                            from services.whatsapp_service import WhatsAppService
+                            WhatsAppService.recount_unread()
+                except Exception as wa_mig_e:
+                    print(f"⚠️ WhatsApp Migration Error: {wa_mig_e}")
+
+                # 10. INDEX REPAIR (create_all only builds indexes together with brand-new tables)
+                try:
+                    from sqlalchemy import inspect
+                    inspector = inspect(db.engine)
+                    for table in db.metadata.sorted_tables:
+                        if not table.indexes or not inspector.has_table(table.name):
+                            continue
+                        for index in table.indexes:
+                            try: index.create(bind=db.engine, checkfirst=True)
+                            except Exception as idx_e: print(f"⚠️ Index {index.name}: {idx_e}")
+                except Exception as idx_mig_e:
+                    print(f"⚠️ Index Migration Error: {idx_mig_e}")
+
             except Exception as context_e:
                 print(f"❌ Startup Context Error: {context_e}")
 
@@ -0,0 +1,40 @@
+from models import db, Contract
+
+# Contract.installment_value is the typed copy of form_data['valor_parcela'] used by the
+# financial/goals aggregates. Fills contracts saved before the column existed. Safe to run multiple times.
+
+BATCH_SIZE = 500
+
+def backfill():
+    print("Backfilling contract installment values...")
+    updated = 0
+    last_id = 0
+
+    while True:
+        rows = db.session.query(Contract.id, Contract.form_data).filter(
+            Contract.id > last_id,
+            Contract.installment_value == None,
+            Contract.form_data != None
+        ).order_by(Contract.id).limit(BATCH_SIZE).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        mappings = []
+        for r in rows:
+            value = Contract.installment_value_from_form_data(r.form_data)
+            if value is not None:
+                mappings.append({'id': r.id, 'installment_value': value})
+
+        if mappings:
+            db.session.bulk_update_mappings(Contract, mappings)
+            db.session.commit()
+            updated += len(mappings)
+
+    print(f"Backfill complete. Contracts updated: {updated}")
+    return updated
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        backfill()
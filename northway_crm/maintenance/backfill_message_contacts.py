@@ -0,0 +1,71 @@
+from sqlalchemy import text
+from app import db
+import uuid
+from datetime import datetime
+
+# Thread history is read by contact_uuid (see WhatsAppService.get_thread_messages); the
+# lead_id / client_id / phone fallback only runs while a thread has unlinked rows.
+# Links legacy messages that were saved without it. Safe to run multiple times.
+
+LINK_FROM_CLIENT = """
+    UPDATE whats_app_message SET contact_uuid = (
+        SELECT client.contact_uuid FROM client WHERE client.id = whats_app_message.client_id
+    )
+    WHERE contact_uuid IS NULL AND client_id IS NOT NULL
+"""
+
+LINK_FROM_LEAD = """
+    UPDATE whats_app_message SET contact_uuid = (
+        SELECT lead.contact_uuid FROM lead WHERE lead.id = whats_app_message.lead_id
+    )
+    WHERE contact_uuid IS NULL AND lead_id IS NOT NULL
+"""
+
+LINK_FROM_PHONE = """
+    UPDATE whats_app_message SET contact_uuid = (
+        SELECT contact.uuid FROM contact
+        WHERE contact.company_id = whats_app_message.company_id AND contact.phone = whats_app_message.phone
+        LIMIT 1
+    )
+    WHERE contact_uuid IS NULL AND phone IS NOT NULL
+"""
+
+def backfill():
+    print("Linking WhatsApp messages to contacts...")
+    connection = db.engine.connect()
+    trans = connection.begin()
+
+    try:
+        for label, sql in [('client', LINK_FROM_CLIENT), ('lead', LINK_FROM_LEAD), ('phone', LINK_FROM_PHONE)]:
+            res = connection.execute(text(sql))
+            print(f"  via {label}: {res.rowcount} rows")
+
+        # Phones with no Contact yet: create one per (company, phone) and link again
+        orphans = connection.execute(text("""
+            SELECT DISTINCT company_id, phone FROM whats_app_message
+            WHERE contact_uuid IS NULL AND phone IS NOT NULL
+        """)).mappings().all()
+
+        for o in orphans:
+            connection.execute(
+                text("INSERT INTO contact (uuid, company_id, phone, created_at) VALUES (:uuid, :cid, :phone, :now)"),
+                {"uuid": str(uuid.uuid4()), "cid": o['company_id'], "phone": o['phone'], "now": datetime.utcnow()}
+            )
+        if orphans:
+            res = connection.execute(text(LINK_FROM_PHONE))
+            print(f"  created {len(orphans)} contacts, linked {res.rowcount} rows")
+
+        remaining = connection.execute(text("SELECT COUNT(*) FROM whats_app_message WHERE contact_uuid IS NULL")).scalar()
+        trans.commit()
+        print(f"Backfill complete. Unlinked messages left: {remaining}")
+    except Exception as e:
+        trans.rollback()
+        print(f"Backfill failed: {e}")
+        raise e
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        backfill()
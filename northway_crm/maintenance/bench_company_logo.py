@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import base64
+import shutil
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from flask import Flask
+from sqlalchemy import text
+from models import db, Company, User
+from services.company_logo_service import CompanyLogoService
+
+# Company logo: base64 in the Company row (legacy, loaded with every current_user.company)
+# vs content-addressed storage (Company.logo_key). Measures the row size, the per-request
+# cost of loading the user's company, and logo serving with the thumbnail cache.
+# Usage: python maintenance/bench_company_logo.py [logo_path] [requests]
+
+
+def row_bytes(company_id):
+    columns = [c.name for c in Company.__table__.columns]
+    expr = ' + '.join(f"coalesce(length({c}), 0)" for c in columns)
+    return db.session.execute(text(f"SELECT {expr} FROM company WHERE id = :id"), {'id': company_id}).scalar()
+
+
+def per_request(user_id, requests, undefer_logo):
+    """What every request does: load the user, then current_user.company (new session each time)."""
+    options = [db.undefer(Company.logo_base64)] if undefer_logo else []
+    for _ in range(20): # Warm up statement caches so both variants compare steady state
+        db.session.remove()
+        Company.query.options(*options).filter_by(id=db.session.get(User, user_id).company_id).first()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(requests):
+        db.session.remove()
+        user = db.session.get(User, user_id)
+        company = Company.query.options(*options).filter_by(id=user.company_id).first()
+        company.name
+    elapsed = (time.perf_counter() - start) / requests
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def timed(fn, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = fn()
+    return (time.perf_counter() - start) / runs, result
+
+
+def main(logo_path, requests):
+    workdir = tempfile.mkdtemp(prefix='bench_logo_')
+    app = Flask(__name__, root_path=ROOT)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{workdir}/bench.db"
+    app.config['COMPANY_UPLOAD_FOLDER'] = os.path.join(workdir, 'company')
+    db.init_app(app)
+    from routes.branding import branding_bp
+    app.register_blueprint(branding_bp)
+
+    with open(logo_path, 'rb') as f:
+        logo = f.read()
+
+    with app.app_context():
+        db.create_all()
+        company = Company(name='Empresa Bench Ltda', logo_base64=base64.b64encode(logo).decode())
+        db.session.add(company)
+        db.session.commit()
+        user = User(name='Bench', email='bench@example.com', password_hash='-', company_id=company.id, role='admin')
+        db.session.add(user)
+        db.session.commit()
+        company_id, user_id = company.id, user.id
+
+        print(f"Logo: {logo_path} ({len(logo) / 1024:.0f} KB), {requests} requests")
+        legacy_row = row_bytes(company_id)
+        legacy_s, legacy_peak = per_request(user_id, requests, undefer_logo=True)
+
+        company = db.session.get(Company, company_id)
+        CompanyLogoService.store(company, logo, 'png')
+        company.logo_base64 = None # Row state after a successful bucket upload (no bucket here)
+        db.session.commit()
+        key = db.session.get(Company, company_id).logo_key
+        new_row = row_bytes(company_id)
+        new_s, new_peak = per_request(user_id, requests, undefer_logo=False)
+
+        print("Company row:")
+        print(f"  base64 in row      {legacy_row / 1024:8.1f} KB")
+        print(f"  logo_key           {new_row / 1024:8.1f} KB  ({legacy_row / new_row:.0f}x smaller)")
+        print("Per request (load user + company):")
+        print(f"  base64 in row      {legacy_s * 1000:8.3f} ms  peak {legacy_peak / 1024:8.1f} KB")
+        print(f"  logo_key           {new_s * 1000:8.3f} ms  peak {new_peak / 1024:8.1f} KB")
+
+        client = app.test_client()
+        url = f"/branding/logos/{company_id}/{key}"
+        response = client.get(url)
+        print(f"Serving {url[:40]}...:")
+        print(f"  original           {len(response.data) / 1024:8.1f} KB  Cache-Control: {response.headers['Cache-Control']}")
+        revalidated = client.get(url, headers={'If-None-Match': f'"{key}"'})
+        print(f"  If-None-Match      status {revalidated.status_code}")
+
+        thumb = client.get(url + '?w=160')
+        print(f"  thumbnail 160px    {len(thumb.data) / 1024:8.1f} KB  ({thumb.mimetype})")
+        thumb_path = CompanyLogoService._local_path(company_id, key, 160)
+
+        def cold():
+            CompanyLogoService._thumbs.clear()
+            if os.path.exists(thumb_path):
+                os.remove(thumb_path)
+            return CompanyLogoService.thumbnail(company_id, key, 160)
+
+        def disk():
+            CompanyLogoService._thumbs.clear()
+            return CompanyLogoService.thumbnail(company_id, key, 160)
+
+        cold_s, _ = timed(cold, 20)
+        disk_s, _ = timed(disk, 200)
+        memory_s, _ = timed(lambda: CompanyLogoService.thumbnail(company_id, key, 160), 2000)
+        print(f"  thumbnail resize   {cold_s * 1000:8.3f} ms")
+        print(f"  thumbnail disk     {disk_s * 1000:8.3f} ms")
+        print(f"  thumbnail LRU      {memory_s * 1000:8.3f} ms")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, 'static', 'images', 'logo.png')
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    main(path, count)
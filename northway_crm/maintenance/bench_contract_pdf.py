@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'vendor')) # Same fpdf2 as the deployed bundle
+
+from flask import Flask
+import services.pdf_service as pdf_service
+from services.pdf_service import ContractPDF, HeaderLogoCache, PdfService
+
+# Multi-page contract rendering: header logo probed + decoded per document/page (legacy)
+# vs HeaderLogoCache (resolved once per process, decoded image seeded into each document).
+# Usage: python maintenance/bench_contract_pdf.py [clauses] [documents]
+# Defaults to ~30 pages per contract.
+
+
+class LegacyHeaderPDF(ContractPDF):
+    """Previous behaviour: every page probes the candidate paths again."""
+    def header(self):
+        HeaderLogoCache._paths.clear()
+        HeaderLogoCache.resolve(pdf_service.current_app.root_path)
+        super().header()
+
+
+def build_contract(n_clauses):
+    clauses = ''.join(
+        f"<h3>CLÁUSULA {i + 1} - DAS OBRIGAÇÕES</h3>"
+        f"<p>A CONTRATADA se obriga a prestar os serviços descritos neste instrumento com zelo e diligência, "
+        f"observando os prazos acordados, as normas técnicas aplicáveis e a legislação vigente. "
+        f"O descumprimento desta cláusula sujeita a parte infratora às penalidades previstas.</p>"
+        for i in range(n_clauses)
+    )
+    company = SimpleNamespace(name='Empresa Bench Ltda', document='00.000.000/0001-00')
+    return SimpleNamespace(id=1, code='CTR-BENCH-0001', company=company, generated_content=clauses)
+
+
+def render(contract, legacy):
+    original = pdf_service.ContractPDF
+    if legacy:
+        pdf_service.ContractPDF = LegacyHeaderPDF
+        HeaderLogoCache._infos.clear() # Logo decoded again for every document
+    try:
+        return PdfService.generate_pdf(contract)
+    finally:
+        pdf_service.ContractPDF = original
+
+
+def headers_only(pages, legacy):
+    """Just the per-page header work: blank pages, no body."""
+    if legacy:
+        HeaderLogoCache._infos.clear()
+    pdf = (LegacyHeaderPDF if legacy else ContractPDF)('CTR-BENCH-0001', 'EMPRESA BENCH LTDA')
+    for _ in range(pages):
+        pdf.add_page()
+    return bytes(pdf.output())
+
+
+def timed_headers(pages, documents, legacy):
+    start = time.perf_counter()
+    for _ in range(documents):
+        headers_only(pages, legacy)
+    return (time.perf_counter() - start) / documents
+
+
+def timed(contract, documents, legacy):
+    start = time.perf_counter()
+    for _ in range(documents):
+        data = render(contract, legacy)
+    return (time.perf_counter() - start) / documents, data
+
+
+def main(n_clauses, documents):
+    app = Flask(__name__, root_path=ROOT)
+    contract = build_contract(n_clauses)
+
+    with app.app_context():
+        print(f"Logo: {HeaderLogoCache.resolve(app.root_path)}")
+        pdf = ContractPDF('x')
+        pdf.add_page()
+        pdf.write_html(contract.generated_content)
+        print(f"Contract: {n_clauses} clauses, {pdf.page} pages, {documents} documents")
+
+        render(contract, legacy=False) # Warm-up (imports, fonts)
+        header_legacy_s = timed_headers(pdf.page, documents, legacy=True)
+        header_cached_s = timed_headers(pdf.page, documents, legacy=False)
+        legacy_s, legacy_pdf = timed(contract, documents, legacy=True)
+        cached_s, cached_pdf = timed(contract, documents, legacy=False)
+
+        print(f"Headers only ({pdf.page} pages):")
+        print(f"  per-page probe + per-document decode  {header_legacy_s * 1000:8.1f} ms/document")
+        print(f"  HeaderLogoCache                       {header_cached_s * 1000:8.1f} ms/document  ({header_legacy_s / header_cached_s:.1f}x)")
+        print("Full contract:")
+        print(f"  per-page probe + per-document decode  {legacy_s * 1000:8.1f} ms/document  ({len(legacy_pdf) / 1024:.0f} KB)")
+        print(f"  HeaderLogoCache                       {cached_s * 1000:8.1f} ms/document  ({len(cached_pdf) / 1024:.0f} KB)")
+        print(f"  speedup {legacy_s / cached_s:.2f}x, same size: {len(legacy_pdf) == len(cached_pdf)}")
+
+
+if __name__ == '__main__':
+    clauses = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    main(clauses, count)
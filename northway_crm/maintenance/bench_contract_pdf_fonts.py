@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+from html import unescape
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'vendor')) # Same fpdf2 as the deployed bundle
+
+from flask import Flask
+from services.pdf_service import ContractHTML2FPDF, PdfFontManager, PdfService
+
+# Contract PDF fonts: core Helvetica with Latin-1 coercion (legacy) vs the full DejaVu TTF
+# registered per document vs PdfFontManager (per-charset subset, cached on disk).
+# Usage: python maintenance/bench_contract_pdf_fonts.py [clauses] [documents]
+
+
+def build_contract(n_clauses):
+    clauses = ''.join(
+        f"<h3>CLÁUSULA {i + 1} – DAS OBRIGAÇÕES</h3>"
+        f"<p>A CONTRATADA se obriga a prestar os “serviços” descritos neste instrumento com zelo e diligência, "
+        f"observando os prazos acordados — inclusive o valor de R$ 1.500,00 (€ 250,00 para itens importados) — "
+        f"e a legislação vigente…</p><ul><li>Entrega mensal ✓</li><li>Multa de 2% ≤ 10 dias</li></ul>"
+        for i in range(n_clauses)
+    )
+    company = SimpleNamespace(name='Empresa Bench Ltda', document='00.000.000/0001-00')
+    return SimpleNamespace(id=1, code='CTR-BENCH-0001', company=company, generated_content=clauses)
+
+
+def render(contract, mode):
+    register, subset = PdfFontManager.register, PdfFontManager._subset
+    if mode == 'latin1':
+        PdfFontManager.register = staticmethod(lambda pdf, root_path, chars: None)
+    elif mode == 'full':
+        PdfFontManager._subset = staticmethod(lambda font_path, chars: font_path)
+    elif mode == 'cold':
+        PdfFontManager._subsets.clear()
+        shutil.rmtree(PdfFontManager._subset_folder(), ignore_errors=True)
+    try:
+        return PdfService.generate_pdf(contract)
+    finally:
+        PdfFontManager.register, PdfFontManager._subset = staticmethod(register), staticmethod(subset)
+
+
+def timed(contract, documents, mode):
+    start = time.perf_counter()
+    for _ in range(documents):
+        data = render(contract, mode)
+    return (time.perf_counter() - start) / documents, data
+
+
+def main(n_clauses, documents):
+    app = Flask(__name__, root_path=ROOT)
+    app.config['PDF_CACHE_FOLDER'] = tempfile.mkdtemp(prefix='bench_pdf_fonts_')
+    contract = build_contract(n_clauses)
+
+    with app.app_context():
+        print(f"Fonts: {PdfFontManager.resolve(app.root_path)}")
+        text = unescape(contract.generated_content)
+        lost = ContractHTML2FPDF.to_latin1(text).count('?') - text.count('?')
+        print(f"Contract: {n_clauses} clauses, {documents} documents, {lost} characters printed as '?' under Latin-1")
+
+        render(contract, 'cached') # Warm-up (imports, subset file)
+        rows = [
+            ('Helvetica + Latin-1 coercion', 'latin1'),
+            ('full DejaVu TTF per document', 'full'),
+            ('PdfFontManager, subset miss', 'cold'),
+            ('PdfFontManager, subset cached', 'cached'),
+        ]
+        base_s = None
+        for label, mode in rows:
+            seconds, data = timed(contract, documents, mode)
+            base_s = base_s or seconds
+            print(f"  {label:30} {seconds * 1000:8.1f} ms/document  {len(data) / 1024:6.0f} KB  ({base_s / seconds:.2f}x)")
+
+    shutil.rmtree(app.config['PDF_CACHE_FOLDER'], ignore_errors=True)
+
+
+if __name__ == '__main__':
+    clauses = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    main(clauses, count)
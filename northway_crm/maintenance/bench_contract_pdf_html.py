@@ -0,0 +1,173 @@
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'vendor')) # Same fpdf2 as the deployed bundle
+
+from flask import Flask
+from fpdf.html import HTML2FPDF
+import services.pdf_service as pdf_service
+from services.pdf_service import ContractHTML2FPDF, ContractPDF, PdfFontManager, PdfService
+
+# Contract HTML normalization before fpdf parses it: legacy regex/str.replace passes over the
+# whole document vs ContractHTML2FPDF (normalized per token inside fpdf's own parser).
+# Checks first that both produce byte-identical PDFs, then measures throughput.
+# Usage: python maintenance/bench_contract_pdf_html.py [size_kb] [runs]
+
+FIXED_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# Inputs where both paths must agree (the legacy path also broke <pre> and quoted style widths)
+CASES = {
+    'paragraphs': '<p>Texto padrão.</p><p align="center">Centralizado</p><p class="x">Com classe</p>',
+    'headings_lists': '<h3>CLÁUSULA 1</h3><ul><li>Primeiro</li><li>Segundo</li></ul><ol><li>Um</li></ol>',
+    'images': '<p>Logo:</p><img src="/static/images/logo.png" width="80"><img src="/static/nao_existe.png">'
+              '<img src="data:image/png;base64,AAAA">',
+    'tables': '<table width="100%" border="1"><tr><th width="30%">Item</th><th>Valor</th></tr>'
+              '<tr><td width="70%">Serviço</td><td style="width: 30%;">R$ 10,00</td></tr></table>',
+    'style_widths': '<div style="width: 50%; text-align: right;">Assinatura</div>',
+    'typography': '<p>\u201cAspas\u201d \u2013 travessão \u2014 reticências\u2026 \u2022 marcador\u00a0nbsp\u200bzwsp \u2018simples\u2019</p>',
+    'emphasis': '<p><b>negrito</b> <i>itálico</i> <u>sublinhado</u> <strong><em>ambos</em></strong></p>',
+}
+
+
+def legacy_normalize(html, latin1):
+    """Previous generate_pdf preprocessing, verbatim."""
+    def replace_img_src(match):
+        full_tag = match.group(0)
+        src_match = re.search(r'src=["\']([^"\']+)["\']', full_tag)
+        if src_match:
+            original_src = src_match.group(1)
+            abs_path = PdfService._resolve_img_path(original_src)
+            if abs_path:
+                return full_tag.replace(original_src, abs_path)
+        return ""
+
+    html = re.sub(r'<img[^>]+>', replace_img_src, html, flags=re.IGNORECASE)
+    if '<p' in html:
+        html = re.sub(r'<p([^>]*)>', r'<p align="justify"\1>', html, flags=re.IGNORECASE)
+    html = re.sub(r'(<table[^>]*?)\swidth="[^"]*"', r'\1', html, flags=re.IGNORECASE)
+    html = re.sub(r'(<td[^>]*?)\swidth="[^"]*"', r'\1', html, flags=re.IGNORECASE)
+    html = re.sub(r'(<th[^>]*?)\swidth="[^"]*"', r'\1', html, flags=re.IGNORECASE)
+    html = re.sub(r'width:\s*[^;"\']+[;"\']?', '', html, flags=re.IGNORECASE)
+    if latin1:
+        replacements = {
+            '\u2013': '-', '\u2014': '-',
+            '\u2018': "'", '\u2019': "'",
+            '\u201c': '"', '\u201d': '"',
+            '\u2022': '-', '\u2026': '...',
+            '\u00a0': ' ', '\u200b': '',
+        }
+        for src, dst in replacements.items():
+            html = html.replace(src, dst)
+        html = html.encode('latin-1', 'replace').decode('latin-1')
+    return html
+
+
+class FixedDatePDF(ContractPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.creation_date = FIXED_DATE
+
+
+class LegacyPDF(FixedDatePDF):
+    """Plain fpdf parser: expects HTML already normalized by legacy_normalize()."""
+    HTML2FPDF_CLASS = HTML2FPDF
+
+    def write_html(self, text, *args, **kwargs):
+        if self.font_name != 'Helvetica':
+            kwargs.setdefault('ul_bullet_char', '\u2022')
+        return super().write_html(text, *args, **kwargs)
+
+
+def render(content, legacy, latin1):
+    register = PdfFontManager.register
+    if latin1:
+        PdfFontManager.register = staticmethod(lambda pdf, root_path, chars: None)
+    pdf_service.ContractPDF = LegacyPDF if legacy else FixedDatePDF
+    if legacy:
+        content = legacy_normalize(content, latin1)
+    company = SimpleNamespace(name='Empresa Bench Ltda', document='00.000.000/0001-00')
+    contract = SimpleNamespace(id=1, code='CTR-BENCH-0001', company=company, generated_content=content)
+    try:
+        return PdfService.generate_pdf(contract)
+    finally:
+        pdf_service.ContractPDF = ContractPDF
+        PdfFontManager.register = staticmethod(register)
+
+
+class HookOnlyParser(HTMLParser):
+    """Tokenizer + ContractHTML2FPDF's per-token work, without fpdf layout."""
+    def __init__(self, latin1):
+        super().__init__()
+        self.latin1 = latin1
+
+    def handle_starttag(self, tag, attrs):
+        ContractHTML2FPDF.normalize_attrs(tag, attrs)
+
+    def handle_data(self, data):
+        if self.latin1:
+            ContractHTML2FPDF.to_latin1(data)
+
+
+class TokenizeOnlyParser(HTMLParser):
+    pass
+
+
+def build_contract(size_kb):
+    block = ''.join(CASES[name] for name in ('paragraphs', 'tables', 'style_widths', 'typography', 'emphasis'))
+    block += '<p>A CONTRATADA se obriga a prestar os serviços descritos neste instrumento com zelo.</p>' * 4
+    return block * max(1, size_kb * 1024 // len(block))
+
+
+def timed(fn, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = fn()
+    return (time.perf_counter() - start) / runs, result
+
+
+def main(size_kb, runs):
+    app = Flask(__name__, root_path=ROOT)
+    app.config['PDF_CACHE_FOLDER'] = '/tmp/pdf_cache'
+
+    with app.app_context():
+        print("Equivalence (byte-identical PDFs):")
+        failures = 0
+        for name, html in CASES.items():
+            for latin1 in (False, True):
+                same = render(html, True, latin1) == render(html, False, latin1)
+                failures += not same
+                print(f"  {name:15} {'helvetica' if latin1 else 'unicode':9} {'ok' if same else 'DIFFERENT'}")
+
+        content = build_contract(size_kb)
+        size_mb = len(content.encode('utf-8')) / 1024 / 1024
+        print(f"Throughput: {len(content) / 1024:.0f} KB contract, {runs} runs")
+
+        tokenize_s, _ = timed(lambda: TokenizeOnlyParser().feed(content), runs)
+        print(f"  fpdf's HTML tokenizer alone     {tokenize_s * 1000:8.1f} ms  (paid by both paths)")
+        for latin1 in (False, True):
+            label = 'helvetica' if latin1 else 'unicode'
+            legacy_s, _ = timed(lambda: legacy_normalize(content, latin1), runs)
+            hooks_s, _ = timed(lambda: HookOnlyParser(latin1).feed(content), runs)
+            hook_cost = max(hooks_s - tokenize_s, 1e-9)
+            print(f"  {label:9} legacy passes         {legacy_s * 1000:8.1f} ms  ({size_mb / legacy_s:6.1f} MB/s)")
+            print(f"  {label:9} per-token hooks       {hook_cost * 1000:8.1f} ms  ({size_mb / hook_cost:6.1f} MB/s)")
+
+        full_legacy_s, legacy_pdf = timed(lambda: render(content, True, False), 1)
+        full_hooks_s, hooks_pdf = timed(lambda: render(content, False, False), 1)
+        print(f"  full render legacy              {full_legacy_s * 1000:8.1f} ms")
+        print(f"  full render ContractHTML2FPDF   {full_hooks_s * 1000:8.1f} ms  (same PDF: {legacy_pdf == hooks_pdf})")
+
+    return failures
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    sys.exit(1 if main(size, count) else 0)
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import random
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.template_engine import CompiledTemplate
+
+# Contract rendering: one str.replace pass per replacement key (legacy) vs CompiledTemplate
+# (tokenized once, one join per render).
+# Usage: python maintenance/bench_contract_templates.py [clauses] [renders]
+
+N_KEYS = 120 # Size of get_contract_replacements()
+
+
+def build(n_clauses):
+    replacements = {f"{{{{CAMPO_{i}}}}}": f"Valor do campo {i} - Empresa Ltda" for i in range(N_KEYS)}
+    keys = list(replacements)
+    paragraphs = []
+    for i in range(n_clauses):
+        used = ' '.join(random.sample(keys, 3))
+        paragraphs.append(
+            f"<h3>CLÁUSULA {i + 1}</h3><p>O CONTRATANTE {used} declara estar ciente das condições "
+            f"descritas neste instrumento, incluindo prazos, valores e obrigações das partes.</p>"
+        )
+    paragraphs.append("<p>{{CAMPO_INEXISTENTE}}</p>")
+    return ''.join(paragraphs), replacements
+
+
+def legacy(content, replacements):
+    for key, value in replacements.items():
+        content = content.replace(key, str(value))
+    return content
+
+
+def timed(fn, renders):
+    start = time.perf_counter()
+    for _ in range(renders):
+        result = fn()
+    return (time.perf_counter() - start) / renders, result
+
+
+def main(n_clauses, renders):
+    content, replacements = build(n_clauses)
+    print(f"Template: {len(content) / 1024:.0f} KB, {N_KEYS} replacement keys, {renders} renders")
+
+    legacy_s, legacy_out = timed(lambda: legacy(content, replacements), renders)
+    cold_s, _ = timed(lambda: CompiledTemplate(content).render(replacements), renders)
+    compiled = CompiledTemplate(content)
+    warm_s, compiled_out = timed(lambda: compiled.render(replacements), renders)
+
+    print(f"  str.replace x{N_KEYS}  {legacy_s * 1000:8.3f} ms/render")
+    print(f"  compile + render  {cold_s * 1000:8.3f} ms/render  (cache miss)")
+    print(f"  render (cached)   {warm_s * 1000:8.3f} ms/render  ({legacy_s / warm_s:.1f}x)")
+    print(f"  identical output: {legacy_out == compiled_out}")
+    print(f"  unknown placeholders: {compiled.unknown_placeholders(replacements)}")
+
+
+if __name__ == '__main__':
+    clauses = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    main(clauses, count)
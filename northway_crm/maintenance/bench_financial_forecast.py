@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import random
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func, extract, case
+from models import db, Company, Client, Contract, ContractTemplate, Transaction
+from routes.financial import add_months
+
+# Forecast section of financial.stats(): legacy (Python buckets + 12 monthly SUMs)
+# vs conditional aggregate + one grouped range scan.
+# Usage: python maintenance/bench_financial_forecast.py [transactions] [database_url]
+# Defaults to a throwaway SQLite file; pass a Postgres URL to benchmark the real planner.
+
+
+def seed(company_id, n_transactions):
+    template = ContractTemplate(name='Bench', content='-', company_id=company_id)
+    client = Client(name='Bench Client', company_id=company_id, account_manager_id=1)
+    db.session.add_all([template, client])
+    db.session.flush()
+
+    contracts = []
+    for _ in range(max(n_transactions // 12, 1)):
+        contracts.append(Contract(client_id=client.id, company_id=company_id, template_id=template.id, status='active', form_data='{}'))
+    db.session.add_all(contracts)
+    db.session.flush()
+
+    today = date.today()
+    rows = []
+    for i in range(n_transactions):
+        rows.append({
+            'contract_id': contracts[i % len(contracts)].id,
+            'client_id': client.id,
+            'company_id': company_id,
+            'description': f"Parcela {i % 12 + 1}/12",
+            'amount': round(random.uniform(100, 5000), 2),
+            'due_date': today + timedelta(days=random.randint(-365, 730)),
+            'status': random.choice(['pending', 'pending', 'paid', 'cancelled'])
+        })
+    db.session.bulk_insert_mappings(Transaction, rows)
+    db.session.commit()
+
+
+def legacy(company_id, today):
+    forecast = [0, 0, 0]
+    for t in Transaction.query.filter(
+        Transaction.company_id == company_id,
+        Transaction.status == 'pending',
+        Transaction.due_date >= today
+    ).all():
+        days_diff = (t.due_date - today).days
+        for i, limit in enumerate((30, 60, 90)):
+            if days_diff <= limit:
+                forecast[i] += t.amount
+
+    chart = []
+    for i in range(12):
+        future_date = add_months(today, i)
+        chart.append(db.session.query(func.sum(Transaction.amount)).join(Contract).filter(
+            Contract.company_id == company_id,
+            Transaction.status == 'pending',
+            extract('month', Transaction.due_date) == future_date.month,
+            extract('year', Transaction.due_date) == future_date.year
+        ).scalar() or 0)
+    return forecast, chart
+
+
+def aggregated(company_id, today):
+    horizon = [today + timedelta(days=d) for d in (30, 60, 90)]
+    forecast = list(db.session.query(*[
+        func.coalesce(func.sum(case((Transaction.due_date <= limit, Transaction.amount), else_=0)), 0)
+        for limit in horizon
+    ]).filter(
+        Transaction.company_id == company_id,
+        Transaction.status == 'pending',
+        Transaction.due_date.between(today, horizon[-1])
+    ).one())
+
+    first_day_month = today.replace(day=1)
+    due_year = extract('year', Transaction.due_date)
+    due_month = extract('month', Transaction.due_date)
+    sums = {(int(y), int(m)): total or 0 for y, m, total in db.session.query(
+        due_year, due_month, func.sum(Transaction.amount)
+    ).filter(
+        Transaction.company_id == company_id,
+        Transaction.contract_id.isnot(None),
+        Transaction.status == 'pending',
+        Transaction.due_date.between(first_day_month, add_months(first_day_month, 12) - timedelta(days=1))
+    ).group_by(due_year, due_month).all()}
+    chart = [sums.get((m.year, m.month), 0) for m in (add_months(first_day_month, i) for i in range(12))]
+    return forecast, chart
+
+
+def timed(fn, *args, runs=5):
+    best, result = None, None
+    for _ in range(runs):
+        db.session.expire_all()
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(n_transactions, database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        company = Company(name='Bench Forecast')
+        db.session.add(company)
+        db.session.commit()
+
+        print(f"Seeding {n_transactions} transactions...")
+        seed(company.id, n_transactions)
+
+        today = date.today()
+        legacy_s, (legacy_buckets, legacy_chart) = timed(legacy, company.id, today)
+        new_s, (new_buckets, new_chart) = timed(aggregated, company.id, today)
+
+        print(f"  legacy      {legacy_s * 1000:8.1f} ms  (1 row fetch + 12 SUM queries)")
+        print(f"  aggregated  {new_s * 1000:8.1f} ms  (2 queries)")
+        print(f"  speedup     {legacy_s / new_s:8.1f}x")
+
+        same_buckets = all(abs(a - b) < 0.01 for a, b in zip(legacy_buckets, new_buckets))
+        same_chart = all(abs(a - b) < 0.01 for a, b in zip(legacy_chart, new_chart))
+        print(f"  buckets match: {same_buckets}, chart matches: {same_chart}")
+
+        if database_url.startswith('postgres'):
+            Transaction.query.filter_by(company_id=company.id).delete()
+            Contract.query.filter_by(company_id=company.id).delete()
+            Client.query.filter_by(company_id=company.id).delete()
+            ContractTemplate.query.filter_by(company_id=company.id).delete()
+            db.session.delete(company)
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    url = sys.argv[2] if len(sys.argv) > 2 else 'sqlite:////tmp/bench_financial_forecast.db'
+    if url.startswith('sqlite:///') and os.path.exists(url[len('sqlite:///'):]):
+        os.remove(url[len('sqlite:///'):])
+    main(count, url)
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import base64
+import shutil
+import resource
+import tempfile
+import subprocess
+
+# Peak RSS of the outgoing media path for a large upload.
+#   legacy: read() + base64 data URI + JSON body (what send_message did before)
+#   stream: chunked copy to a temp file, then chunked read as the storage client does
+# Usage: python maintenance/bench_media_upload.py [size_mb]
+
+CHUNK = 1024 * 1024
+
+
+def make_upload(size_mb):
+    # Werkzeug spools large uploads to an anonymous temp file; mimic that
+    f = tempfile.TemporaryFile()
+    block = os.urandom(CHUNK)
+    for _ in range(size_mb):
+        f.write(block)
+    f.seek(0)
+    return f
+
+
+def run_legacy(upload):
+    data = upload.read()
+    b64 = "data:video/mp4;base64,{}".format(base64.b64encode(data).decode('utf-8'))
+    body = json.dumps({"phone": "5511999999999", "document": b64})
+    return len(body)
+
+
+def run_stream(upload):
+    with tempfile.NamedTemporaryFile() as tmp:
+        shutil.copyfileobj(upload, tmp, CHUNK)
+        tmp.flush()
+        sent = 0
+        with open(tmp.name, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sent += len(chunk)
+        return sent
+
+
+def child(mode, size_mb):
+    upload = make_upload(size_mb)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    (run_legacy if mode == 'legacy' else run_stream)(upload)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'mode': mode, 'baseline_kb': baseline, 'peak_kb': peak}))
+
+
+def main(size_mb):
+    print(f"Upload size: {size_mb} MB")
+    for mode in ('legacy', 'stream'):
+        out = subprocess.run([sys.executable, __file__, '--child', mode, str(size_mb)], capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout)
+        print(f"  {mode:<7} peak RSS {r['peak_kb'] / 1024:7.1f} MB  (+{(r['peak_kb'] - r['baseline_kb']) / 1024:.1f} MB over baseline)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 15)
@@ -0,0 +1,204 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# In-memory stand-in for the Asaas v3 API (customers, payments, subscriptions, invoices, webhooks)
+# with fault injection, for running the CRM or AsaasClient against it locally.
+#
+#   python maintenance/fake_asaas_server.py [port] [--fail-rate 0.2] [--rate-limit 30] [--latency-ms 50]
+#       then start the app with ASAAS_API_URL=http://127.0.0.1:<port>
+#   python maintenance/fake_asaas_server.py --check
+#       runs AsaasClient against a throwaway instance: retries, Retry-After, customer cache, idempotency
+
+
+class FakeAsaas:
+    def __init__(self, fail_rate=0.0, rate_limit=0, latency_ms=0):
+        self.fail_rate = fail_rate # Share of requests answered with HTTP 500
+        self.rate_limit = rate_limit # Requests per 60s window before HTTP 429 (0 = unlimited)
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.fail_next = [] # Forced statuses for the next requests, e.g. [500, 429]
+        self.requests = [] # (method, path)
+        self.data = {'customers': {}, 'payments': {}, 'subscriptions': {}, 'invoices': {}, 'webhooks': {}}
+        self.seq = 0
+
+    def new_id(self, prefix):
+        self.seq += 1
+        return f"{prefix}_{self.seq:06d}"
+
+    def rate_headers(self):
+        if not self.rate_limit:
+            return {}
+        reset = max(int(60 - (time.monotonic() - self.window_start)), 0)
+        return {'RateLimit-Limit': str(self.rate_limit), 'RateLimit-Remaining': str(max(self.rate_limit - self.window_count, 0)),
+                'RateLimit-Reset': str(reset)}
+
+    def handle(self, method, path, query, body):
+        """Returns (status, payload, headers)."""
+        with self.lock:
+            self.requests.append((method, path))
+            if time.monotonic() - self.window_start >= 60:
+                self.window_start, self.window_count = time.monotonic(), 0
+            self.window_count += 1
+
+            if self.fail_next:
+                status = self.fail_next.pop(0)
+                return status, {'errors': [{'description': f'Injected {status}'}]}, {'Retry-After': '0'} if status == 429 else {}
+            if self.rate_limit and self.window_count > self.rate_limit:
+                return 429, {'errors': [{'description': 'Too many requests'}]}, self.rate_headers()
+            if self.fail_rate and random.random() < self.fail_rate:
+                return 500, {'errors': [{'description': 'Injected failure'}]}, {}
+
+            parts = path.strip('/').split('/')
+            collection = parts[0] if parts else ''
+            if collection not in self.data:
+                return 404, {'errors': [{'description': 'Not found'}]}, {}
+            store = self.data[collection]
+            headers = self.rate_headers()
+
+            if len(parts) == 1 and method == 'GET':
+                items = list(store.values())
+                filters = {'cpfCnpj': 'cpfCnpj', 'externalReference': 'externalReference', 'payment': 'payment'}
+                for param, field in filters.items():
+                    if param in query:
+                        items = [i for i in items if str(i.get(field)) == query[param][0]]
+                return 200, {'object': 'list', 'totalCount': len(items), 'data': items}, headers
+
+            if len(parts) == 1 and method == 'POST':
+                obj = dict(body or {}, id=self.new_id(collection[:3]), deleted=False)
+                if collection == 'payments':
+                    obj['invoiceUrl'] = f"https://fake.asaas/i/{obj['id']}"
+                    obj['status'] = 'PENDING'
+                store[obj['id']] = obj
+                return 200, obj, headers
+
+            obj = store.get(parts[1])
+            if not obj:
+                return 404, {'errors': [{'description': 'Not found'}]}, headers
+            if len(parts) == 3 and parts[2] == 'payments':
+                items = [p for p in self.data['payments'].values() if p.get('subscription') == obj['id']]
+                return 200, {'object': 'list', 'totalCount': len(items), 'data': items}, headers
+            if len(parts) == 3 and parts[2] == 'cancel':
+                obj['status'] = 'CANCELED'
+                return 200, obj, headers
+            if method == 'GET':
+                return 200, obj, headers
+            if method == 'PUT':
+                obj.update(body or {})
+                return 200, obj, headers
+            if method == 'DELETE':
+                obj['deleted'] = True
+                return 200, {'deleted': True, 'id': obj['id']}, headers
+            return 405, {'errors': [{'description': 'Method not allowed'}]}, headers
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def _dispatch(self, method):
+            url = urlparse(self.path)
+            path = re.sub(r'^/api/v3', '', url.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'null') if length else None
+
+            if fake.latency_ms:
+                time.sleep(fake.latency_ms / 1000)
+            status, payload, headers = fake.handle(method, path, parse_qs(url.query), body)
+
+            raw = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(raw)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self): self._dispatch('GET')
+        def do_POST(self): self._dispatch('POST')
+        def do_PUT(self): self._dispatch('PUT')
+        def do_DELETE(self): self._dispatch('DELETE')
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=0, **options):
+    """Starts the fake server in a daemon thread; returns (server, fake, base_url)."""
+    fake = FakeAsaas(**options)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fake))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def check():
+    from services.asaas_client import AsaasClient
+    server, fake, base_url = serve()
+    client = AsaasClient('fake-key', base_url=base_url)
+    results = []
+
+    def expect(name, condition):
+        results.append(condition)
+        print(f"  {'ok  ' if condition else 'FAIL'} {name}")
+
+    # Customer cache: search + create once, then served from memory (digits-only key)
+    cid, err = client.get_or_create_customer('Cliente', 'c@x.com', '12.345.678/0001-90')
+    calls = len(fake.requests)
+    cid2, _ = client.get_or_create_customer('Cliente', 'c@x.com', '12345678000190')
+    expect('customer created and cached by CPF/CNPJ', cid and cid == cid2 and len(fake.requests) == calls)
+
+    # GET retried on 5xx
+    fake.fail_next = [500, 502]
+    data, err = client.call('GET', 'payments')
+    expect('GET retried after 500/502', data is not None)
+
+    # POST retried on 429 honoring Retry-After, not on 500
+    fake.fail_next = [429]
+    payment, err = client.call('POST', 'payments', json={'customer': cid, 'value': 10, 'externalReference': '1'})
+    expect('POST retried after 429', payment is not None)
+    fake.fail_next = [500]
+    before = len(fake.data['payments'])
+    payment, err = client.call('POST', 'payments', json={'customer': cid, 'value': 10, 'externalReference': '2'})
+    expect('POST not resent after 500', payment is None and len(fake.data['payments']) == before)
+
+    # Idempotency lookup by externalReference
+    data, _ = client.call('GET', 'payments', params={'externalReference': '1'})
+    expect('payment found by externalReference', data and data['totalCount'] == 1)
+
+    print(json.dumps(AsaasClient.metrics(), indent=2))
+    server.shutdown()
+    return all(results)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if '--check' in args:
+        sys.exit(0 if check() else 1)
+
+    def option(name, cast, default):
+        return cast(args[args.index(name) + 1]) if name in args else default
+
+    port = int(args[0]) if args and args[0].isdigit() else 8089
+    server, fake, base_url = serve(
+        port,
+        fail_rate=option('--fail-rate', float, 0.0),
+        rate_limit=option('--rate-limit', int, 0),
+        latency_ms=option('--latency-ms', int, 0)
+    )
+    print(f"Fake Asaas listening on {base_url} (ASAAS_API_URL={base_url})")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
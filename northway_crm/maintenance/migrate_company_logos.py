@@ -0,0 +1,36 @@
+from models import db, Company
+from services.company_logo_service import CompanyLogoService
+
+# Company.logo_base64 kept whole images in the Company row.
+# Uploads them to the logo bucket and clears the column only for logos the bucket accepted;
+# rows without a successful upload keep their base64 copy. Safe to run multiple times.
+# Usage: python maintenance/migrate_company_logos.py (needs Supabase storage configured)
+
+def migrate():
+    print("Moving company logos to storage...")
+    moved = 0
+
+    ids = [r.id for r in db.session.query(Company.id).filter(
+        Company.logo_base64 != None
+    ).order_by(Company.id).all()]
+
+    for company_id in ids:
+        company = db.session.get(Company, company_id)
+        try:
+            if CompanyLogoService.migrate_base64(company):
+                db.session.commit()
+                moved += 1
+            else:
+                db.session.rollback()
+                print(f"⚠️ Logo of company {company_id} kept in the database (storage upload unavailable)")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Logo of company {company_id} not moved: {e}")
+
+    print(f"Logo migration complete. Companies updated: {moved}")
+    return moved
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        migrate()
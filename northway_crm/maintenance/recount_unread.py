@@ -0,0 +1,11 @@
+from app import app
+from services.whatsapp_service import WhatsAppService
+
+# Contact.unread_count is maintained incrementally (webhook +1, mark_as_read resets).
+# Rebuilds every counter from whats_app_message in case they drifted. Safe to run multiple times.
+
+if __name__ == '__main__':
+    with app.app_context():
+        print("Recounting WhatsApp unread counters...")
+        WhatsAppService.recount_unread()
+        print("Done.")
@@ -0,0 +1,85 @@
+import sys
+import time
+import argparse
+from datetime import datetime
+from models import db, BillingEvent
+from services.billing_event_service import BillingEventService
+
+# Re-applies stored Asaas webhook payloads (BillingEvent) for recovery, e.g. after a bug in the
+# handlers or a restore. Events are processed in id order, in batches that load their transactions
+# and companies with one query each and commit once. Activation e-mails are not re-sent unless --notify.
+#
+#   python maintenance/replay_billing_events.py --status failed
+#   python maintenance/replay_billing_events.py --since 2026-01-01 --event PAYMENT_RECEIVED --dry-run
+#   python maintenance/replay_billing_events.py --ids 10 11 12 --include-processed
+
+BATCH_SIZE = 500
+
+
+def build_query(args):
+    query = BillingEvent.query
+    if args.ids:
+        query = query.filter(BillingEvent.id.in_(args.ids))
+    if args.since:
+        query = query.filter(BillingEvent.created_at >= datetime.strptime(args.since, '%Y-%m-%d'))
+    if args.until:
+        query = query.filter(BillingEvent.created_at < datetime.strptime(args.until, '%Y-%m-%d'))
+    if args.event:
+        query = query.filter(BillingEvent.event_type.in_(args.event))
+
+    statuses = list(args.status)
+    if args.include_processed:
+        statuses += ['processed', 'ignored']
+    return query.filter(BillingEvent.status.in_(statuses))
+
+
+def replay(args, app):
+    total = build_query(args).count()
+    print(f"Events to replay: {total}")
+    if args.dry_run or not total:
+        return {}
+
+    summary, done, last_id = {}, 0, 0
+    started = time.perf_counter()
+    while True:
+        ids = [r.id for r in build_query(args).filter(BillingEvent.id > last_id)
+               .with_entities(BillingEvent.id).order_by(BillingEvent.id).limit(args.batch_size).all()]
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        # Back to 'received' with a fresh attempt budget; process_batch claims them like the runner does
+        BillingEvent.query.filter(BillingEvent.id.in_(ids)).update(
+            {'status': 'received', 'attempts': 0, 'last_error': None}, synchronize_session=False)
+        db.session.commit()
+
+        for status, count in BillingEventService.process_batch(app, ids, notify=args.notify).items():
+            summary[status] = summary.get(status, 0) + count
+        done += len(ids)
+        db.session.expire_all()
+
+        elapsed = time.perf_counter() - started
+        print(f"  {done}/{total} ({done / elapsed:.0f} events/s) {summary}")
+
+    print(f"Replay complete: {summary}. NFS-e queued by these events are issued by the billing-events runner/cron.")
+    return summary
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Replay stored Asaas webhook events.')
+    parser.add_argument('--ids', type=int, nargs='+')
+    parser.add_argument('--since', help='AAAA-MM-DD (created_at >=)')
+    parser.add_argument('--until', help='AAAA-MM-DD (created_at <)')
+    parser.add_argument('--event', nargs='+', help='Event types, e.g. PAYMENT_RECEIVED')
+    parser.add_argument('--status', nargs='+', default=['failed', 'received'])
+    parser.add_argument('--include-processed', action='store_true', help='Also replay processed/ignored events')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--notify', action='store_true', help='Send activation e-mails again')
+    parser.add_argument('--dry-run', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        replay(parse_args(sys.argv[1:]), app)
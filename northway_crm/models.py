@@ -1,7 +1,11 @@
 from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
+from flask import current_app, has_app_context
 from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 import uuid
+import json
 
 def get_now_br():
     return datetime.utcnow() - timedelta(hours=3)
@@ -13,6 +17,8 @@ class Contact(db.Model):
     uuid = db.Column(db.String(36), unique=True, nullable=False) # UUID string
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
     phone = db.Column(db.String(50), nullable=False) # Canonical E.164
+    unread_count = db.Column(db.Integer, default=0) # Incoming WhatsApp messages not read yet
+    unread_tab = db.Column(db.String(20), nullable=True) # Inbox tab of the unread messages: lead, client, atendimento
     created_at = db.Column(db.DateTime, default=get_now_br)
     
     # Relationships
@@ -20,6 +26,11 @@ class Contact(db.Model):
     clients = db.relationship('Client', backref='contact', lazy=True)
     messages = db.relationship('WhatsAppMessage', backref='contact', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_contact_company_phone', 'company_id', 'phone'),
+        db.Index('ix_contact_company_unread', 'company_id', 'unread_count'),
+    )
+
 # Enums (using simple strings for MVP sqlite compatibility/simplicity)
 ROLE_ADMIN = 'admin'
 ROLE_MANAGER = 'gestor'
@@ -57,7 +68,7 @@ class LibraryBook(db.Model):
     category = db.Column(db.String(50), default='Outros') # Apresentacao, Processos, Treinamento
     cover_image = db.Column(db.String(200), nullable=True) # URL or Filename
     route_name = db.Column(db.String(100), nullable=True) # For legacy static routes (e.g., 'docs.user_manual')
-    content = db.Column(db.Text, nullable=True) # HTML content for new books
+    content = db.deferred(db.Column(db.Text, nullable=True)) # HTML content for new books (loaded on access, not in lists)
     active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=get_now_br)
     
@@ -101,7 +112,7 @@ class Company(db.Model):
     
     # SaaS Subscription & Billing
     plan_id = db.Column(db.String(50), nullable=True) # UUID of the plan
-    asaas_customer_id = db.Column(db.String(50), nullable=True)
+    asaas_customer_id = db.Column(db.String(50), nullable=True, index=True) # Webhook lookup
     subscription_id = db.Column(db.String(50), nullable=True) # Asaas Subscription ID
     
     # Status Control
@@ -132,7 +143,8 @@ class Company(db.Model):
     
     # Branding
     logo_filename = db.Column(db.String(150), nullable=True)
-    logo_base64 = db.Column(db.Text, nullable=True) 
+    logo_base64 = db.deferred(db.Column(db.Text, nullable=True)) # Durable copy until the bucket upload succeeds (maintenance/migrate_company_logos.py)
+    logo_key = db.Column(db.String(80), nullable=True) # "<sha256>.<ext>" in logo storage (CompanyLogoService)
     primary_color = db.Column(db.String(7), default='#fa0102') 
     secondary_color = db.Column(db.String(7), default='#111827') 
     
@@ -462,11 +474,12 @@ class ContractTemplate(db.Model):
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.String(500), nullable=True)
     type = db.Column(db.String(20), default='contract') # contract, attachment, library_doc
-    content = db.Column(db.Text, nullable=False) # HTML/Text with {{variables}}
+    content = db.deferred(db.Column(db.Text, nullable=False)) # HTML/Text with {{variables}} (loaded on access, not in lists)
     active = db.Column(db.Boolean, default=True)
     is_global = db.Column(db.Boolean, default=False)
     is_library = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=get_now_br)
+    updated_at = db.Column(db.DateTime, default=get_now_br, onupdate=get_now_br) # Version key of the compiled template cache
     
     # Access Control Relationship
     allowed_companies = db.relationship('Company', secondary=template_company_association, backref=db.backref('accessible_templates', lazy='dynamic'))
@@ -479,8 +492,9 @@ class Contract(db.Model):
     
     code = db.Column(db.String(50), nullable=True) # Unique Identification Code (e.g. CTR-2024-001)
     
-    generated_content = db.Column(db.Text, nullable=True) # Nullable for drafts
-    form_data = db.Column(db.Text, nullable=True) # JSON store for draft inputs
+    # Heavy text columns are deferred: loaded on first access, or with db.undefer() for bulk reads
+    generated_content = db.deferred(db.Column(db.Text, nullable=True)) # Nullable for drafts
+    form_data = db.deferred(db.Column(db.Text, nullable=True)) # JSON store for draft inputs
     status = db.Column(db.String(20), default='draft') # draft, issued, signed
     contact_uuid = db.Column(db.String(36), db.ForeignKey('contact.uuid'), nullable=True)
     created_at = db.Column(db.DateTime, default=get_now_br)
@@ -499,6 +513,26 @@ class Contract(db.Model):
     nfse_iss_rate = db.Column(db.Float, nullable=True) # e.g 2.0 (%)
     nfse_desc = db.Column(db.String(255), nullable=True) # Description for the invoice
 
+    # Typed copy of form_data['valor_parcela'] for SQL aggregates (MRR, ticket, niches)
+    installment_value = db.Column(db.Numeric(12, 2), nullable=True)
+
+    # Content hash of the rendered PDF currently in the artifact store (see PdfArtifactService)
+    pdf_key = db.Column(db.String(64), nullable=True)
+
+    @staticmethod
+    def installment_value_from_form_data(form_data):
+        from utils import parse_brl_amount
+        try:
+            data = json.loads(form_data) if isinstance(form_data, str) else (form_data or {})
+            return parse_brl_amount(data.get('valor_parcela'))
+        except (ValueError, TypeError, AttributeError):
+            return None
+
+@event.listens_for(Contract.form_data, 'set')
+def _sync_contract_installment_value(target, value, oldvalue, initiator):
+    """Every create/autosave/issue path writes form_data; keep installment_value in step."""
+    target.installment_value = Contract.installment_value_from_form_data(value)
+
 class Integration(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
@@ -566,8 +600,41 @@ class WhatsAppMessage(db.Model):
     profile_pic_url = db.Column(db.String(500), nullable=True) # URL from webhook
     attachment_url = db.Column(db.String(1000), nullable=True) # Media URL (image, audio, etc.)
     contact_uuid = db.Column(db.String(36), db.ForeignKey('contact.uuid'), nullable=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('whats_app_campaign.id'), nullable=True) # Broadcast recipient row
+    attempts = db.Column(db.Integer, default=0) # Broadcast send attempts
     created_at = db.Column(db.DateTime, default=get_now_br)
 
+    # Thread history is paginated by (contact_uuid, id) keyset; the lead/client/phone indexes
+    # serve the legacy path for rows not yet linked to a Contact
+    __table_args__ = (
+        db.Index('ix_whatsapp_message_thread', 'company_id', 'contact_uuid', 'id'),
+        db.Index('ix_whatsapp_message_lead', 'company_id', 'lead_id', 'id'),
+        db.Index('ix_whatsapp_message_client', 'company_id', 'client_id', 'id'),
+        db.Index('ix_whatsapp_message_phone', 'company_id', 'phone', 'id'),
+        db.Index('ix_whatsapp_message_campaign', 'campaign_id', 'status'),
+    )
+
+class WhatsAppCampaign(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    name = db.Column(db.String(100), nullable=False)
+    message = db.Column(db.Text, nullable=False) # Supports {nome} placeholder
+    filters_json = db.Column(db.Text, nullable=True) # Saved lead filter: q, status, source, assigned_to, stage_id
+    status = db.Column(db.String(20), default='queued') # queued, running, paused, completed, cancelled
+    total_count = db.Column(db.Integer, default=0)
+    sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=get_now_br)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Runner lease: one process sends a campaign; locked_at is its heartbeat
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+    created_by = db.relationship('User', foreign_keys=[created_by_id])
+    recipients = db.relationship('WhatsAppMessage', backref='campaign', lazy='dynamic')
+
 class QuickMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
@@ -664,7 +731,7 @@ class Transaction(db.Model):
     created_at = db.Column(db.DateTime, default=get_now_br)
     
     # ASAAS Integration Fields
-    asaas_id = db.Column(db.String(50), nullable=True)
+    asaas_id = db.Column(db.String(50), nullable=True, index=True) # Webhook lookup
     asaas_invoice_url = db.Column(db.String(500), nullable=True)
     installment_number = db.Column(db.Integer, nullable=True)
     total_installments = db.Column(db.Integer, nullable=True)
@@ -677,10 +744,25 @@ class Transaction(db.Model):
     nfse_pdf_url = db.Column(db.String(500), nullable=True)
     nfse_xml_url = db.Column(db.String(500), nullable=True)
     nfse_issued_at = db.Column(db.DateTime, nullable=True)
+
+    # Background boleto generation (BillingJob): queued, sending, verify, created, failed
+    billing_status = db.Column(db.String(20), nullable=True)
+    billing_error = db.Column(db.Text, nullable=True)
+
+    # NFS-e issuance queue (NFSeService): nfse_status pending -> queued -> issuing -> issued | error
+    nfse_attempts = db.Column(db.Integer, default=0)
+    nfse_error = db.Column(db.Text, nullable=True)
+    nfse_next_attempt_at = db.Column(db.DateTime, nullable=True) # Retry backoff; lease deadline while issuing
     
     contract = db.relationship('Contract', backref=db.backref('transactions', cascade='all, delete-orphan'))
     client = db.relationship('Client', backref=db.backref('transactions', lazy=True, cascade='all, delete-orphan'))
 
+    # Forecast / aging queries range-scan due_date within a tenant and status
+    __table_args__ = (
+        db.Index('ix_transaction_company_status_due', 'company_id', 'status', 'due_date'),
+        db.Index('ix_transaction_nfse_queue', 'nfse_status', 'company_id'),
+    )
+
 class BillingEvent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True) # Nullable if we can't identify company yet
@@ -690,6 +772,57 @@ class BillingEvent(db.Model):
     idempotency_key = db.Column(db.String(100), unique=True, nullable=True) # payment_id + event
     created_at = db.Column(db.DateTime, default=get_now_br)
 
+    # Processed after the webhook returns (BillingEventService): received, processing, processed, ignored, failed
+    status = db.Column(db.String(20), default='received')
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_billing_event_status', 'status', 'id'),)
+
+class BillingJob(db.Model):
+    """Asaas boleto generation for a contract's installments, run in the background (sign / regenerate)."""
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    contract_id = db.Column(db.Integer, db.ForeignKey('contract.id'), nullable=False)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    kind = db.Column(db.String(20), default='sign') # sign, regenerate
+    status = db.Column(db.String(20), default='queued') # queued, running, completed, failed
+    total_count = db.Column(db.Integer, default=0)
+    created_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=get_now_br)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    contract = db.relationship('Contract', backref=db.backref('billing_jobs', lazy='dynamic', cascade='all, delete-orphan'))
+
+    __table_args__ = (db.Index('ix_billing_job_contract', 'contract_id', 'id'),)
+
+class ContractExportJob(db.Model):
+    """Bulk PDF export of a company's contracts into one ZIP, rendered in the background (audits)."""
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    statuses = db.Column(db.String(100), default='signed,active') # Contract statuses included
+    status = db.Column(db.String(20), default='queued') # queued, running, completed, failed
+    total_count = db.Column(db.Integer, default=0)
+    done_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    file_path = db.Column(db.String(255), nullable=True) # ZIP on the instance that ran the export
+    storage_path = db.Column(db.String(255), nullable=True) # ZIP in the private artifact bucket (served to any instance)
+    file_size = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=get_now_br)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Runner lease: one process builds the ZIP; locked_at is its heartbeat
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_contract_export_job_company', 'company_id', 'id'),)
+
 class NFSELog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
@@ -730,6 +863,143 @@ class Expense(db.Model):
     
     created_at = db.Column(db.DateTime, default=get_now_br)
 
+class DRESnapshot(db.Model):
+    """Cached DRE of a closed month. Dropped whenever a record dated in that month changes."""
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.JSON, nullable=False)
+    computed_at = db.Column(db.DateTime, default=get_now_br)
+
+    __table_args__ = (db.UniqueConstraint('company_id', 'year', 'month', name='uq_dre_snapshot_period'),)
+
+def _dre_periods_touched(obj, whole=False):
+    """(company_id, year, month) pairs whose DRE a pending change to obj affects, old and new values."""
+    state = inspect(obj)
+    if whole:
+        dates, companies = [obj.due_date], [obj.company_id]
+    else:
+        watched = ['amount', 'due_date', 'company_id'] + (['category_id'] if isinstance(obj, Expense) else [])
+        if not any(state.attrs[name].history.has_changes() for name in watched):
+            return set()
+        dates = [obj.due_date] + list(state.attrs.due_date.history.deleted)
+        companies = [obj.company_id] + list(state.attrs.company_id.history.deleted)
+    return {(cid, d.year, d.month) for cid in companies for d in dates if cid and d}
+
+def _keep_previous_period(target, value, oldvalue, initiator):
+    """No-op; registered with active_history so the pre-change value shows up in attribute history."""
+
+for _attr in (Transaction.due_date, Transaction.company_id, Expense.due_date, Expense.company_id):
+    event.listen(_attr, 'set', _keep_previous_period, active_history=True)
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_dre_snapshots(session, flush_context):
+    periods, companies = set(), set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, (Transaction, Expense)):
+            periods |= _dre_periods_touched(obj, whole=True)
+    for obj in session.dirty:
+        if isinstance(obj, (Transaction, Expense)):
+            periods |= _dre_periods_touched(obj)
+        elif isinstance(obj, FinancialCategory) and session.is_modified(obj):
+            companies.add(obj.company_id)  # Renamed/retyped category moves amounts between DRE lines
+
+    today = get_now_br().date()
+    closed = [p for p in periods if (p[1], p[2]) < (today.year, today.month)]
+    if not closed and not companies:
+        return
+
+    snapshots = DRESnapshot.__table__
+    conditions = [db.and_(snapshots.c.company_id == cid, snapshots.c.year == y, snapshots.c.month == m) for cid, y, m in closed]
+    conditions += [snapshots.c.company_id == cid for cid in companies]
+    session.connection().execute(snapshots.delete().where(db.or_(*conditions)))
+
+class RevenueRollup(db.Model):
+    """Goals revenue per account manager per month (GOALS_REVENUE_ROLLUP). Rebuilt per tenant-year on transaction changes."""
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=True) # Client account manager; Null = unassigned
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=get_now_br)
+
+    __table_args__ = (db.Index('ix_revenue_rollup_company_year', 'company_id', 'year'),)
+
+    @staticmethod
+    def aggregate(company_id, year):
+        """[(account_manager_id, month, total)]: non-cancelled revenue by due_date, owner via contract client or direct client."""
+        owner_client_id = db.func.coalesce(Contract.client_id, Transaction.client_id)
+        month = db.extract('month', Transaction.due_date)
+        return db.session.query(Client.account_manager_id, month, db.func.sum(Transaction.amount))\
+            .select_from(Transaction)\
+            .outerjoin(Contract, Transaction.contract_id == Contract.id)\
+            .outerjoin(Client, Client.id == owner_client_id)\
+            .filter(
+                Transaction.company_id == company_id,
+                Transaction.due_date >= datetime(year, 1, 1).date(),
+                Transaction.due_date < datetime(year + 1, 1, 1).date(),
+                db.func.coalesce(Transaction.status, '') != 'cancelled'
+            ).group_by(Client.account_manager_id, month).all()
+
+    @staticmethod
+    def refresh(company_id, year, connection):
+        rows = RevenueRollup.aggregate(company_id, year)
+        table = RevenueRollup.__table__
+        connection.execute(table.delete().where(table.c.company_id == company_id, table.c.year == year))
+        if rows:
+            now = get_now_br()
+            connection.execute(table.insert(), [
+                {'company_id': company_id, 'year': year, 'month': int(m), 'user_id': user_id, 'amount': total or 0, 'updated_at': now}
+                for user_id, m, total in rows
+            ])
+
+    @staticmethod
+    def read(company_id, year):
+        """Rollup rows for the year, building them on first use."""
+        rows = RevenueRollup.query.filter_by(company_id=company_id, year=year)\
+            .with_entities(RevenueRollup.user_id, RevenueRollup.month, RevenueRollup.amount).all()
+        if not rows:
+            RevenueRollup.refresh(company_id, year, db.session.connection())
+            db.session.commit()
+            rows = RevenueRollup.query.filter_by(company_id=company_id, year=year)\
+                .with_entities(RevenueRollup.user_id, RevenueRollup.month, RevenueRollup.amount).all()
+        return rows
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_revenue_rollups(session, flush_context):
+    if not has_app_context() or not current_app.config.get('GOALS_REVENUE_ROLLUP'):
+        return
+
+    years, companies = set(), set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Transaction) and obj.company_id and obj.due_date:
+            years.add((obj.company_id, obj.due_date.year))
+    for obj in session.dirty:
+        if isinstance(obj, Transaction):
+            years |= {(cid, y) for cid, y, _ in _dre_periods_touched(obj)} # amount / due_date / company
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in ('status', 'contract_id', 'client_id')):
+                years.add((obj.company_id, obj.due_date.year))
+        elif isinstance(obj, (Client, Contract)) and session.is_modified(obj):
+            # Reassigned account manager / contract client: every stored year of the tenant may move
+            state = inspect(obj)
+            watched = 'account_manager_id' if isinstance(obj, Client) else 'client_id'
+            if state.attrs[watched].history.has_changes():
+                companies.add(obj.company_id)
+
+    if companies:
+        table = RevenueRollup.__table__
+        stored = session.connection().execute(
+            db.select(table.c.company_id, table.c.year).where(table.c.company_id.in_(companies)).distinct()
+        ).all()
+        years |= {(cid, y) for cid, y in stored}
+
+    for company_id, year in years:
+        if company_id:
+            RevenueRollup.refresh(company_id, year, session.connection())
+
 class ProcessTemplate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -4,9 +4,6 @@ from flask_login import login_required, current_user
 # from models import db, User, Role, ROLE_ADMIN, ROLE_MANAGER, ROLE_SALES
 from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
-import os
-import time
-import base64
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -147,60 +144,26 @@ def company_settings():
         company.primary_color = request.form.get('primary_color', '#fa0102')
         company.secondary_color = request.form.get('secondary_color', '#111827')
         
-        # Logo Upload Logic
+        # Logo Upload Logic (content-addressed storage, see CompanyLogoService)
         if 'logo' in request.files:
             file = request.files['logo']
             if file and file.filename != '':
+                from services.company_logo_service import CompanyLogoService
                 try:
-                    filename = secure_filename(file.filename)
-                    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'png'
-                    unique_filename = f"logo_{company.id}_{int(time.time())}.{ext}"
-                    
-                    uploaded = False
-                    # 1. Try Supabase Storage
-                    if hasattr(current_app, 'supabase') and current_app.supabase:
-                        try:
-                            # Reset cursor ensures clean read
-                            file.seek(0)
-                            bucket = 'company-assets'
-                            file_content = file.read()
-                            path = f"logos/{unique_filename}"
-                            current_app.supabase.storage.from_(bucket).upload(path, file_content, {"content-type": file.content_type})
-                            public_url = current_app.supabase.storage.from_(bucket).get_public_url(path)
-                            company.logo_filename = public_url
-                            # Clear base64 if cloud upload works to save DB space (optional, but good practice)
-                            company.logo_base64 = None 
-                            uploaded = True
-                            print(f"✅ Uploaded logo to Supabase: {public_url}")
-                        except Exception as storage_e:
-                            print(f"⚠️ Supabase Upload Failed: {storage_e}")
-                            # Fallback continues below
-                    
-                    # 2. Fallback: Base64 Database Storage (Persistence Guarantee)
-                    if not uploaded:
-                        try:
-                            print("💾 Falling back to Base64 Database Storage...")
-                            file.seek(0) # Reset cursor again
-                            file_data = file.read()
-                            base64_str = base64.b64encode(file_data).decode('utf-8')
-                            company.logo_base64 = base64_str
-                            # Set filename to indicate base64 mode if needed, or keep for reference
-                            # company.logo_filename = "base64" 
-                            uploaded = True
-                            print("✅ Logo saved as Base64 in Database.")
-                        except Exception as b64_e:
-                            print(f"❌ Base64 Conversion Failed: {b64_e}")
-                            raise b64_e # Trigger outer except
-
+                    ext = CompanyLogoService.extension(secure_filename(file.filename), file.mimetype)
+                    CompanyLogoService.store(company, file.read(CompanyLogoService.MAX_BYTES + 1), ext)
+                except ValueError as e:
+                    flash(str(e), 'error')
                 except Exception as e:
-                    print(f"❌ Error uploading logo: {e}")
+                    current_app.logger.error(f"Error uploading logo: {e}")
                     flash(f'Erro ao salvar logotipo: {str(e)}', 'error')
     
         db.session.commit()
         flash('Configurações da empresa atualizadas!', 'success')
         return redirect(url_for('admin.company_settings'))
     
-    return render_template('company_settings.html', company=company)
+    from services.company_logo_service import CompanyLogoService
+    return render_template('company_settings.html', company=company, logo_url=CompanyLogoService.url(company, width=160))
 
 @admin_bp.route('/settings/integrations', methods=['GET', 'POST'])
 def settings_integrations():
@@ -222,6 +185,9 @@ def settings_integrations():
             intg.api_key = api_key
             intg.is_active = True
             db.session.commit()
+            if service == 'z_api':
+                from services.zapi_client import ZApiClient
+                ZApiClient.invalidate(current_user.company_id)
             flash('Integração salva!', 'success')
         return redirect(url_for('admin.settings_integrations'))
 
@@ -246,6 +212,9 @@ def delete_integration(service):
     if intg:
         db.session.delete(intg)
         db.session.commit()
+        if service == 'z_api':
+            from services.zapi_client import ZApiClient
+            ZApiClient.invalidate(current_user.company_id)
         flash(f'Integração {service} removida.', 'success')
     else:
         flash('Integração não encontrada.', 'error')
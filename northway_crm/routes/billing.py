@@ -1,8 +1,9 @@
-from flask import Blueprint, request, jsonify, redirect, url_for, flash
+from flask import Blueprint, request, jsonify, redirect, url_for, flash, current_app
 from flask_login import login_required, current_user
 from models import db
 from models import db, Company, BillingEvent, FinancialEvent, User, Transaction, Integration, NFSELog
 from services.asaas_service import create_customer, create_subscription, get_subscription_payments
+from services.billing_event_service import BillingEventService
 from datetime import datetime, timedelta
 import json
 import os
@@ -98,157 +99,41 @@ def process_checkout():
 def asaas_webhook():
     """
     Receives events from Asaas.
+    The event is stored (deduplicated by payment + event) and its status update applied here;
+    NFS-e issuance is deferred to BillingEventService's queue, so Asaas never waits on it.
     """
     # 1. Security Check
     token = request.headers.get('asaas-access-token')
     if token != ASAAS_WEBHOOK_TOKEN:
         return jsonify({'error': 'Unauthorized'}), 401
-    
-    data = request.json
-    event = data.get('event')
-    payment = data.get('payment', {})
-    
-    # 2. Log Event
-    try:
-        # Find company by Customer ID
-        customer_id = payment.get('customer')
-        company = Company.query.filter_by(asaas_customer_id=customer_id).first()
-        
-        log = BillingEvent(
-            company_id=company.id if company else None,
-            event_type=event,
-            payload=data,
-            processed_at=datetime.utcnow(),
-            idempotency_key=f"{payment.get('id')}_{event}"
-        )
-        db.session.add(log)
-        db.session.commit()
-        
-        if not company:
-            return jsonify({'status': 'ignored_no_company'}), 200
-
-        # 3. Handle Logic
-        if event in ['PAYMENT_CONFIRMED', 'PAYMENT_RECEIVED']:
-            company.payment_status = 'active'
-            company.platform_inoperante = False
-            company.overdue_since = None
-            company.subscription_status = 'active'
-            company.subscription_status = 'active'
-            print(f"✅ Company {company.name} Activated!")
-            
-            # Send Email
-            from services.email_service import EmailService
-            from models import EMAIL_TEMPLATES
-            
-            admin_user = User.query.filter_by(company_id=company.id).first() # Notify first user/admin
-            if admin_user:
-                plan_name = 'Plano Anual' if company.plan_type == 'annual' else 'Plano Mensal'
-                try:
-                    EmailService.send_email(
-                        to=admin_user.email,
-                        subject="Pagamento Confirmado - NorthWay",
-                        template=EMAIL_TEMPLATES.subscription_active,
-                        context={
-                           'user': admin_user, 
-                           'plan_name': plan_name,
-                           'amount': f"R$ {payment.get('value', '')}",
-                           'next_billing_date': (datetime.now() + timedelta(days=365 if company.plan_type == 'annual' else 30)).strftime('%d/%m/%Y'),
-                           'dashboard_url': url_for('dashboard.home', _external=True)
-                        },
-                        company_id=company.id,
-                        user_id=admin_user.id
-                    )
-                except Exception as ex:
-                    print(f"Failed to send email: {ex}")
-                except Exception as ex:
-                    print(f"Failed to send email: {ex}")
-        
-        # --- NEW LOGIC: Look for Tenant Transactions (Client Payments) ---
-        transaction = Transaction.query.filter_by(asaas_id=payment.get('id')).first()
-        if transaction:
-            print(f"✅ Webhook matched Transaction {transaction.id} for Contract {transaction.contract_id}")
-            
-            # Log for Transaction
-            nfse_log = NFSELog(
-                company_id=transaction.company_id,
-                transaction_id=transaction.id,
-                status=event,
-                payload=data
-            )
-            db.session.add(nfse_log)
-
-            if event in ['PAYMENT_CONFIRMED', 'PAYMENT_RECEIVED']:
-                transaction.status = 'paid'
-                transaction.paid_date = datetime.now().date()
-                
-                # NFS-e Emission Logic
-                if transaction.contract and transaction.contract.emit_nfse:
-                    # Check if already issued
-                    if transaction.nfse_status != 'issued':
-                        print(f"🚀 Triggering NFS-e for Transaction {transaction.id}")
-                        transaction.nfse_status = 'pending_emission'
-                        
-                        # Get Tenant API Key
-                        tenant_integration = Integration.query.filter_by(
-                            company_id=transaction.company_id, 
-                            service='asaas', 
-                            is_active=True
-                        ).first()
-                        
-                        if tenant_integration and tenant_integration.api_key:
-                            from services.asaas_service import issue_nfse
-                            nfse, err = issue_nfse(
-                                payment_id=transaction.asaas_id,
-                                service_code=transaction.contract.nfse_service_code or '1.03', # Default or from contract
-                                iss_rate=transaction.contract.nfse_iss_rate or 2.0,
-                                description=f"Serviços ref. {transaction.description}",
-                                api_key=tenant_integration.api_key
-                            )
-                            
-                            if nfse:
-                                transaction.nfse_status = 'issued'
-                                transaction.nfse_id = nfse.get('id')
-                                transaction.nfse_number = str(nfse.get('number', '')) or 'PENDING'
-                                print(f"✅ NFS-e Requested: {nfse.get('id')}")
-                                
-                                # Log Success
-                                db.session.add(NFSELog(
-                                    company_id=transaction.company_id, transaction_id=transaction.id,
-                                    status='NFSE_REQUESTED', message=f"ID: {nfse.get('id')}"
-                                ))
-                            else:
-                                transaction.nfse_status = 'error'
-                                print(f"❌ NFS-e Failed: {err}")
-                                db.session.add(NFSELog(
-                                    company_id=transaction.company_id, transaction_id=transaction.id,
-                                    status='NFSE_ERROR', message=str(err)
-                                ))
-            
-            elif event in ['PAYMENT_REFUNDED', 'PAYMENT_REVERSED']:
-                transaction.status = 'refunded'
-                # TODO: Cancel NFS-e logic (Asaas doesn't always allow auto-cancel via API for all cities)
-                # But we can try cancel_nfse if needed.
-            
-            elif event in ['PAYMENT_OVERDUE']:
-                transaction.status = 'overdue'
 
-        # --- END NEW LOGIC ---
-
-        elif event in ['PAYMENT_OVERDUE']:
-            company.payment_status = 'overdue'
-            # Only set overdue_since if it's new
-            if not company.overdue_since:
-                company.overdue_since = datetime.utcnow()
-            print(f"⚠️ Company {company.name} Overdue!")
-            
-        elif event in ['SUBSCRIPTION_DELETED', 'SUBSCRIPTION_CANCELLED']:
-             company.payment_status = 'canceled'
-             company.platform_inoperante = True # Immediate block rule? prompt said D+30 logic, but usually cancel = stop service
-             company.subscription_status = 'canceled'
-             
-        db.session.commit()
-        return jsonify({'status': 'processed'}), 200
+    data = request.get_json(silent=True)
+    if not data or not data.get('event'):
+        return jsonify({'error': 'Invalid payload'}), 400
 
+    # 2. Record Event (indexed idempotency check first: re-deliveries cost one lookup)
+    try:
+        if BillingEventService.is_duplicate(BillingEventService.idempotency_key(data)):
+            return jsonify({'status': 'duplicate'}), 200
+        event = BillingEventService.record(data)
+        if not event:
+            return jsonify({'status': 'duplicate'}), 200
     except Exception as e:
         print(f"Webhook Error: {e}")
         return jsonify({'error': str(e)}), 500
+
+    # 3. Apply the payment/company status now (cheap); on failure the event stays queued for the cron
+    status = 'queued'
+    try:
+        summary = BillingEventService.process_batch(current_app._get_current_object(), [event.id])
+        status = next(iter(summary), status)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Webhook processing error: {e}")
+
+    # 4. NFS-e issuance runs in the background (the cron drains it if this worker stops)
+    try:
+        BillingEventService.start()
+    except Exception as e:
+        print(f"Webhook runner start error: {e}")
+    return jsonify({'status': status}), 200
@@ -0,0 +1,39 @@
+import io
+from flask import Blueprint, send_file, abort, request
+from services.company_logo_service import CompanyLogoService
+
+branding_bp = Blueprint('branding', __name__)
+
+@branding_bp.route('/branding/logos/<int:company_id>/<key>')
+def company_logo(company_id, key):
+    """
+    Company logo by content hash (public: used by e-mails and public forms).
+    The URL changes whenever the logo does, so it is cached as immutable for a year.
+    Optional ?w=<px> serves a cached PNG thumbnail.
+    """
+    if not CompanyLogoService.is_valid_key(key):
+        abort(404)
+
+    width = request.args.get('w', type=int)
+    source, mimetype, etag = None, CompanyLogoService.content_type(key), key
+    if width:
+        width = CompanyLogoService.thumb_width(width)
+        data = CompanyLogoService.thumbnail(company_id, key, width)
+        if data is not None:
+            source, mimetype, etag = io.BytesIO(data), 'image/png', f"{key}-{width}"
+
+    if source is None:
+        source = CompanyLogoService.load(company_id, key)
+        if source is None:
+            abort(404)
+
+    response = send_file(
+        source,
+        mimetype=mimetype,
+        etag=etag,
+        conditional=True,
+        max_age=CompanyLogoService.CACHE_SECONDS
+    )
+    response.headers['Cache-Control'] = f"public, max-age={CompanyLogoService.CACHE_SECONDS}, immutable"
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
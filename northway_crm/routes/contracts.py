@@ -1,11 +1,15 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort, current_app
 from flask_login import login_required, current_user
-from models import db, Client, Contract, ContractTemplate, Transaction, Task, WhatsAppMessage
-from utils import create_notification, get_contract_replacements, get_date_extenso_br
+from models import db, Client, Contract, ContractTemplate, Transaction, Task, WhatsAppMessage, BillingJob
+from utils import create_notification, get_contract_replacements, get_date_extenso_br, parse_brl_amount
+from services.billing_job_service import BillingJobService
+from services.template_engine import TemplateEngine
+from services.contract_preview_service import ContractPreviewService
+from services.pdf_artifact_service import PdfArtifactService
+from services.company_logo_service import CompanyLogoService
 from datetime import datetime, date, timedelta
 import json
 import uuid
-import markdown
 
 contracts_bp = Blueprint('contracts', __name__)
 
@@ -62,7 +66,15 @@ def autosave_contract():
         contract = None
         if contract_id:
             contract = Contract.query.get(contract_id)
+            if contract and contract.company_id != current_user.company_id:
+                return jsonify({'success': False, 'error': 'Unauthorized'}), 403
         
+        form_json = json.dumps(form_data) if form_data else None
+        if contract and str(contract.template_id) == str(template_id) \
+                and (form_json or contract.form_data) == contract.form_data and contract.generated_content == content:
+            # Nothing changed since the last autosave: skip the write
+            return jsonify({'success': True, 'contract_id': contract.id, 'unchanged': True})
+
         if not contract:
             # Create new draft
             contract = Contract(
@@ -70,14 +82,16 @@ def autosave_contract():
                 company_id=current_user.company_id,
                 template_id=template_id,
                 status='draft',
-                form_data=json.dumps(form_data) if form_data else None,
+                form_data=form_json,
                 generated_content=content
             )
             db.session.add(contract)
         else:
             # Update existing draft
+            if contract.generated_content != content:
+                PdfArtifactService.invalidate(contract, commit=False)
             contract.template_id = template_id
-            contract.form_data = json.dumps(form_data) if form_data else contract.form_data
+            contract.form_data = form_json or contract.form_data
             contract.generated_content = content
             
         db.session.commit()
@@ -149,164 +163,27 @@ def preview_contract():
     if client.company_id != current_user.company_id:
         return jsonify({'error': 'Unauthorized'}), 403
 
-    replacements = get_contract_replacements(client, form_data)
-    
-    content = template.content
-    for key, value in replacements.items():
-        content = content.replace(key, str(value))
-    
-    try:
-        content = markdown.markdown(content)
-    except Exception as e:
-        print(f"Markdown Error: {e}")
-    
+    attachment = None
     if attachment_id:
         attachment = ContractTemplate.query.get(attachment_id)
-        if attachment and attachment.company_id == client.company_id:
-            att_content = attachment.content
-            for key, value in replacements.items():
-                att_content = att_content.replace(key, str(value))
-            try:
-                att_content = markdown.markdown(att_content)
-                content += f"<br><hr><br><div class='attachment-section'>{att_content}</div>"
-            except:
-                pass
+        if attachment and attachment.company_id != client.company_id:
+            attachment = None
 
-    # --- PREMIUM HEADER LOGIC ---
-    logo_img_tag = ""
-    if client.company.logo_base64:
-        logo_img_tag = f'<img src="data:image/png;base64,{client.company.logo_base64}" alt="Logo" style="max-height: 80px; object-fit: contain;">'
-    elif client.company.logo_filename:
-        if client.company.logo_filename.startswith('http'):
-            logo_url = client.company.logo_filename
-        else:
-            logo_url = url_for('static', filename='uploads/company/' + client.company.logo_filename)
-        logo_img_tag = f'<img src="{logo_url}" alt="Logo" style="max-height: 80px; object-fit: contain;">'
-
-    primary_col = client.company.primary_color or '#fa0102'
-    second_col = client.company.secondary_color or '#111827'
-    
-    header_html = f"""
-        <!-- Header -->
-        <div style="font-family: 'Inter', 'Helvetica Neue', Helvetica, Arial, sans-serif; color: #111827; display: flex; justify-content: space-between; align-items: center; padding-bottom: 25px; border-bottom: 1px solid #e5e7eb; margin-bottom: 40px;">
-            <div style="flex: 1;">
-                {logo_img_tag}
-            </div>
-            <div style="text-align: right;">
-                <h2 style="margin: 0; font-size: 20px; font-weight: 800; color: {second_col}; text-transform: uppercase; letter-spacing: 2px;">{client.company.name}</h2>
-                <p style="margin: 4px 0 0; color: #6b7280; font-size: 13px; font-weight: 500;">CNPJ: {client.company.document or 'N/A'}</p>
-                <div style="margin-top: 8px; font-size: 11px; font-weight: 600; color: #9ca3af; text-transform: uppercase; letter-spacing: 1px;">{get_date_extenso_br()}</div>
-            </div>
-        </div>
-    """
-
-    # Footer Logic
-    footer_html = f"""
-        <!-- Footer -->
-        <div style="font-family: 'Inter', 'Helvetica Neue', Helvetica, Arial, sans-serif; margin-top: 60px; padding-top: 25px; border-top: 1px solid #f3f4f6; text-align: center;">
-            <p style="margin: 0; font-size: 11px; font-weight: 700; color: #374151; text-transform: uppercase; letter-spacing: 1.5px;">{client.company.name}</p>
-            <p style="margin: 4px 0; font-size: 10px; color: #9ca3af; line-height: 1.6;">{client.company.address or ''}</p>
-            <div style="margin-top: 10px; width: 40px; height: 2px; background-color: {primary_col}; margin-left: auto; margin-right: auto; opacity: 0.3;"></div>
-        </div>
-    """
-
-    # --- ANEXO I: QUADRO RESUMO (Mandatory) ---
-    def generate_summary_sheet(client, replacements, primary_col):
-        summary_html = f"""
-        <div style="page-break-before: always; font-family: 'Inter', 'Helvetica Neue', Helvetica, Arial, sans-serif; padding: 40px; color: #111827;">
-            <div style="text-align: center; margin-bottom: 40px;">
-                <h1 style="font-size: 20px; font-weight: 800; color: {primary_col}; margin: 0; text-transform: uppercase; letter-spacing: 2px;">ANEXO I - QUADRO RESUMO</h1>
-                <div style="width: 60px; height: 3px; background-color: {primary_col}; margin: 15px auto 0;"></div>
-            </div>
-            
-            <p style="margin-bottom: 25px; font-size: 13px; color: #6b7280; line-height: 1.6; text-align: center; max-width: 80%; margin-left: auto; margin-right: auto;">
-                Este documento consolida as principais condições comerciais acordadas. 
-                Sua validade está vinculada ao contrato principal.
-            </p>
-
-            <h3 style="font-size: 12px; font-weight: 700; color: #374151; text-transform: uppercase; letter-spacing: 1px; margin-bottom: 12px; display: flex; align-items: center; gap: 8px;">
-                <span style="width: 8px; height: 8px; border-radius: 50%; background-color: {primary_col}; display: inline-block; margin-right: 8px;"></span>
-                1. Informações das Partes
-            </h3>
-            <table style="width: 100%; border-collapse: collapse; font-size: 13px; margin-bottom: 30px; border: 1px solid #f3f4f6; border-radius: 8px; overflow: hidden;">
-                <tr style="background-color: #fafafa;">
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; width: 30%; color: #6b7280;"><strong>CONTRATANTE</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; font-weight: 600;">{replacements.get('{{nome_empresarial_contratante}}', '')}</td>
-                </tr>
-                 <tr>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>CNPJ/CPF</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">{replacements.get('{{cnpj_contratante}}', '')}</td>
-                </tr>
-                 <tr>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Responsável</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">{replacements.get('{{representante_legal_contratante}}', '')}</td>
-                </tr>
-            </table>
-
-            <h3 style="font-size: 12px; font-weight: 700; color: #374151; text-transform: uppercase; letter-spacing: 1px; margin: 25px 0 12px; display: flex; align-items: center; gap: 8px;">
-                <span style="width: 8px; height: 8px; border-radius: 50%; background-color: {primary_col}; display: inline-block; margin-right: 8px;"></span>
-                2. Vigência e Prazo
-            </h3>
-            <table style="width: 100%; border-collapse: collapse; font-size: 13px; margin-bottom: 30px; border: 1px solid #f3f4f6; border-radius: 8px; overflow: hidden;">
-                <tr style="background-color: #fafafa;">
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; width: 30%; color: #6b7280;"><strong>Início</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; font-weight: 600;">{replacements.get('{{DATA_INICIO}}', replacements.get('{{data_inicio}}', ''))}</td>
-                </tr>
-                <tr>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Término</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">{replacements.get('{{DATA_FIM}}', replacements.get('{{data_fim}}', 'Indeterminado'))}</td>
-                </tr>
-                 <tr>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Duração</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; font-weight: 600; color: {primary_col};">{replacements.get('{{VIGENCIA_MESES}}', replacements.get('{{vigencia_meses}}', ''))} meses</td>
-                </tr>
-            </table>
-    
-            <h3 style="font-size: 12px; font-weight: 700; color: #374151; text-transform: uppercase; letter-spacing: 1px; margin: 25px 0 12px; display: flex; align-items: center; gap: 8px;">
-                <span style="width: 8px; height: 8px; border-radius: 50%; background-color: {primary_col}; display: inline-block; margin-right: 8px;"></span>
-                3. Condições Comerciais
-            </h3>
-            <table style="width: 100%; border-collapse: collapse; font-size: 13px; margin-bottom: 40px; border: 1px solid #f3f4f6; border-radius: 8px; overflow: hidden;">
-                <tr style="background-color: #fafafa;">
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; width: 30%; color: #6b7280;"><strong>Valor Total</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; font-size: 15px; font-weight: 800; color: {primary_col};">R$ {replacements.get('{{valor_total}}', replacements.get('{{VALOR_TOTAL}}', '0,00'))}</td>
-                </tr>
-                <tr>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Implantação</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">R$ {replacements.get('{{VALOR_IMPLANTACAO}}', '0,00')}</td>
-                </tr>
-                 <tr>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Mensalidade</strong></td>
-                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">
-                        <span style="font-weight: 600;">{replacements.get('{{NUMERO_PARCELAS}}', '0')}x de R$ {replacements.get('{{VALOR_MENSAL}}', '0,00')}</span>
-                        <br><small style="color: #9ca3af;">Vencimento: dia {replacements.get('{{DIA_VENCIMENTO}}', '')}</small>
-                    </td>
-                </tr>
-                <tr style="background-color: #fafafa;">
-                    <td style="padding: 12px 15px; color: #6b7280;"><strong>Tráfego Mínimo</strong></td>
-                    <td style="padding: 12px 15px; font-weight: 500;">R$ {replacements.get('{{VALOR_MINIMO_TRAFEGO}}', '0,00')} / {replacements.get('{{PERIODO_TRAFEGO}}', 'mês')}</td>
-                </tr>
-            </table>
-
-            <div style="margin-top: 60px; display: flex; justify-content: space-between; gap: 40px; text-align: center;">
-                 <div style="flex: 1;">
-                    <div style="height: 1px; background-color: #374151; margin-bottom: 12px;"></div>
-                    <p style="margin: 0; font-size: 11px; font-weight: 700; color: #111827; text-transform: uppercase; letter-spacing: 0.5px;">{replacements.get('{{nome_empresarial_contratante}}', 'CONTRATANTE')}</p>
-                    <p style="margin-top: 4px; font-size: 10px; color: #9ca3af; text-transform: uppercase;">Contratante</p>
-                </div>
-                <div style="flex: 1;">
-                    <div style="height: 1px; background-color: #374151; margin-bottom: 12px;"></div>
-                    <p style="margin: 0; font-size: 11px; font-weight: 700; color: #111827; text-transform: uppercase; letter-spacing: 0.5px;">{client.company.name}</p>
-                    <p style="margin-top: 4px; font-size: 10px; color: #9ca3af; text-transform: uppercase;">Contratada</p>
-                </div>
-            </div>
-        </div>
-        """
-        return summary_html
+    replacements = get_contract_replacements(client, form_data)
 
-    summary_sheet = generate_summary_sheet(client, replacements, primary_col)
-    
-    return jsonify({'content': header_html + content + footer_html + summary_sheet})
+    # Unchanged inputs: the editor keeps its current preview
+    etag = ContractPreviewService.etag(client.company, template, attachment, replacements)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        content, unknown_placeholders = ContractPreviewService.render(client, template, attachment, replacements)
+        response = jsonify({
+            'content': content,
+            'unknown_placeholders': unknown_placeholders
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @contracts_bp.route('/clients/<int:id>/contracts', methods=['POST'])
 @login_required
@@ -342,27 +219,21 @@ def create_contract(id):
             # Sync Financials
             val_p = form_data.get('valor_parcela')
             if val_p:
-                try:
-                    client.monthly_value = float(val_p.replace('R$', '').replace('.', '').replace(',', '.').strip())
-                except: pass
+                parsed = parse_brl_amount(val_p)
+                if parsed is not None:
+                    client.monthly_value = float(parsed)
             
             client.start_date = datetime.strptime(form_data.get('data_inicio'), '%d/%m/%Y').date() if form_data.get('data_inicio') else client.start_date
         
         # Generate Content
-        generated_content = template.content
-        for key, value in replacements.items():
-            generated_content = generated_content.replace(key, str(value))
+        generated_content, unknown_placeholders = TemplateEngine.render(template, replacements)
+        if unknown_placeholders:
+            current_app.logger.warning(f"Template {template.id}: unknown placeholders {', '.join(unknown_placeholders)}")
         
         # --- PREMIUM HEADER & FOOTER LOGIC (CREATE) ---
         logo_img_tag = ""
-        if current_user.company.logo_base64:
-             logo_src = f"data:image/png;base64,{current_user.company.logo_base64}"
-             logo_img_tag = f'<img src="{logo_src}" alt="Logo" style="max-height: 80px; width: auto;">'
-        elif current_user.company.logo_filename:
-             if current_user.company.logo_filename.startswith('http'):
-                 logo_url = current_user.company.logo_filename
-             else:
-                 logo_url = url_for('static', filename='uploads/company/' + current_user.company.logo_filename, _external=True)
+        logo_url = CompanyLogoService.url(current_user.company, external=True)
+        if logo_url:
              logo_img_tag = f'<img src="{logo_url}" alt="Logo" style="max-height: 80px; width: auto;">'
 
         primary_col = current_user.company.primary_color or '#fa0102'
@@ -482,6 +353,7 @@ def create_contract(id):
         if contract_id:
             contract = Contract.query.get(contract_id)
             if contract and contract.company_id == current_user.company_id:
+                PdfArtifactService.invalidate(contract, commit=False)
                 contract.template_id = template.id
                 contract.generated_content = generated_content
                 contract.form_data = json.dumps(form_data)
@@ -606,19 +478,14 @@ def sign_contract(id):
         return jsonify({'error': 'Unauthorized'}), 403
 
     try:
-        def add_months_helper(sourcedate, months):
-            month = sourcedate.month - 1 + months
-            year = sourcedate.year + month // 12
-            month = month % 12 + 1
-            day = min(sourcedate.day, [31, 29 if year % 4 == 0 and not year % 100 == 0 or year % 400 == 0 else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
-            return date(year, month, day)
-
         contract = Contract.query.get_or_404(id)
         if contract.company_id != current_user.company_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
         data = json.loads(contract.form_data)
-        val_p = float(data.get('valor_parcela', '0').replace('.', '').replace(',', '.'))
+        if contract.installment_value is None:
+            raise ValueError("Valor da parcela inválido ou não informado.")
+        val_p = float(contract.installment_value)
         qtd_p = int(data.get('qtd_parcelas', '12'))
         venc = int(data.get('dia_vencimento', '5'))
         start_d = datetime.strptime(data.get('data_inicio'), '%d/%m/%Y').date()
@@ -627,89 +494,30 @@ def sign_contract(id):
         contract.total_installments = qtd_p
         contract.amount = val_p * qtd_p
         contract.emit_nfse = True if data.get('emit_nfse') == 'on' else False
-        db.session.commit()
     
         # --- TENANT BILLING LOGIC ---
-        from models import Integration
-        from services.asaas_service import create_customer, create_payment
-        
-        # 1. Check if Tenant has Asaas Configured
-        tenant_integration = Integration.query.filter_by(
-            company_id=current_user.company_id, 
-            service='asaas', 
-            is_active=True
-        ).first()
-        
-        tenant_api_key = tenant_integration.api_key if tenant_integration else None
-        
-        asaas_customer_id = None
-        if tenant_api_key:
-            # Create/Get Customer in Tenant's Asaas
-            try:
-                asaas_customer_id = create_customer(
-                    name=contract.client.name,
-                    email=contract.client.email,
-                    cpf_cnpj=contract.client.document,
-                    phone=contract.client.phone,
-                    external_id=contract.client.id,
-                    api_key=tenant_api_key
-                )
-            except Exception as e:
-                print(f"⚠️ Failed to create Asaas customer: {e}")
+        # Installments are created locally in one insert; boletos are generated by a background job
+        tenant_api_key = BillingJobService.get_api_key(current_user.company_id)
 
         if Transaction.query.filter_by(contract_id=contract.id).count() == 0:
-            for i in range(qtd_p):
-                target_m = add_months_helper(start_d, i)
-                try: due_d = date(target_m.year, target_m.month, venc)
-                except ValueError: due_d = date(target_m.year, target_m.month, 28)
-            
-                # FIX: Ensure due date is not in the past (Asaas rejects past dates for new boletos)
-                if due_d < date.today():
-                    due_d = date.today()
-
-                t = Transaction(
-                    contract_id=contract.id, client_id=contract.client_id, company_id=contract.company_id,
-                    description=f"Parcela {i+1}/{qtd_p}", amount=val_p, due_date=due_d, status='pending',
-                    installment_number=i+1, total_installments=qtd_p,
-                    nfse_status='pending' if contract.emit_nfse else 'not_supported'
-                )
-                db.session.add(t)
-                db.session.flush() # Get ID
-                
-                # Create Real Boleto if Tenant Configured
-                if tenant_api_key and asaas_customer_id:
-                    try:
-                        payment, err = create_payment(
-                            customer_id=asaas_customer_id,
-                            value=val_p,
-                            due_date=due_d.strftime('%Y-%m-%d'),
-                            description=f"Contrato #{contract.id} - Parcela {i+1}/{qtd_p}",
-                            external_ref=t.id,
-                            api_key=tenant_api_key
-                        )
-                        if payment:
-                            t.asaas_id = payment.get('id')
-                            t.asaas_invoice_url = payment.get('invoiceUrl') or payment.get('bankSlipUrl')
-                            print(f"✅ Created Asaas Payment {t.asaas_id} for Transaction {t.id}")
-                        else:
-                            print(f"❌ Failed to create Asaas Payment: {err}")
-                    except Exception as bill_e:
-                        print(f"❌ Exception generating boleto {i+1}: {bill_e}")
+            BillingJobService.create_installments(contract, qtd_p, val_p, start_d, venc, queue=bool(tenant_api_key))
         
         contract.signed_at = datetime.now()
         contract.status = 'active'
         db.session.commit()
         
         msg = 'Contrato assinado.'
-        if tenant_api_key and asaas_customer_id:
-            msg += ' Boletos gerados no seu Asaas com sucesso!'
-        else:
+        job = BillingJobService.enqueue(contract, current_user.id, 'sign') if tenant_api_key else None
+        if job:
+            BillingJobService.start(job.id)
+            msg += ' Os boletos estão sendo gerados no seu Asaas; acompanhe na página do contrato.'
+        elif not tenant_api_key:
             msg += ' (Boletos não gerados: configure sua integração Asaas)'
             
-        return jsonify({'message': msg})
+        return jsonify({'success': True, 'message': msg, 'billing_job_id': job.id if job else None})
     except Exception as e:
         db.session.rollback()
-        return jsonify({'message': f'Erro: {str(e)}'}), 500
+        return jsonify({'error': f'Erro: {str(e)}'}), 500
 
 @contracts_bp.route('/contracts')
 @login_required
@@ -717,11 +525,57 @@ def index():
     if not current_user.company_id:
         abort(403)
 
-    # Fetch all contracts for the current company
-    contracts = Contract.query.filter_by(company_id=current_user.company_id)\
-        .order_by(Contract.created_at.desc()).all()
-    
-    return render_template('contracts/index.html', contracts=contracts)
+    page = request.args.get('page', 1, type=int)
+    per_page = 25
+    query = Contract.query.filter_by(company_id=current_user.company_id)
+
+    # Filters
+    search_q = request.args.get('q')
+    status = request.args.get('status')
+    template_id = request.args.get('template', type=int)
+    created_start = request.args.get('created_start')
+    created_end = request.args.get('created_end')
+
+    if search_q:
+        search_term = f"%{search_q}%"
+        query = query.join(Contract.client).filter(db.or_(
+            Contract.code.ilike(search_term),
+            Client.name.ilike(search_term)
+        ))
+
+    if status:
+        query = query.filter(Contract.status == status)
+
+    if template_id:
+        query = query.filter(Contract.template_id == template_id)
+
+    if created_start:
+        try:
+            start_date = datetime.strptime(created_start, '%Y-%m-%d')
+            query = query.filter(Contract.created_at >= start_date)
+        except ValueError:
+            pass
+
+    if created_end:
+        try:
+            end_date = datetime.strptime(created_end, '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(Contract.created_at < end_date)
+        except ValueError:
+            pass
+
+    # generated_content stays deferred; form_data (value column) is loaded for this page only
+    pagination = query.options(
+        db.joinedload(Contract.client).load_only(Client.id, Client.name),
+        db.joinedload(Contract.template).load_only(ContractTemplate.id, ContractTemplate.name),
+        db.undefer(Contract.form_data)
+    ).order_by(Contract.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+
+    templates = db.session.query(ContractTemplate.id, ContractTemplate.name)\
+        .join(Contract, Contract.template_id == ContractTemplate.id)\
+        .filter(Contract.company_id == current_user.company_id)\
+        .distinct().order_by(ContractTemplate.name).all()
+
+    return render_template('contracts/index.html', contracts=pagination.items, pagination=pagination, templates=templates)
 
 @contracts_bp.route('/contracts/<int:id>')
 @login_required
@@ -732,7 +586,8 @@ def view_contract(id):
     contract = Contract.query.get_or_404(id)
     if contract.company_id != current_user.company_id:
         abort(403)
-    return render_template('contracts/view_contract.html', contract=contract)
+    billing_job = contract.billing_jobs.order_by(BillingJob.id.desc()).first()
+    return render_template('contracts/view_contract.html', contract=contract, billing_job=billing_job)
 
 @contracts_bp.route('/contracts/<int:id>/edit')
 @login_required
@@ -763,6 +618,8 @@ def save_contract(id):
         if not new_content:
             return jsonify({'error': 'Content is required'}), 400
             
+        if contract.generated_content != new_content:
+            PdfArtifactService.invalidate(contract, commit=False)
         contract.generated_content = new_content
         db.session.commit()
         
@@ -781,39 +638,10 @@ def regenerate_billing(id):
         
     try:
         # --- TENANT BILLING LOGIC ---
-        from models import Integration
-        from services.asaas_service import create_customer, create_payment
-        
-        # 1. Check if Tenant has Asaas Configured
-        tenant_integration = Integration.query.filter_by(
-            company_id=current_user.company_id, 
-            service='asaas', 
-            is_active=True
-        ).first()
-        
-        if not tenant_integration or not tenant_integration.api_key:
+        if not BillingJobService.get_api_key(current_user.company_id):
              flash('Integração Asaas não configurada. Configure em Integrações.', 'error')
              return redirect(url_for('contracts.view_contract', id=id))
-        
-        tenant_api_key = tenant_integration.api_key
-        
-        # 2. Get/Create Customer
-        asaas_customer_id = None
-        try:
-            asaas_customer_id, err = create_customer(
-                name=contract.client.name,
-                email=contract.client.email,
-                cpf_cnpj=contract.client.document,
-                phone=contract.client.phone,
-                external_id=contract.client.id,
-                api_key=tenant_api_key
-            )
-            if err: raise Exception(err)
-        except Exception as e:
-            flash(f"Erro ao criar cliente no Asaas: {e}", 'error')
-            return redirect(url_for('contracts.view_contract', id=id))
 
-        # 3. Iterate Transactions and Generate Boletos
         # Get optional new due date from form
         new_due_date_str = request.form.get('new_due_date')
         new_due_date = None
@@ -826,44 +654,28 @@ def regenerate_billing(id):
             except ValueError:
                 pass
 
-        transactions = Transaction.query.filter_by(contract_id=contract.id).order_by(Transaction.due_date).all()
-        count = 0
+        # Queue every open installment without a boleto; the background job generates them
+        transactions = Transaction.query.filter(
+            Transaction.contract_id == contract.id,
+            Transaction.asaas_id.is_(None),
+            ~Transaction.status.in_(['paid', 'cancelled']),
+            db.or_(Transaction.billing_status.is_(None), ~Transaction.billing_status.in_(['sending', 'verify']))
+        ).all()
         
         for t in transactions:
-            # Skip if already has Asaas ID or is paid/cancelled
-            if t.asaas_id or t.status in ['paid', 'cancelled']:
-                continue
-            
-            # FIX: Ensure due date is not in the past
+            # FIX: Ensure due date is not in the past (Asaas rejects past dates for new boletos)
             if t.due_date < date.today():
                 t.due_date = new_due_date if new_due_date else date.today()
-                
-
-                
-            try:
-                payment, err = create_payment(
-                    customer_id=asaas_customer_id,
-                    value=t.amount,
-                    due_date=t.due_date.strftime('%Y-%m-%d'),
-                    description=f"Contrato #{contract.id} - {t.description}",
-                    external_ref=t.id,
-                    api_key=tenant_api_key
-                )
-                if payment:
-                    t.asaas_id = payment.get('id')
-                    t.asaas_invoice_url = payment.get('invoiceUrl') or payment.get('bankSlipUrl')
-                    count += 1
-                else:
-                    print(f"❌ Failed to regen Asaas Payment: {err}")
-            except Exception as bill_e:
-                print(f"❌ Exception regen boleto: {bill_e}")
-        
+            t.billing_status = 'queued'
+            t.billing_error = None
         db.session.commit()
-        
-        if count > 0:
-            flash(f'{count} boletos gerados com sucesso!', 'success')
+
+        job = BillingJobService.enqueue(contract, current_user.id, 'regenerate')
+        if job:
+            BillingJobService.start(job.id)
+            flash(f'Gerando {job.total_count} boletos em segundo plano...', 'success')
         else:
-            flash('Nenhum boleto precisou ser gerado (todos já existem ou erro).', 'info')
+            flash('Nenhum boleto precisou ser gerado (todos já existem).', 'info')
             
         return redirect(url_for('contracts.view_contract', id=id))
 
@@ -871,3 +683,15 @@ def regenerate_billing(id):
         db.session.rollback()
         flash(f"Erro ao regerar boletos: {str(e)}", 'error')
         return redirect(url_for('contracts.view_contract', id=id))
+
+@contracts_bp.route('/api/contracts/<int:id>/billing')
+@login_required
+def billing_progress(id):
+    contract = Contract.query.get_or_404(id)
+    if contract.company_id != current_user.company_id:
+        abort(403)
+
+    job = contract.billing_jobs.order_by(BillingJob.id.desc()).first()
+    if not job:
+        return jsonify({'job': None})
+    return jsonify({'job': BillingJobService.progress(job)})
@@ -1,10 +1,15 @@
 from flask import Blueprint, render_template, jsonify, abort, request
 from flask_login import login_required, current_user
-from models import db, Contract, Transaction, FinancialCategory, Expense, ROLE_ADMIN, ROLE_MANAGER
+from models import db, Contract, Client, Transaction, FinancialCategory, Expense, ROLE_ADMIN, ROLE_MANAGER
+from services.dre_service import DREService
+from services.nfse_service import NFSeService
+from services.projection_service import ProjectionService
+from services.aging_service import AgingService
+from services.billing_event_service import BillingEventService
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 import json
-from sqlalchemy import func, desc, extract
+from sqlalchemy import func, desc, extract, case
 
 financial_bp = Blueprint('financial', __name__)
 
@@ -41,30 +46,17 @@ def stats():
     today = date.today()
     
     # --- PROJECTION & REVENUE ---
-    # Optimized: Single aggregate query for future revenue buckets could be faster,
-    # but Python loop is acceptable for <10k transactions.
-    
-    forecast_30 = 0
-    forecast_60 = 0
-    forecast_90 = 0
-    
-    # Fetch all pending future transactions
-    # Simplified: Direct filter on Transaction using company_id
-    upcoming_transactions = Transaction.query.filter(
+    # One conditional aggregate over a due_date range scan (ix_transaction_company_status_due)
+    horizon = {days: today + timedelta(days=days) for days in (30, 60, 90)}
+    forecast_30, forecast_60, forecast_90 = db.session.query(*[
+        func.coalesce(func.sum(case((Transaction.due_date <= limit, Transaction.amount), else_=0)), 0)
+        for limit in horizon.values()
+    ]).filter(
         Transaction.company_id == company_id,
         Transaction.status == 'pending',
-        Transaction.due_date >= today
-    ).all()
-    
-    for t in upcoming_transactions:
-        days_diff = (t.due_date - today).days
-        if days_diff <= 30:
-            forecast_30 += t.amount
-        if days_diff <= 60:
-            forecast_60 += t.amount
-        if days_diff <= 90:
-            forecast_90 += t.amount
-            
+        Transaction.due_date.between(today, horizon[90])
+    ).one()
+
     # Confirmed Revenue (Paid this month)
     first_day_month = today.replace(day=1)
     paid_this_month = db.session.query(func.sum(Transaction.amount)).filter(
@@ -81,26 +73,20 @@ def stats():
     ).scalar() or 0
     
     # --- MRR & TICKET ---
-    # Performance: Avoid parsing JSON for every request if possible.
-    # For now, we iterate active contracts.
-    active_contracts = Contract.query.filter(
+    # SQL aggregates over the typed Contract.installment_value column
+    active_filter = (
         Contract.company_id == company_id,
         Contract.status.in_(['signed', 'active'])
-    ).all()
-    cancelled_contracts = Contract.query.filter_by(company_id=company_id, status='cancelled').all() # Assuming 'cancelled' status exists/used
-    
-    mrr = 0
-    active_clients_count = len(active_contracts)
-    cancelled_count = len(cancelled_contracts)
-    
-    for c in active_contracts:
-        try:
-            data = json.loads(c.form_data)
-            val_str = data.get('valor_parcela', '0')
-            val = float(val_str.replace('.', '').replace(',', '.'))
-            mrr += val
-        except:
-            pass
+    )
+    mrr, active_clients_count = db.session.query(
+        func.coalesce(func.sum(Contract.installment_value), 0),
+        func.count(Contract.id)
+    ).filter(*active_filter).one()
+    mrr = float(mrr)
+    cancelled_count = db.session.query(func.count(Contract.id)).filter(
+        Contract.company_id == company_id,
+        Contract.status == 'cancelled'
+    ).scalar() or 0
 
     avg_ticket = mrr / active_clients_count if active_clients_count > 0 else 0
     
@@ -109,56 +95,44 @@ def stats():
     churn_rate = (cancelled_count / total_ever_signed * 100) if total_ever_signed > 0 else 0
 
     # --- CHARTS (12 Months Projection) ---
+    # Single range scan grouped by month; extract() only in GROUP BY, never in WHERE
+    months = [add_months(first_day_month, i) for i in range(12)]
+    due_year = extract('year', Transaction.due_date)
+    due_month = extract('month', Transaction.due_date)
+    month_rows = db.session.query(
+        due_year, due_month, func.sum(Transaction.amount)
+    ).filter(
+        Transaction.company_id == company_id,
+        Transaction.contract_id.isnot(None), # Contract installments only (manual charges stay out of the chart)
+        Transaction.status == 'pending',
+        Transaction.due_date.between(first_day_month, add_months(first_day_month, 12) - timedelta(days=1))
+    ).group_by(due_year, due_month).all()
+    month_sums = {(int(y), int(m)): total or 0 for y, m, total in month_rows}
+
     chart_labels = []
     chart_values = []
-    for i in range(12):
-        future_date = add_months(today, i)
-        # Sum transactions due in that month/year
-        month_sum = db.session.query(func.sum(Transaction.amount)).join(Contract).filter(
-            Contract.company_id == company_id,
-            Transaction.status == 'pending',
-            extract('month', Transaction.due_date) == future_date.month,
-            extract('year', Transaction.due_date) == future_date.year
-        ).scalar() or 0
-        
+    for i, month_start in enumerate(months):
+        month_sum = month_sums.get((month_start.year, month_start.month), 0)
         if i == 0:
              month_sum += paid_this_month
-             
-        chart_labels.append(future_date.strftime('%b/%Y'))
+
+        chart_labels.append(month_start.strftime('%b/%Y'))
         chart_values.append(month_sum)
 
     # --- NICHE STATS (New) ---
-    # Aggregate MRR by Client Niche
-    # We iterate active contracts and group by their client's niche
-    niche_buckets = {} # For MRR
-    niche_counts = {} # For Client Count
-    
-    for c in active_contracts:
-        try:
-            # Extract value from contract JSON
-            data = json.loads(c.form_data)
-            val_str = data.get('valor_parcela', '0')
-            val = float(val_str.replace('.', '').replace(',', '.'))
-            
-            # Get Niche
-            niche = c.client.niche or "Sem Nicho"
-            niche = niche.strip()
-            if not niche: niche = "Sem Nicho"
-            
-            if niche not in niche_buckets:
-                niche_buckets[niche] = 0
-                niche_counts[niche] = 0
-            niche_buckets[niche] += val
-            niche_counts[niche] += 1
-        except:
-            pass
-            
-    # Sort Niches by MRR (desc)
-    sorted_niches = sorted(niche_buckets.items(), key=lambda x: x[1], reverse=True)
-    niche_labels = [item[0] for item in sorted_niches]
-    niche_values = [item[1] for item in sorted_niches]
-    # Create matching list of counts for the frontend (same order as labels)
-    niche_quantities = [niche_counts[label] for label in niche_labels]
+    # Aggregate MRR by Client Niche (SUM ... GROUP BY client.niche)
+    niche_col = func.coalesce(func.nullif(func.trim(Client.niche), ''), 'Sem Nicho')
+    niche_mrr = func.coalesce(func.sum(Contract.installment_value), 0)
+    niche_rows = db.session.query(
+        niche_col, niche_mrr, func.count(Contract.id)
+    ).join(Client, Contract.client_id == Client.id)\
+        .filter(*active_filter)\
+        .group_by(niche_col)\
+        .order_by(niche_mrr.desc()).all()
+
+    niche_labels = [row[0] for row in niche_rows]
+    niche_values = [float(row[1]) for row in niche_rows]
+    niche_quantities = [row[2] for row in niche_rows]
 
     # --- RECENT TRANSACTIONS ---
     recent_txs = Transaction.query.filter(
@@ -230,115 +204,153 @@ def get_dre_data():
     if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
         abort(403)
         
-    company_id = current_user.company_id
-    
     # Get filters
     year = request.args.get('year', type=int, default=date.today().year)
     month = request.args.get('month', type=int, default=date.today().month)
-    
-    # --- 1. RECEITA BRUTA (Transactions Paid + Issued in that month?) ---
-    # Usually DRE is Competence Regime (issued invoice). Let's use 'due_date' (vencimento/competencia approx) or created_at?
-    # For MVP financial, let's use 'due_date' as proxy for competence if paid or pending.
-    # Ideally we should have 'competence_date', but due_date is close enough for simple CRM.
-    
-    # Fetch Revenue Transactions
-    revenue_txs = Transaction.query.filter(
-        Transaction.company_id == company_id,
-        extract('year', Transaction.due_date) == year,
-        extract('month', Transaction.due_date) == month
-        # We include all, or just paid? DRE Competency = All Billed. DRE Cash = All Paid.
-        # Let's do COMPETENCY (Billed/Faturado).
-    ).all()
-    
-    gross_revenue = sum(t.amount for t in revenue_txs)
-    
-    # --- 2. DEDUÇÕES (Impostos) --- 
-    # Simple approx: Category 'Impostos' manually added OR calculated
-    # Let's fetch Manual Expenses of type 'expense' named 'Impostos' or similar?
-    # Actually, we defined Expense Types.
-    # Let's fetch ALL Expenses for the period (by due_date)
-    
-    period_expenses = Expense.query.filter(
-        Expense.company_id == company_id,
-        extract('year', Expense.due_date) == year,
-        extract('month', Expense.due_date) == month
-    ).all()
-    
-    # Categorize
-    taxes = 0
-    variable_costs = 0 # Markting if variable? Or commissions?
-    fixed_expenses = 0
-    
-    # Map from our DB Categories
-    # We need to join with Category to check type
-    
-    # Helper to group by category for frontend
-    breakdown_expenses = {} # { 'Pessoal': 5000, 'Marketing': 1000 }
-    
-    for exp in period_expenses:
-        cat = exp.category
-        val = exp.amount
-        
-        # Populate Breakdown
-        if cat.name not in breakdown_expenses:
-            breakdown_expenses[cat.name] = 0
-        breakdown_expenses[cat.name] += val
-        
-        # Aggregate High Level
-        if cat.type == 'cost':
-             variable_costs += val
-        elif cat.name.lower().startswith('imposto'): # Hacky if user didn't use default
-             taxes += val
-        else:
-             # Default to fixed expense
-             fixed_expenses += val
-             
-    # Adjust: If 'Impostos' is a category, we might have double counted in fixed_expenses if we didn't filtering logic properly.
-    # Let's refine. type='revenue' (not used for expense), 'expense', 'cost'.
-    # We will assume 'cost' = CMV/Variable. 'expense' = Fixed.
-    # 'Impostos' usually is separate. Let's look for a category named "Impostos e Taxas".
-    
-    # Refined Loop
-    taxes = 0
-    variable_costs = 0
-    fixed_expenses = 0
-    breakdown = {}
-    
-    for exp in period_expenses:
-        cat = exp.category
-        val = exp.amount
-        
-        if cat.name not in breakdown: breakdown[cat.name] = 0
-        breakdown[cat.name] += val
-        
-        if "imposto" in cat.name.lower():
-            taxes += val
-        elif cat.type == 'cost':
-            variable_costs += val
-        else:
-            fixed_expenses += val
-
-    # --- CALCULATION ---
-    net_revenue = gross_revenue - taxes
-    gross_profit = net_revenue - variable_costs # Margem de Contribuição
-    # EBITDA = Gross Profit - Fixed Expenses (before interest/depreciation)
-    # We assume all 'fixed_expenses' are operating expenses for EBITDA in this simple model.
-    ebitda = gross_profit - fixed_expenses
-    
-    # Net Result (ignoring depreciation/interest for MVP)
-    net_result = ebitda 
-    
-    return jsonify({
-        'gross_revenue': gross_revenue,
-        'taxes': taxes,
-        'net_revenue': net_revenue,
-        'variable_costs': variable_costs,
-        'gross_profit': gross_profit, # Margem Contribuição
-        'fixed_expenses': fixed_expenses,
-        'ebitda': ebitda,
-        'net_result': net_result,
-        'breakdown': breakdown
-    })
+    if not 1 <= month <= 12:
+        return jsonify({'error': 'Mês inválido'}), 400
+
+    # Competence regime by due_date; closed months come from the DRE snapshot cache
+    dre = DREService.get_months(current_user.company_id, [(year, month)])[(year, month)]
+    return jsonify(dre)
+
+@financial_bp.route('/api/financial/dre/compare')
+@login_required
+def get_dre_comparison():
+    if not current_user.company_id:
+        abort(403)
+
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+
+    # ?start=2025-01&end=2026-12&group=month|year
+    today = date.today()
+    try:
+        start = tuple(int(p) for p in request.args.get('start', f"{today.year}-01").split('-'))
+        end = tuple(int(p) for p in request.args.get('end', f"{today.year}-12").split('-'))
+        if len(start) != 2 or len(end) != 2 or not (1 <= start[1] <= 12 and 1 <= end[1] <= 12):
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Período inválido (use AAAA-MM)'}), 400
+
+    group = 'year' if request.args.get('group') == 'year' else 'month'
+    try:
+        return jsonify(DREService.compare(current_user.company_id, start, end, group))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@financial_bp.route('/api/financial/projection', methods=['GET', 'POST'])
+@login_required
+def get_projection():
+    if not current_user.company_id:
+        abort(403)
+
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+
+    # GET ?months=12 -> default scenarios; POST {"months": 24, "scenarios": [{"label", "churn", "new_sales", "late_rate", "ticket"}]}
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    try:
+        months = int(data.get('months') or request.args.get('months') or 12)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Horizonte inválido.'}), 400
+
+    try:
+        scenarios = data.get('scenarios')
+        if scenarios is not None and not isinstance(scenarios, list):
+            raise ValueError("'scenarios' deve ser uma lista.")
+        return jsonify(ProjectionService.project(current_user.company_id, months, scenarios))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+@financial_bp.route('/financial/aging')
+@login_required
+def aging_page():
+    if not current_user.company_id:
+        abort(403)
+
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+    return render_template('financial/aging.html')
+
+@financial_bp.route('/api/financial/aging')
+@login_required
+def get_aging():
+    if not current_user.company_id:
+        abort(403)
+
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+
+    # Cached for the day; ?refresh=1 recomputes (e.g. after registering payments)
+    report = AgingService.report(current_user.company_id, refresh=request.args.get('refresh') == '1')
+    if request.args.get('format') != 'csv':
+        return jsonify(report)
+
+    import csv
+    from io import StringIO
+    from flask import Response
+
+    si = StringIO()
+    cw = csv.writer(si)
+    cw.writerow(['Cliente'] + [b['label'] for b in report['buckets']] + ['Total', 'Parcelas', 'Maior atraso (dias)'])
+    for c in report['clients']:
+        cw.writerow([c['client']] + [f"{c[b['key']]:.2f}" for b in report['buckets']] + [f"{c['total']:.2f}", c['count'], c['oldest_days']])
+
+    return Response(
+        si.getvalue(),
+        mimetype="text/csv",
+        headers={"Content-disposition": f"attachment; filename=aging_{report['date']}.csv"}
+    )
+
+@financial_bp.route('/api/financial/aging/detail')
+@login_required
+def get_aging_detail():
+    if not current_user.company_id:
+        abort(403)
+
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+
+    # ?client_id=<id>; empty = charges without a client
+    client_id = request.args.get('client_id', type=int)
+    return jsonify({'items': AgingService.client_detail(current_user.company_id, client_id)})
+
+@financial_bp.route('/financial/nfse')
+@login_required
+def nfse_page():
+    if not current_user.company_id:
+        abort(403)
+
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+    return render_template('financial/nfse.html')
+
+@financial_bp.route('/api/financial/nfse/backlog')
+@login_required
+def nfse_backlog():
+    if not current_user.company_id:
+        abort(403)
+
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+    return jsonify(NFSeService.backlog(current_user.company_id))
+
+@financial_bp.route('/api/financial/nfse/retry', methods=['POST'])
+@login_required
+def nfse_retry():
+    if not current_user.company_id:
+        abort(403)
+
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+
+    # {"ids": [..]} re-queues those invoices; no ids re-queues every failed one
+    ids = (request.get_json(silent=True) or {}).get('ids') or None
+    count = NFSeService.retry(current_user.company_id, ids)
+    if count:
+        BillingEventService.start()
+    return jsonify({'success': True, 'requeued': count})
 
 @financial_bp.route('/api/expenses', methods=['GET', 'POST'])
 @login_required
@@ -3,6 +3,7 @@ from flask import Blueprint, request, jsonify, current_app, render_template, red
 from flask_login import login_required, current_user
 from models import db, FormInstance, User, LibraryTemplate, LibraryTemplateGrant, FormSubmission
 from services.form_service import FormService
+from services.company_logo_service import CompanyLogoService
 import secrets
 import re
 
@@ -25,16 +26,7 @@ def get_form_schema(slug):
     token = FormService.generate_public_token(instance.id)
     
     # Get Company Logo
-    company_logo = None
-    if instance.owner.company:
-        company = instance.owner.company
-        if company.logo_filename:
-             if company.logo_filename.startswith('http'):
-                 company_logo = company.logo_filename
-             else:
-                 company_logo = url_for('static', filename='uploads/company/' + company.logo_filename, _external=True)
-        elif company.logo_base64:
-             company_logo = f"data:image/png;base64,{company.logo_base64}"
+    company_logo = CompanyLogoService.url(instance.owner.company, width=320, external=True)
              
     # Default fallback
     if not company_logo:
@@ -282,17 +274,7 @@ def get_report(submission_id):
     # Get Company details and logo
     from models import Company
     company = Company.query.get(submission.tenant_id)
-    company_logo = None
-    
-    if company:
-        # Check priority: logo_filename (cloud or local), then base64
-        if company.logo_filename:
-             if company.logo_filename.startswith('http'):
-                 company_logo = company.logo_filename
-             else:
-                 company_logo = url_for('static', filename='uploads/company/' + company.logo_filename, _external=True)
-        elif company.logo_base64:
-             company_logo = f"data:image/png;base64,{company.logo_base64}"
+    company_logo = CompanyLogoService.url(company, width=320, external=True)
              
     # Default fallback
     if not company_logo:
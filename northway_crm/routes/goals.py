@@ -1,6 +1,6 @@
-from flask import Blueprint, render_template, jsonify, abort, request
+from flask import Blueprint, render_template, jsonify, abort, request, current_app
 from flask_login import login_required, current_user
-from models import db, Contract, User, Goal, Transaction, ROLE_ADMIN, ROLE_MANAGER
+from models import db, Contract, User, Goal, Transaction, RevenueRollup, ROLE_ADMIN, ROLE_MANAGER
 from datetime import date, datetime
 import json
 from sqlalchemy import func, extract
@@ -25,22 +25,27 @@ def get_dashboard_data():
         year=year
     ).all()
     
-    # --- 2. Fetch ALL Transactions for the Year (Revenue) ---
-    # We use Transaction.due_date as the reference for "Competence" (Faturamento prev/real)
-    # Filter out cancelled. Use direct filter on Transaction.company_id to include manual charges.
-    year_transactions = Transaction.query.filter(
-        Transaction.company_id == company_id,
-        extract('year', Transaction.due_date) == year,
-        Transaction.status != 'cancelled'
-    ).all()
+    # --- 2. Revenue per Account Manager per Month (Single Grouped Query) ---
+    # Transaction.due_date is the "Competence" reference (Faturamento prev/real), cancelled excluded.
+    # Filtered on Transaction.company_id to include manual charges; owner = contract client or direct client.
+    if current_app.config.get('GOALS_REVENUE_ROLLUP'):
+        revenue_rows = RevenueRollup.read(company_id, year)
+    else:
+        revenue_rows = RevenueRollup.aggregate(company_id, year)
     
-    # --- 3. Fetch New Contracts for the Year (New Business Growth) ---
-    # Used for the secondary condition "Minimum New Sales"
-    year_new_contracts = Contract.query.filter(
-        Contract.company_id == company_id,
-        extract('year', Contract.created_at) == year, # Assuming created_at or specialized signed_at
-        Contract.status.in_(['signed', 'active'])
-    ).all()
+    # --- 3. New Contracts for the Year (New Business Growth) ---
+    # Used for the secondary condition "Minimum New Sales": SUM(installment_value) per month
+    new_sales_month = extract('month', Contract.created_at)
+    new_sales_by_month = {
+        int(m): float(total or 0) for m, total in db.session.query(
+            new_sales_month, func.sum(Contract.installment_value)
+        ).filter(
+            Contract.company_id == company_id,
+            Contract.created_at >= datetime(year, 1, 1), # Assuming created_at or specialized signed_at
+            Contract.created_at < datetime(year + 1, 1, 1),
+            Contract.status.in_(['signed', 'active'])
+        ).group_by(new_sales_month).all()
+    }
     
     # Initialize Aggregators
     monthly_data = {
@@ -80,16 +85,9 @@ def get_dashboard_data():
             else:
                 monthly_data['user_targets'][g.user_id] = monthly_data['user_targets'].get(g.user_id, 0) + g.target_amount
 
-    # Process Transactions (Revenue)
-    for t in year_transactions:
-        val = t.amount
-        
-        # Determine owners
-        u_id = None
-        if t.contract:
-            u_id = t.contract.client.account_manager_id
-        elif t.client:
-            u_id = t.client.account_manager_id
+    # Process Revenue
+    for u_id, m, total in revenue_rows:
+        val = float(total or 0)
         
         # Annual Aggregate
         annual_data['company_actual'] += val
@@ -97,26 +95,14 @@ def get_dashboard_data():
             annual_data['user_actuals'][u_id] += val
             
         # Monthly Specific
-        if t.due_date.month == month:
+        if int(m) == month:
             monthly_data['company_actual'] += val
             if u_id and u_id in monthly_data['user_actuals']:
                 monthly_data['user_actuals'][u_id] += val
                 
     # Process New Contracts (New Business)
-    for c in year_new_contracts:
-        try:
-            data = json.loads(c.form_data)
-            val_str = data.get('valor_parcela', '0')
-            val = float(val_str.replace('.', '').replace(',', '.'))
-        except:
-            val = 0
-            
-        # Annual
-        annual_data['company_new_sales_actual'] += val
-        
-        # Monthly
-        if c.created_at.month == month:
-            monthly_data['company_new_sales_actual'] += val
+    annual_data['company_new_sales_actual'] = sum(new_sales_by_month.values())
+    monthly_data['company_new_sales_actual'] = new_sales_by_month.get(month, 0)
 
     # Helper to build Response Object
     def build_response(data_source):
@@ -149,15 +135,6 @@ def get_dashboard_data():
             'ranking': ranking
         }
 
-    # Debug to File
-    try:
-        with open('debug_dashboard.log', 'w') as f:
-            f.write(f"Year: {year}, Month: {month}\n")
-            f.write(f"Monthly Data: {str(monthly_data)}\n")
-            f.write(f"Response: {str(build_response(monthly_data))}\n")
-    except: pass
-
-    print(f"DEBUG DASHBOARD MONTHLY: {monthly_data}") 
     return jsonify({
         'monthly': build_response(monthly_data),
         'annual': build_response(annual_data)
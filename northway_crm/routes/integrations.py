@@ -73,6 +73,15 @@ def setup_asaas_webhook():
     else:
         return api_response(success=False, error=f"Erro Asaas: {err}", status=500)
 
+@integrations_bp.route('/api/integrations/asaas/metrics')
+@login_required
+def asaas_metrics():
+    """Per-endpoint Asaas latency/retries for this worker process."""
+    if not (current_user.is_super_admin or current_user.role == 'admin'):
+        return jsonify({"error": "Unauthorized"}), 403
+    from services.asaas_client import AsaasClient
+    return jsonify({'endpoints': AsaasClient.metrics(), 'pool_size': AsaasClient.POOL_SIZE})
+
 @integrations_bp.route('/api/integrations/google-maps/test', methods=['POST'])
 @login_required
 def test_google_maps():
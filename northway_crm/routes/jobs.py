@@ -110,3 +110,59 @@ def drive_sync_job():
             db.session.commit()
 
     return jsonify(results)
+
+@jobs_bp.route('/api/cron/billing-jobs', methods=['GET', 'POST'])
+def billing_jobs_job():
+    """
+    Cron job to resume Asaas boleto generation whose worker stopped (deploy/restart).
+    Runs in this request, up to CRON_TIME_BUDGET_SECONDS: background threads freeze on serverless.
+    Installments are claimed atomically and verified by externalReference, so no boleto is created twice.
+    """
+    from services.billing_job_service import BillingJobService
+    try:
+        resumed = BillingJobService.drain(current_app._get_current_object(), current_app.config.get('CRON_TIME_BUDGET_SECONDS', 45))
+        return jsonify({'resumed': resumed})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/api/cron/contract-exports', methods=['GET', 'POST'])
+def contract_exports_job():
+    """
+    Cron job to resume contract PDF exports whose worker stopped (deploy/restart).
+    The ZIP is rebuilt from scratch; PDFs already in the artifact store are copied, not re-rendered.
+    With PDF_EXPORT_INLINE (default on Vercel) the export runs inside this request.
+    """
+    from services.contract_export_service import ContractExportService
+    try:
+        resumed = ContractExportService.resume_stalled()
+        return jsonify({'resumed': resumed})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/api/cron/whatsapp-broadcasts', methods=['GET', 'POST'])
+def whatsapp_broadcast_job():
+    """
+    Cron job to resume WhatsApp broadcast campaigns whose worker stopped (deploy/restart).
+    Runs in this request, up to CRON_TIME_BUDGET_SECONDS: background threads freeze on serverless.
+    Recipients are claimed atomically, so overlapping runs never send the same message twice.
+    """
+    from services.broadcast_service import BroadcastService
+    try:
+        resumed = BroadcastService.drain(current_app._get_current_object(), current_app.config.get('CRON_TIME_BUDGET_SECONDS', 45))
+        return jsonify({'resumed': resumed})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/api/cron/billing-events', methods=['GET', 'POST'])
+def billing_events_job():
+    """
+    Cron job to drain Asaas webhook events and the NFS-e queue (pending events after a restart, scheduled retries).
+    Runs in this request, up to CRON_TIME_BUDGET_SECONDS: background threads freeze on serverless.
+    Events and invoices are claimed atomically, so overlapping runs never apply or issue twice.
+    """
+    from services.billing_event_service import BillingEventService
+    try:
+        result = BillingEventService.drain(current_app._get_current_object(), current_app.config.get('CRON_TIME_BUDGET_SECONDS', 45))
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
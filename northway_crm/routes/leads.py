@@ -67,33 +67,9 @@ def leads():
     # Strict filter
     query = Lead.query.filter(Lead.company_id == current_user.company_id)
     
-    # Filters
-    search_q = request.args.get('q')
-    status = request.args.get('status')
-    source = request.args.get('source')
-    assigned_to = request.args.get('assigned_to')
-    stage_id = request.args.get('stage_id')
-    
-    if search_q:
-        search_term = f"%{search_q}%"
-        query = query.filter(db.or_(
-            Lead.name.ilike(search_term),
-            Lead.email.ilike(search_term),
-            Lead.phone.ilike(search_term),
-            Lead.legal_name.ilike(search_term) 
-            # Actually Lead model usually has name. It might not have company_name field (it has company_id).
-            # Let's check Lead model again or just stick to safe fields.
-            # Viewing leads.py confirms Lead has name, email, phone.
-        ))
-    
-    if status:
-        query = query.filter_by(status=status)
-    if source:
-        query = query.filter_by(source=source)
-    if assigned_to:
-        query = query.filter_by(assigned_to_id=int(assigned_to))
-    if stage_id:
-        query = query.filter_by(pipeline_stage_id=int(stage_id))
+    # Filters (shared with WhatsApp broadcast targeting)
+    from services.broadcast_service import BroadcastService
+    query = BroadcastService.apply_lead_filters(query, request.args)
         
     pagination = query.options(
         db.joinedload(Lead.assigned_user),
@@ -1,7 +1,6 @@
-from flask import Blueprint, send_file, render_template, current_app, abort
+from flask import Blueprint, send_file, render_template, current_app, abort, request, jsonify, redirect
 from flask_login import login_required, current_user
-from models import Contract
-import io
+from models import db, Contract, ContractExportJob, ROLE_ADMIN, ROLE_MANAGER
 
 pdf_bp = Blueprint('pdf', __name__)
 
@@ -9,10 +8,8 @@ pdf_bp = Blueprint('pdf', __name__)
 @login_required
 def download_contract_pdf(id):
     """
-    Generates and downloads a PDF for a specific contract.
+    Downloads the PDF of a specific contract (rendered once per content version).
     """
-    # Lazy import to avoid circular dependencies or startup errors
-    from services.pdf_service import PdfService
     # 1. Fetch Contract & verify permission
     contract = Contract.query.get_or_404(id)
     
@@ -20,24 +17,91 @@ def download_contract_pdf(id):
     if contract.company_id != current_user.company_id:
         abort(403)
 
+    # Lazy import to avoid circular dependencies or startup errors
+    from services.pdf_artifact_service import PdfArtifactService
+
+    # Same content already downloaded: the browser copy is still valid
+    key = PdfArtifactService.cache_key(contract)
+    if contract.pdf_key == key and request.if_none_match.contains(key):
+        response = current_app.response_class(status=304)
+        response.set_etag(key)
+        return response
+
     try:
-        # 2. Generate PDF using FPDF2 (Zero-dependency)
-        # We pass the contract object directly, no intermediate HTML template needed for layout
-        pdf_bytes = PdfService.generate_pdf(contract)
+        # 2. Cached artifact, or render with FPDF2 (Zero-dependency) and store
+        source, key = PdfArtifactService.get_or_render(contract)
 
-        # 4. Return as attachment
-        return send_file(
-            io.BytesIO(pdf_bytes),
+        # 3. Return as attachment (ETag = content hash; Range and If-None-Match handled by send_file)
+        response = send_file(
+            source,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=f"Contrato_{contract.code or contract.id}.pdf"
+            download_name=f"Contrato_{contract.code or contract.id}.pdf",
+            etag=key,
+            conditional=True,
+            max_age=0
         )
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         current_app.logger.error(f"Failed to generate PDF for contract {id}: {str(e)}")
         # Return the actual error to the user for debugging
         return f"Erro ao gerar PDF: {str(e)}", 500
 
+@pdf_bp.route('/contracts/export', methods=['POST'])
+@login_required
+def start_contract_export():
+    """Queues a ZIP export of the company's contracts as PDFs (rendered in the background)."""
+    if not current_user.company_id:
+        abort(403)
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        return jsonify({'error': 'Acesso restrito a administradores e gestores.'}), 403
+
+    from services.contract_export_service import ContractExportService
+    data = request.get_json(silent=True) or {}
+    statuses = ContractExportService.parse_statuses(data.get('statuses'))
+    job = ContractExportService.enqueue(current_user.company_id, current_user.id, statuses)
+    ContractExportService.start(job.id)
+    return jsonify({'job': ContractExportService.progress(job)})
+
+@pdf_bp.route('/contracts/export/<int:job_id>')
+@login_required
+def contract_export_progress(job_id):
+    from services.contract_export_service import ContractExportService
+    job = ContractExportJob.query.get_or_404(job_id)
+    if job.company_id != current_user.company_id:
+        abort(403)
+    return jsonify({'job': ContractExportService.progress(job)})
+
+@pdf_bp.route('/contracts/export/<int:job_id>/download')
+@login_required
+def download_contract_export(job_id):
+    job = ContractExportJob.query.get_or_404(job_id)
+    if job.company_id != current_user.company_id:
+        abort(403)
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+
+    import os
+    from services.contract_export_service import ContractExportService
+    unavailable = "Arquivo da exportação não está disponível. Gere uma nova exportação.", 404
+    if job.status != 'completed':
+        return unavailable
+
+    if not job.file_path or not os.path.exists(job.file_path):
+        # Built on another instance: serve it from the bucket
+        url = ContractExportService.download_url(job)
+        return redirect(url) if url else unavailable
+
+    return send_file(
+        job.file_path,
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=f"Contratos_{job.finished_at.strftime('%Y-%m-%d') if job.finished_at else job.id}.zip",
+        conditional=True
+    )
+
 @pdf_bp.route('/debug-pillow')
 def debug_pillow():
     try:
@@ -1,8 +1,12 @@
-from flask import Blueprint, request, jsonify, flash, redirect, url_for, render_template, current_app, Response
+from flask import Blueprint, request, jsonify, flash, redirect, url_for, render_template, current_app, Response, stream_with_context, abort
 from flask_login import login_required, current_user
-from models import db, Integration, WhatsAppMessage, Lead, Client, QuickMessage
+from models import db, Integration, WhatsAppMessage, WhatsAppCampaign, Lead, Client, QuickMessage, ROLE_ADMIN, ROLE_MANAGER
 from services.whatsapp_service import WhatsAppService
+from services.realtime_service import RealtimeService
+from services.zapi_client import ZApiClient
+from services.broadcast_service import BroadcastService
 import json
+import time
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
 
@@ -60,6 +64,7 @@ def configure():
     
     try:
         db.session.commit()
+        ZApiClient.invalidate(current_user.company_id)
         flash('Configuração salva.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -70,8 +75,8 @@ def configure():
 @whatsapp_bp.route('/api/whatsapp/test', methods=['POST'])
 @login_required
 def test_connection():
-    config = WhatsAppService.get_config(current_user.company_id)
-    if not config:
+    client = ZApiClient.for_company(current_user.company_id)
+    if not client:
         # DEBUG LOGIC FOR VERCEL
         from models import Integration
         cid = current_user.company_id
@@ -83,13 +88,8 @@ def test_connection():
             
         return jsonify({'connected': False, 'message': "Configuração incompleta ou inválida."})
     
-    import requests
-    headers = {}
-    if config.get('client_token'): headers['Client-Token'] = config['client_token']
-    url = f"{config['api_url']}/instances/{config['instance_id']}/token/{config['token']}/status"
-    
     try:
-        res = requests.get(url, headers=headers, timeout=10)
+        res = client.get('status', timeout=10)
         data = res.json()
         
         if 'error' in data:
@@ -132,6 +132,14 @@ def setup_webhook():
              
         return jsonify({'error': err_msg}), 500
 
+@whatsapp_bp.route('/api/whatsapp/metrics')
+@login_required
+def zapi_metrics():
+    """Per-endpoint Z-API latency for this worker process."""
+    if not (current_user.is_super_admin or current_user.role == 'admin'):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify({'endpoints': ZApiClient.metrics(), 'pool_size': ZApiClient.POOL_SIZE})
+
 # --- VIEWS ---
 @whatsapp_bp.route('/whatsapp')
 @login_required
@@ -168,46 +176,56 @@ def get_history(type='lead', contact_id=None, id=None):
     if 'client' in request.endpoint: 
         type = 'client'
     
-    # Check Auth & Get Messages
-    filters = []
+    # Pagination: latest page by default, ?before=<message id> for older pages
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 200))
+        before = int(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+    # Check Auth & Resolve Thread (contact_uuid)
+    from models import Contact
+    legacy_filters = []
     
     if type == 'lead':
         obj = Lead.query.get_or_404(contact_id)
         if obj.company_id != current_user.company_id: return jsonify({'error': 'Unauthorized'}), 403
         norm_phone = WhatsAppService.normalize_phone(obj.phone)
-        filters.append(WhatsAppMessage.lead_id == obj.id)
-        if norm_phone:
-            filters.append(WhatsAppMessage.phone == norm_phone)
+        legacy_filters.append(WhatsAppMessage.lead_id == obj.id)
+        contact_uuid = obj.contact_uuid
     elif type == 'client':
         obj = Client.query.get_or_404(contact_id)
         if obj.company_id != current_user.company_id: return jsonify({'error': 'Unauthorized'}), 403
         norm_phone = WhatsAppService.normalize_phone(obj.phone)
-        filters.append(WhatsAppMessage.client_id == obj.id)
-        if norm_phone:
-            filters.append(WhatsAppMessage.phone == norm_phone)
+        legacy_filters.append(WhatsAppMessage.client_id == obj.id)
+        contact_uuid = obj.contact_uuid
     elif type == 'atendimento':
         # Unknown contact, lookup by phone
         norm_phone = WhatsAppService.normalize_phone(contact_id)
-        filters.append(WhatsAppMessage.phone == norm_phone)
-        filters.append(WhatsAppMessage.phone == contact_id) # Just in case
+        contact_uuid = None
     else:
         return jsonify({'error': 'Invalid type'}), 400
-        
-    msgs = WhatsAppMessage.query.filter(
-        WhatsAppMessage.company_id == current_user.company_id,
-        db.or_(*filters)
-    ).order_by(WhatsAppMessage.created_at.asc()).all()
+
+    # Every Contact linked to this thread: the lead/client's own and the one for its phone
+    contact_uuids = [contact_uuid] if contact_uuid else []
+    if norm_phone:
+        legacy_filters.append(WhatsAppMessage.phone == norm_phone)
+        contact = Contact.query.filter_by(company_id=current_user.company_id, phone=norm_phone).first()
+        if contact and contact.uuid not in contact_uuids:
+            contact_uuids.append(contact.uuid)
+
+    messages, has_more = WhatsAppService.get_thread_messages(
+        current_user.company_id,
+        contact_uuids=contact_uuids,
+        legacy_filters=legacy_filters,
+        before=before,
+        limit=limit
+    )
     
     return jsonify({
-        'messages': [{
-            'id': m.id,
-            'content': m.content,
-            'direction': m.direction,
-            'status': m.status,
-            'type': m.type or 'text',
-            'attachment_url': m.attachment_url,
-            'timestamp': m.created_at.isoformat()
-        } for m in msgs]
+        'messages': messages,
+        'has_more': has_more,
+        'next_before': messages[0]['id'] if has_more and messages else None
     })
 
 @whatsapp_bp.route('/api/whatsapp/send', methods=['POST'])
@@ -232,6 +250,11 @@ def send_msg():
 @whatsapp_bp.route('/api/whatsapp/send-media', methods=['POST'])
 @login_required
 def send_media():
+    # Reject oversized uploads before Werkzeug spools the body to disk
+    max_mb = current_app.config.get('WHATSAPP_MEDIA_MAX_MB', 16)
+    if request.content_length and request.content_length > (max_mb + 1) * 1024 * 1024:
+        return jsonify({'error': f'Arquivo excede o limite de {max_mb} MB.'}), 413
+
     if 'file' not in request.files: return jsonify({'error': 'No file'}), 400
     file = request.files['file']
     
@@ -258,6 +281,68 @@ def webhook(company_id):
         return jsonify({'error': str(e)}), 500
 
 # --- QUICK MESSAGES (CRUD) ---
+# --- BROADCAST CAMPAIGNS ---
+@whatsapp_bp.route('/whatsapp/campaigns')
+@login_required
+def campaigns():
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        abort(403)
+    from models import Pipeline, PipelineStage, User
+    campaigns_list = WhatsAppCampaign.query.filter_by(company_id=current_user.company_id)\
+        .order_by(WhatsAppCampaign.created_at.desc()).limit(50).all()
+    pipeline = Pipeline.query.filter_by(company_id=current_user.company_id).first()
+    stages = PipelineStage.query.filter_by(pipeline_id=pipeline.id).order_by(PipelineStage.order).all() if pipeline else []
+    users = User.query.filter_by(company_id=current_user.company_id).all()
+    return render_template('whatsapp_campaigns.html', campaigns=campaigns_list, stages=stages, users=users,
+                           filters=BroadcastService.clean_filters(request.args))
+
+@whatsapp_bp.route('/api/whatsapp/campaigns/preview')
+@login_required
+def campaign_preview():
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        return jsonify({'error': 'Forbidden'}), 403
+    targets = BroadcastService.resolve_targets(current_user.company_id, BroadcastService.clean_filters(request.args))
+    return jsonify({'count': len(targets)})
+
+@whatsapp_bp.route('/api/whatsapp/campaigns', methods=['POST'])
+@login_required
+def create_campaign():
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        return jsonify({'error': 'Forbidden'}), 403
+    data = request.get_json(silent=True) or request.form
+    try:
+        campaign = BroadcastService.create_campaign(
+            current_user.company_id, current_user.id,
+            (data.get('name') or '').strip(), data.get('message'),
+            BroadcastService.clean_filters(data)
+        )
+        BroadcastService.start(campaign.id)
+        return jsonify({'success': True, 'campaign': BroadcastService.progress(campaign)})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@whatsapp_bp.route('/api/whatsapp/campaigns/<int:id>')
+@login_required
+def campaign_progress(id):
+    campaign = WhatsAppCampaign.query.filter_by(id=id, company_id=current_user.company_id).first_or_404()
+    return jsonify(BroadcastService.progress(campaign))
+
+@whatsapp_bp.route('/api/whatsapp/campaigns/<int:id>/<string:action>', methods=['POST'])
+@login_required
+def campaign_action(id, action):
+    if current_user.role not in [ROLE_ADMIN, ROLE_MANAGER]:
+        return jsonify({'error': 'Forbidden'}), 403
+    status = {'pause': 'paused', 'resume': 'running', 'cancel': 'cancelled'}.get(action)
+    if not status:
+        return jsonify({'error': 'Ação inválida'}), 400
+    campaign = WhatsAppCampaign.query.filter_by(id=id, company_id=current_user.company_id).first_or_404()
+    try:
+        BroadcastService.set_status(campaign, status)
+        return jsonify(BroadcastService.progress(campaign))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
 @whatsapp_bp.route('/api/whatsapp/quick-messages', methods=['GET'])
 @login_required
 def list_quick_messages():
@@ -481,6 +566,74 @@ def get_unread_counts():
 @whatsapp_bp.route('/api/whatsapp/read/<string:phone>', methods=['POST'])
 @login_required
 def mark_read(phone):
-    """Marks a conversation as read."""
-    success = WhatsAppService.mark_as_read(current_user.company_id, phone)
+    """Marks a conversation as read (?contact_uuid= skips the phone lookup)."""
+    success = WhatsAppService.mark_as_read(current_user.company_id, phone, contact_uuid=request.args.get('contact_uuid'))
     return jsonify({'success': success})
+
+
+# --- REALTIME (SSE + Long-poll fallback) ---
+def _event_cursor():
+    """Resolves the client's cursor from Last-Event-ID (SSE reconnect) or ?since= (long-poll)."""
+    raw = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return RealtimeService.last_event_id()
+
+@whatsapp_bp.route('/api/whatsapp/stream')
+@login_required
+def event_stream():
+    """
+    Server-Sent Events channel for the tenant inbox (new messages, status changes, reads).
+    The stream is closed after REALTIME_STREAM_SECONDS so workers are recycled;
+    EventSource reconnects automatically sending Last-Event-ID.
+    Disabled by REALTIME_SSE (default off on serverless, where a stream pins a function instance).
+    """
+    if not current_app.config.get('REALTIME_SSE', True):
+        return jsonify({'error': 'SSE disabled'}), 404
+
+    company_id = current_user.company_id
+    since = _event_cursor()
+    max_age = current_app.config.get('REALTIME_STREAM_SECONDS', 300)
+    heartbeat = current_app.config.get('REALTIME_HEARTBEAT_SECONDS', 15)
+
+    # Release the DB connection: an idle stream must not hold a pool slot
+    db.session.remove()
+
+    def generate():
+        cursor = since
+        started = time.monotonic()
+        yield "retry: 3000\n\n"
+        while time.monotonic() - started < max_age:
+            events = RealtimeService.wait_for_events(company_id, cursor, timeout=heartbeat)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, event in events:
+                cursor = event_id
+                yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@whatsapp_bp.route('/api/whatsapp/events')
+@login_required
+def poll_events():
+    """Long-poll fallback for clients/proxies without SSE support."""
+    company_id = current_user.company_id
+    since = _event_cursor()
+    try:
+        timeout = min(float(request.args.get('timeout', 25)), 55)
+    except ValueError:
+        timeout = 25
+
+    db.session.remove()
+
+    events = RealtimeService.wait_for_events(company_id, since, timeout=timeout)
+    cursor = events[-1][0] if events else max(since, 0)
+    return jsonify({
+        'cursor': cursor,
+        'events': [dict(event, id=event_id) for event_id, event in events]
+    })
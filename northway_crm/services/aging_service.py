@@ -0,0 +1,142 @@
+import threading
+from datetime import date, timedelta
+from sqlalchemy import func, case
+from models import db, Transaction, Contract, Client
+from utils import get_now_br
+
+
+class AgingService:
+    """
+    Receivables aging (days overdue) per client.
+    One grouped query over the overdue range of ix_transaction_company_status_due builds every
+    bucket at once; the report is cached per tenant for the day (overdue buckets only move at
+    midnight), with an explicit refresh for same-day payments.
+    """
+
+    BUCKETS = (
+        ('d0_30', '0-30 dias', 0, 30),
+        ('d31_60', '31-60 dias', 31, 60),
+        ('d61_90', '61-90 dias', 61, 90),
+        ('d90_plus', '90+ dias', 91, None)
+    )
+    OPEN_STATUSES = ('pending', 'overdue')
+    DETAIL_LIMIT = 500
+
+    _cache = {} # (company_id, day) -> report
+    _cache_lock = threading.Lock()
+
+    @staticmethod
+    def client_column():
+        # Manual charges link the client directly; contract installments may only have contract_id
+        return func.coalesce(Transaction.client_id, Contract.client_id)
+
+    @staticmethod
+    def report(company_id, refresh=False, today=None):
+        today = today or date.today()
+        key = (company_id, today)
+        if not refresh:
+            with AgingService._cache_lock:
+                cached = AgingService._cache.get(key)
+            if cached:
+                return cached
+
+        report = AgingService._compute(company_id, today)
+        with AgingService._cache_lock:
+            # Keep only today's reports
+            for k in [k for k in AgingService._cache if k[1] != today]:
+                del AgingService._cache[k]
+            AgingService._cache[key] = report
+        return report
+
+    @staticmethod
+    def _compute(company_id, today):
+        client_id = AgingService.client_column()
+        sums = []
+        for key, _, min_days, max_days in AgingService.BUCKETS:
+            # days overdue between min and max  <=>  due_date between today-max and today-min
+            condition = Transaction.due_date <= today - timedelta(days=min_days)
+            if max_days is not None:
+                condition = condition & (Transaction.due_date >= today - timedelta(days=max_days))
+            sums.append(func.coalesce(func.sum(case((condition, Transaction.amount), else_=0)), 0).label(key))
+
+        rows = db.session.query(
+            client_id.label('client_id'),
+            Client.name,
+            *sums,
+            func.sum(Transaction.amount).label('total'),
+            func.count(Transaction.id).label('count'),
+            func.min(Transaction.due_date).label('oldest')
+        ).select_from(Transaction)\
+            .outerjoin(Contract, Transaction.contract_id == Contract.id)\
+            .outerjoin(Client, Client.id == client_id)\
+            .filter(
+                Transaction.company_id == company_id,
+                Transaction.status.in_(AgingService.OPEN_STATUSES),
+                Transaction.due_date < today
+            ).group_by(client_id, Client.name)\
+            .order_by(func.sum(Transaction.amount).desc()).all()
+
+        clients = []
+        totals = {key: 0.0 for key, *_ in AgingService.BUCKETS}
+        totals.update({'total': 0.0, 'count': 0})
+        for r in rows:
+            item = {
+                'client_id': r.client_id,
+                'client': r.name or 'Sem cliente',
+                'total': round(float(r.total or 0), 2),
+                'count': r.count,
+                'oldest_days': (today - r.oldest).days if r.oldest else 0
+            }
+            for key, *_ in AgingService.BUCKETS:
+                item[key] = round(float(getattr(r, key) or 0), 2)
+                totals[key] += item[key]
+            totals['total'] += item['total']
+            totals['count'] += item['count']
+            clients.append(item)
+
+        return {
+            'date': today.isoformat(),
+            'generated_at': get_now_br().strftime('%d/%m/%Y %H:%M'),
+            'buckets': [{'key': key, 'label': label} for key, label, *_ in AgingService.BUCKETS],
+            'totals': {k: round(v, 2) if isinstance(v, float) else v for k, v in totals.items()},
+            'clients': clients
+        }
+
+    @staticmethod
+    def bucket_for(days):
+        for key, label, min_days, max_days in AgingService.BUCKETS:
+            if days >= min_days and (max_days is None or days <= max_days):
+                return key
+        return AgingService.BUCKETS[0][0]
+
+    @staticmethod
+    def client_detail(company_id, client_id, today=None):
+        """Open overdue charges of one client (client_id None = charges without a client)."""
+        today = today or date.today()
+        client_col = AgingService.client_column()
+        query = db.session.query(
+            Transaction.id, Transaction.description, Transaction.amount, Transaction.due_date,
+            Transaction.status, Transaction.asaas_invoice_url, Transaction.contract_id
+        ).select_from(Transaction)\
+            .outerjoin(Contract, Transaction.contract_id == Contract.id)\
+            .filter(
+                Transaction.company_id == company_id,
+                Transaction.status.in_(AgingService.OPEN_STATUSES),
+                Transaction.due_date < today,
+                client_col == client_id if client_id is not None else client_col.is_(None)
+            ).order_by(Transaction.due_date).limit(AgingService.DETAIL_LIMIT)
+
+        items = []
+        for t in query.all():
+            days = (today - t.due_date).days
+            items.append({
+                'id': t.id,
+                'description': t.description,
+                'amount': t.amount,
+                'due_date': t.due_date.strftime('%d/%m/%Y'),
+                'days_overdue': days,
+                'bucket': AgingService.bucket_for(days),
+                'contract_id': t.contract_id,
+                'invoice_url': t.asaas_invoice_url
+            })
+        return items
@@ -0,0 +1,241 @@
+import os
+import re
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+
+ASAAS_API_URL = os.environ.get('ASAAS_API_URL', 'https://www.asaas.com/api/v3') # Use 'https://sandbox.asaas.com/api/v3' for test
+
+
+class AsaasClient:
+    """
+    Asaas API client, one instance per API key (platform key or a tenant's key).
+    - One pooled requests.Session (keep-alive) shared by every key.
+    - Default timeout on every call.
+    - Retry with backoff on 429/5xx, honoring Retry-After / RateLimit-Reset.
+      POSTs are only retried when Asaas certainly did not process them (429, connect timeout).
+    - Customer id cache by CPF/CNPJ, so each installment/subscription skips the search call.
+    - Per-endpoint latency/error counters.
+    """
+    POOL_SIZE = int(os.environ.get('ASAAS_POOL_SIZE', 20))
+    TIMEOUT = int(os.environ.get('ASAAS_TIMEOUT', 20))
+    MAX_RETRIES = int(os.environ.get('ASAAS_HTTP_RETRIES', 3))
+    MAX_WAIT = 60 # Never sleep longer than this on a single retry
+    CUSTOMER_TTL = int(os.environ.get('ASAAS_CUSTOMER_TTL', 3600))
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    _clients = {} # api_key -> AsaasClient
+    _clients_lock = threading.Lock()
+
+    _metrics = {} # endpoint -> {'count', 'errors', 'retries', 'total_ms', 'max_ms'}
+    _metrics_lock = threading.Lock()
+
+    def __init__(self, api_key, base_url=None):
+        self.api_key = api_key
+        self.base_url = (base_url or ASAAS_API_URL).rstrip('/')
+        self.headers = {'Content-Type': 'application/json', 'access_token': api_key}
+        self._customers = {} # cpf_cnpj digits -> (customer_id, expires_at)
+        self._customers_lock = threading.Lock()
+        self._not_before = 0.0 # Set when Asaas reports the rate-limit window is exhausted
+
+    # --- Factory ---
+    @classmethod
+    def for_key(cls, api_key=None):
+        """Shared client for the key (falls back to the platform ASAAS_API_KEY). None if no key."""
+        api_key = api_key or os.environ.get('ASAAS_API_KEY')
+        if not api_key:
+            return None
+        with cls._clients_lock:
+            client = cls._clients.get(api_key)
+            if client is None:
+                client = cls._clients[api_key] = cls(api_key)
+            return client
+
+    # --- HTTP ---
+    @classmethod
+    def get_session(cls):
+        if cls._session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=cls.POOL_SIZE)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    cls._session = session
+        return cls._session
+
+    @staticmethod
+    def endpoint_name(method, path):
+        """'GET payments/{id}' style label: ids are collapsed so metrics group per route."""
+        parts = ['{id}' if re.search(r'\d', p) else p for p in path.strip('/').split('/')]
+        return f"{method} {'/'.join(parts)}"
+
+    def _retry_wait(self, response, attempt):
+        """Seconds to wait before the next attempt, from rate-limit headers or exponential backoff."""
+        if response is not None:
+            for header in ('Retry-After', 'RateLimit-Reset'):
+                value = response.headers.get(header)
+                if value and value.isdigit():
+                    return min(int(value), self.MAX_WAIT)
+        # Full jitter so concurrent workers don't retry in lockstep
+        return random.uniform(0, min(2 ** attempt, self.MAX_WAIT))
+
+    def request(self, method, path, **kwargs):
+        """Calls `{base_url}/{path}`; returns the final requests.Response or raises the last network error."""
+        kwargs.setdefault('timeout', self.TIMEOUT)
+        endpoint = self.endpoint_name(method, path)
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        for attempt in range(self.MAX_RETRIES + 1):
+            wait = self._not_before - time.monotonic()
+            if wait > 0:
+                time.sleep(min(wait, self.MAX_WAIT))
+
+            started = time.perf_counter()
+            response, error = None, None
+            try:
+                response = self.get_session().request(method, url, headers=self.headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            self._record(endpoint, (time.perf_counter() - started) * 1000, response is None or response.status_code >= 400, attempt > 0)
+
+            if response is not None and response.headers.get('RateLimit-Remaining') == '0':
+                reset = response.headers.get('RateLimit-Reset', '')
+                if reset.isdigit():
+                    self._not_before = time.monotonic() + min(int(reset), self.MAX_WAIT)
+
+            if error is not None:
+                # Once a POST may have reached Asaas (read timeout, dropped connection) it is never resent blindly
+                retryable = method != 'POST' or isinstance(error, requests.ConnectTimeout)
+            else:
+                status = response.status_code
+                retryable = status == 429 or (status >= 500 and method != 'POST')
+
+            if not retryable or attempt == self.MAX_RETRIES:
+                if error is not None:
+                    raise error
+                return response
+
+            wait = self._retry_wait(response, attempt)
+            self._log(f"Asaas {endpoint} {'error ' + str(error) if error else response.status_code}; retry {attempt + 1} in {wait:.1f}s")
+            time.sleep(wait)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    @staticmethod
+    def error_message(response):
+        try:
+            errors = response.json().get('errors', [])
+            if isinstance(errors, list) and errors:
+                return errors[0].get('description', response.text)
+            return response.text
+        except Exception:
+            return f"Status {response.status_code}: {response.text}"
+
+    def call(self, method, path, **kwargs):
+        """(json, None) on HTTP 200, (None, error message) otherwise - the convention of asaas_service."""
+        try:
+            response = self.request(method, path, **kwargs)
+        except Exception as e:
+            return None, str(e)
+        if response.status_code == 200:
+            return response.json(), None
+        return None, self.error_message(response)
+
+    # --- Customers ---
+    @staticmethod
+    def _document_key(cpf_cnpj):
+        return re.sub(r'\D', '', str(cpf_cnpj or ''))
+
+    def cached_customer(self, cpf_cnpj):
+        key = self._document_key(cpf_cnpj)
+        with self._customers_lock:
+            cached = self._customers.get(key)
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+        return None
+
+    def remember_customer(self, cpf_cnpj, customer_id):
+        key = self._document_key(cpf_cnpj)
+        if key and customer_id:
+            with self._customers_lock:
+                self._customers[key] = (customer_id, time.monotonic() + self.CUSTOMER_TTL)
+
+    def get_or_create_customer(self, name, email, cpf_cnpj, phone=None, external_id=None):
+        """Returns (customer_id, error): cache, then search by CPF/CNPJ, then create."""
+        customer_id = self.cached_customer(cpf_cnpj)
+        if customer_id:
+            return customer_id, None
+
+        if self._document_key(cpf_cnpj):
+            data, err = self.call('GET', 'customers', params={'cpfCnpj': cpf_cnpj})
+            if data and data.get('totalCount', 0) > 0:
+                customer_id = data['data'][0]['id']
+                self.remember_customer(cpf_cnpj, customer_id)
+                return customer_id, None
+            if err:
+                self._log(f"⚠️ Error searching customer in Asaas: {err}")
+
+        payload = {
+            "name": name,
+            "email": email,
+            "cpfCnpj": cpf_cnpj,
+            "externalReference": str(external_id) if external_id else None
+        }
+        if phone:
+            payload["mobilePhone"] = phone
+
+        data, err = self.call('POST', 'customers', json=payload)
+        if not data:
+            return None, err
+        self.remember_customer(cpf_cnpj, data['id'])
+        return data['id'], None
+
+    # --- Metrics ---
+    @staticmethod
+    def _log(message):
+        if has_app_context():
+            current_app.logger.warning(message)
+        else:
+            print(message)
+
+    @classmethod
+    def _record(cls, endpoint, elapsed_ms, failed, retried):
+        with cls._metrics_lock:
+            m = cls._metrics.get(endpoint)
+            if m is None:
+                m = cls._metrics[endpoint] = {'count': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            m['count'] += 1
+            m['errors'] += 1 if failed else 0
+            m['retries'] += 1 if retried else 0
+            m['total_ms'] += elapsed_ms
+            m['max_ms'] = max(m['max_ms'], elapsed_ms)
+
+    @classmethod
+    def metrics(cls):
+        """Snapshot of per-endpoint timings for this process."""
+        with cls._metrics_lock:
+            return {
+                endpoint: {
+                    'count': m['count'],
+                    'errors': m['errors'],
+                    'retries': m['retries'],
+                    'avg_ms': round(m['total_ms'] / m['count'], 1) if m['count'] else 0,
+                    'max_ms': round(m['max_ms'], 1)
+                } for endpoint, m in cls._metrics.items()
+            }
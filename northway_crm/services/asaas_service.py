@@ -1,73 +1,37 @@
-import os
-import requests
-import json
 from datetime import datetime
-from flask import current_app
+from services.asaas_client import AsaasClient
 
-ASAAS_API_URL = os.environ.get('ASAAS_API_URL', 'https://www.asaas.com/api/v3') # Use 'https://sandbox.asaas.com/api/v3' for test
+# Thin functional API over AsaasClient (pooled session, timeouts, retries, customer cache).
+# Every function keeps its historical return convention.
 
-def get_headers(api_key=None):
-    token = api_key or os.environ.get('ASAAS_API_KEY')
-    return {
-        'Content-Type': 'application/json',
-        'access_token': token
-    }
+def _client(api_key=None):
+    client = AsaasClient.for_key(api_key)
+    if not client:
+        print("❌ ERROR: ASAAS_API_KEY not found.")
+    return client
 
 def create_customer(name, email, cpf_cnpj, phone=None, external_id=None, api_key=None):
     """
     Creates or Retrieves a customer in Asaas.
     """
-    token = api_key or os.environ.get('ASAAS_API_KEY')
-    if not token:
-        print("❌ ERROR: ASAAS_API_KEY not found.")
+    client = _client(api_key)
+    if not client:
         return None, "ASAAS_API_KEY Missing"
 
-    # First, try to find existing customer by CPF/CNPJ to avoid duplicates
-    try:
-        search_url = f"{ASAAS_API_URL}/customers?cpfCnpj={cpf_cnpj}"
-        response = requests.get(search_url, headers=get_headers(token))
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('totalCount', 0) > 0:
-                print(f"✅ Customer found in Asaas: {data['data'][0]['id']}")
-                return data['data'][0]['id'], None
-    except Exception as e:
-        print(f"⚠️ Error searching customer in Asaas: {e}")
-
-    # If not found, create new
-    payload = {
-        "name": name,
-        "email": email,
-        "cpfCnpj": cpf_cnpj,
-        "externalReference": str(external_id) if external_id else None
-    }
-    if phone:
-        payload["mobilePhone"] = phone
-
-    try:
-        response = requests.post(f"{ASAAS_API_URL}/customers", json=payload, headers=get_headers(token))
-        if response.status_code == 200:
-            return response.json()['id'], None
-        else:
-            error_data = response.json()
-            error_msg = error_data.get('errors', [{}])[0].get('description', response.text)
-            print(f"❌ Error creating customer in Asaas: {error_msg}")
-            return None, error_msg
-    except Exception as e:
-        print(f"❌ Exception creating customer: {e}")
-        return None, str(e)
+    customer_id, err = client.get_or_create_customer(name, email, cpf_cnpj, phone=phone, external_id=external_id)
+    if err:
+        print(f"❌ Error creating customer in Asaas: {err}")
+    return customer_id, err
 
 def get_subscription(subscription_id, api_key=None):
     """
     Retrieves subscription details to check status/validity.
     """
-    try:
-        response = requests.get(f"{ASAAS_API_URL}/subscriptions/{subscription_id}", headers=get_headers(api_key))
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except Exception:
+    client = _client(api_key)
+    if not client:
         return None
+    data, _ = client.call('GET', f"subscriptions/{subscription_id}")
+    return data
 
 def create_subscription(customer_id, value, next_due_date, cycle='MONTHLY', description="NorthWay CRM Subscription", api_key=None):
     """
@@ -82,63 +46,51 @@ def create_subscription(customer_id, value, next_due_date, cycle='MONTHLY', desc
         "description": description
     }
     
-    try:
-        response = requests.post(f"{ASAAS_API_URL}/subscriptions", json=payload, headers=get_headers(api_key))
-        if response.status_code == 200:
-            return response.json(), None
-        else:
-             print(f"❌ Error creating subscription: {response.text}")
-             error_data = response.json()
-             error_msg = error_data.get('errors', [{}])[0].get('description', response.text)
-             return None, error_msg
-    except Exception as e:
-        print(f"❌ Exception creating subscription: {e}")
-        return None, str(e)
+    client = _client(api_key)
+    if not client:
+        return None, "ASAAS_API_KEY Missing"
+    data, err = client.call('POST', 'subscriptions', json=payload)
+    if err:
+        print(f"❌ Error creating subscription: {err}")
+    return data, err
 
 def get_subscription_payments(subscription_id, api_key=None):
     """
     Get pending payments for a subscription to redirect user to payment page.
     """
-    try:
-        response = requests.get(f"{ASAAS_API_URL}/subscriptions/{subscription_id}/payments", headers=get_headers(api_key))
-        if response.status_code == 200:
-            return response.json()['data']
-        return []
-    except Exception as e:
+    client = _client(api_key)
+    if not client:
         return []
+    data, _ = client.call('GET', f"subscriptions/{subscription_id}/payments")
+    return data.get('data', []) if data else []
 
 def delete_subscription(subscription_id, api_key=None):
     """
     Cancels a subscription in Asaas (removes pending boletos).
     """
-    try:
-        response = requests.delete(f"{ASAAS_API_URL}/subscriptions/{subscription_id}", headers=get_headers(api_key))
-        if response.status_code == 200:
-            print(f"✅ Subscription {subscription_id} deleted.")
-            return True, None
-        else:
-            error_data = response.json()
-            error_msg = error_data.get('errors', [{}])[0].get('description', response.text)
-            print(f"⚠️ Error deleting subscription: {error_msg}")
-            return False, error_msg
-    except Exception as e:
-        return False, str(e)
+    client = _client(api_key)
+    if not client:
+        return False, "ASAAS_API_KEY Missing"
+    data, err = client.call('DELETE', f"subscriptions/{subscription_id}")
+    if err:
+        print(f"⚠️ Error deleting subscription: {err}")
+        return False, err
+    print(f"✅ Subscription {subscription_id} deleted.")
+    return True, None
 
 def cancel_payment(payment_id, api_key=None):
     """
     Cancels a specific payment (Cobrança) in Asaas.
     """
-    try:
-        response = requests.delete(f"{ASAAS_API_URL}/payments/{payment_id}", headers=get_headers(api_key))
-        if response.status_code == 200:
-            print(f"✅ Payment {payment_id} cancelled/deleted.")
-            return True, None
-        else:
-            error_data = response.json()
-            print(f"⚠️ Error cancelling payment: {error_msg}")
-            return False, error_msg
-    except Exception as e:
-        return False, str(e)
+    client = _client(api_key)
+    if not client:
+        return False, "ASAAS_API_KEY Missing"
+    data, err = client.call('DELETE', f"payments/{payment_id}")
+    if err:
+        print(f"⚠️ Error cancelling payment: {err}")
+        return False, err
+    print(f"✅ Payment {payment_id} cancelled/deleted.")
+    return True, None
 
 def create_payment(customer_id, value, due_date, description, external_ref=None, api_key=None):
     """
@@ -153,16 +105,25 @@ def create_payment(customer_id, value, due_date, description, external_ref=None,
         "externalReference": str(external_ref) if external_ref else None
     }
     
-    try:
-        response = requests.post(f"{ASAAS_API_URL}/payments", json=payload, headers=get_headers(api_key))
-        if response.status_code == 200:
-            return response.json(), None
-        else:
-             error_data = response.json()
-             error_msg = error_data.get('errors', [{}])[0].get('description', response.text)
-             return None, error_msg
-    except Exception as e:
-        return None, str(e)
+    client = _client(api_key)
+    if not client:
+        return None, "ASAAS_API_KEY Missing"
+    return client.call('POST', 'payments', json=payload)
+
+def find_payment_by_reference(external_ref, api_key=None):
+    """
+    Looks up a non-deleted payment by externalReference (our Transaction.id).
+    Used before retrying a create so an attempt that reached Asaas is never duplicated.
+    Returns (payment or None, error).
+    """
+    client = _client(api_key)
+    if not client:
+        return None, "ASAAS_API_KEY Missing"
+    data, err = client.call('GET', 'payments', params={'externalReference': str(external_ref)})
+    if err:
+        return None, err
+    payments = [p for p in data.get('data', []) if not p.get('deleted')]
+    return (payments[0] if payments else None), None
 
 # --- NFS-e Logic ---
 
@@ -186,32 +147,34 @@ def issue_nfse(payment_id, service_code, iss_rate, description, api_key=None):
         "effectiveDate": datetime.now().strftime('%Y-%m-%d') # Emit today
     }
     
-    try:
-        response = requests.post(f"{ASAAS_API_URL}/invoices", json=payload, headers=get_headers(api_key))
-        if response.status_code == 200:
-             return response.json(), None
-        else:
-             error_data = response.json()
-             error_msg = error_data.get('errors', [{}])[0].get('description', response.text)
-             return None, error_msg
-             
-    except Exception as e:
-        return None, str(e)
+    client = _client(api_key)
+    if not client:
+        return None, "ASAAS_API_KEY Missing"
+    return client.call('POST', 'invoices', json=payload)
+
+def find_nfse_by_payment(payment_id, api_key=None):
+    """
+    Looks up a non-cancelled NFS-e already requested for a payment.
+    Used before re-issuing when a previous attempt may have reached Asaas.
+    Returns (invoice or None, error).
+    """
+    client = _client(api_key)
+    if not client:
+        return None, "ASAAS_API_KEY Missing"
+    data, err = client.call('GET', 'invoices', params={'payment': payment_id})
+    if err:
+        return None, err
+    invoices = [i for i in data.get('data', []) if i.get('status') not in ('CANCELED', 'CANCELLED')]
+    return (invoices[0] if invoices else None), None
 
 def cancel_nfse(nfse_id, api_key=None):
     """
     Cancels an existing NFS-e.
     """
-    try:
-        response = requests.post(f"{ASAAS_API_URL}/invoices/{nfse_id}/cancel", headers=get_headers(api_key))
-        if response.status_code == 200:
-             return response.json(), None
-        else:
-             error_data = response.json()
-             error_msg = error_data.get('errors', [{}])[0].get('description', response.text)
-             return None, error_msg
-    except Exception as e:
-        return None, str(e)
+    client = _client(api_key)
+    if not client:
+        return None, "ASAAS_API_KEY Missing"
+    return client.call('POST', f"invoices/{nfse_id}/cancel")
 
 def create_webhook(webhook_url, email, api_key=None):
     """
@@ -231,39 +194,16 @@ def create_webhook(webhook_url, email, api_key=None):
         ]
     }
     
-    headers = get_headers(api_key)
-    
-    try:
-        # 1. Try to list existing webhooks
-        get_res = requests.get(f"{ASAAS_API_URL}/webhooks", headers=headers)
-        existing_id = None
-        
-        if get_res.status_code == 200:
-            webhooks = get_res.json().get('data', [])
-            if webhooks:
-                # Assuming single webhook or taking the first one to update
-                existing_id = webhooks[0].get('id')
-        
-        # 2. Update or Create
-        if existing_id:
-             # Try PUT for update
-             response = requests.put(f"{ASAAS_API_URL}/webhooks/{existing_id}", json=payload, headers=headers)
-        else:
-             response = requests.post(f"{ASAAS_API_URL}/webhooks", json=payload, headers=headers)
-        
-        if response.status_code == 200:
-             return response.json(), None
-        else:
-             try:
-                 error_data = response.json()
-                 # Handle list of errors or single object
-                 errors = error_data.get('errors', [])
-                 if isinstance(errors, list) and errors:
-                     error_msg = errors[0].get('description', response.text)
-                 else:
-                     error_msg = str(error_data)
-             except:
-                 error_msg = f"Status {response.status_code}: {response.text}"
-             return None, error_msg
-    except Exception as e:
-        return None, str(e)
+    client = _client(api_key)
+    if not client:
+        return None, "ASAAS_API_KEY Missing"
+
+    # 1. Try to list existing webhooks (assuming single webhook or taking the first one to update)
+    existing, _ = client.call('GET', 'webhooks')
+    webhooks = existing.get('data', []) if existing else []
+    existing_id = webhooks[0].get('id') if webhooks else None
+
+    # 2. Update or Create
+    if existing_id:
+        return client.call('PUT', f"webhooks/{existing_id}", json=payload)
+    return client.call('POST', 'webhooks', json=payload)
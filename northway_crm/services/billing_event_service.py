@@ -0,0 +1,292 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+from sqlalchemy.exc import IntegrityError
+from models import db, Company, BillingEvent, Transaction, User, NFSELog
+from services.nfse_service import NFSeService
+from utils import get_now_br
+
+
+class BillingEventService:
+    """
+    Asaas webhook events are stored (deduplicated on BillingEvent.idempotency_key) and
+    applied in arrival order - platform subscription status for companies, payment status
+    for tenant transactions - and NFS-e issuance is handed to the NFSeService queue.
+    The webhook applies its own event at once; only NFS-e issuance (and events whose first
+    attempt failed) wait for the runner or the cron, which drains both queues inline.
+    """
+
+    PAID_EVENTS = ('PAYMENT_CONFIRMED', 'PAYMENT_RECEIVED')
+    BATCH_SIZE = 50
+    MAX_ATTEMPTS = 3
+    LOCK_MINUTES = 10 # A row stuck in 'processing' longer than this had its worker die
+
+    # Process-wide state: a single runner drains events and the NFS-e queue
+    _running = False
+    _wake = False
+    _lock = threading.Lock()
+
+    # --- Intake ---
+    @staticmethod
+    def idempotency_key(data):
+        payment = data.get('payment') or {}
+        subscription = data.get('subscription') or {}
+        reference = payment.get('id') or subscription.get('id') or data.get('id')
+        return f"{reference}_{data.get('event')}"
+
+    @staticmethod
+    def is_duplicate(key):
+        """Indexed lookup on the unique idempotency_key, done before any other webhook work."""
+        return db.session.query(BillingEvent.id).filter_by(idempotency_key=key).first() is not None
+
+    @staticmethod
+    def record(data):
+        """Stores the webhook payload. Returns the BillingEvent, or None if it was already received."""
+        event = BillingEvent(
+            event_type=(data.get('event') or 'UNKNOWN')[:50],
+            payload=data,
+            idempotency_key=BillingEventService.idempotency_key(data),
+            status='received'
+        )
+        db.session.add(event)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Asaas re-delivery of an event we already have
+            return None
+        return event
+
+    # --- Runner ---
+    @staticmethod
+    def start():
+        """Wakes the runner, starting it in a background thread if none is running in this process."""
+        with BillingEventService._lock:
+            BillingEventService._wake = True
+            if BillingEventService._running:
+                return False
+            BillingEventService._running = True
+
+        app = current_app._get_current_object()
+        threading.Thread(target=BillingEventService._run, args=(app,), name='billing-events', daemon=True).start()
+        return True
+
+    @staticmethod
+    def drain(app, budget_seconds):
+        """
+        Cron entry point: applies pending events and issues due NFS-e in the caller's request
+        until both queues are empty or the time budget runs out (serverless: a background
+        thread freezes once the response is sent). Returns counts and whether it drained.
+        """
+        deadline = time.monotonic() + budget_seconds
+        events, invoices = 0, 0
+        while time.monotonic() < deadline:
+            handled = BillingEventService.process_pending(app)
+            issued = NFSeService.process_pending(app)
+            events += handled
+            invoices += issued
+            if not handled and not issued:
+                return {'events': events, 'nfse': invoices, 'drained': True}
+        return {'events': events, 'nfse': invoices, 'drained': False}
+
+    @staticmethod
+    def _run(app):
+        try:
+            with app.app_context():
+                while True:
+                    with BillingEventService._lock:
+                        BillingEventService._wake = False
+
+                    handled = BillingEventService.process_pending(app)
+                    issued = NFSeService.process_pending(app)
+                    if handled or issued:
+                        continue
+
+                    # Exit only if no webhook arrived while this round ran
+                    with BillingEventService._lock:
+                        if not BillingEventService._wake:
+                            BillingEventService._running = False
+                            return
+        except Exception as e:
+            app.logger.error(f"Billing events runner error: {e}")
+        with BillingEventService._lock:
+            BillingEventService._running = False
+
+    @staticmethod
+    def process_pending(app):
+        """Applies up to BATCH_SIZE received events in arrival order. Returns how many were handled."""
+        now = get_now_br()
+        BillingEvent.query.filter(
+            BillingEvent.status == 'processing',
+            BillingEvent.locked_at < now - timedelta(minutes=BillingEventService.LOCK_MINUTES)
+        ).update({'status': 'received'}, synchronize_session=False)
+        db.session.commit()
+
+        ids = [r.id for r in BillingEvent.query.filter_by(status='received')
+               .with_entities(BillingEvent.id).order_by(BillingEvent.id)
+               .limit(BillingEventService.BATCH_SIZE).all()]
+        if ids:
+            BillingEventService.process_batch(app, ids)
+        return len(ids)
+
+    @staticmethod
+    def process_batch(app, ids, notify=True):
+        """
+        Claims the given received events and applies them in one transaction: transactions and
+        companies are loaded with one query each, and every event runs in a savepoint so a bad
+        payload only fails itself. notify=False skips the activation e-mails (replays).
+        Returns {status: count}.
+        """
+        claimed = BillingEvent.query.filter(BillingEvent.id.in_(ids), BillingEvent.status == 'received').update({
+            'status': 'processing', 'locked_at': get_now_br(),
+            'attempts': db.func.coalesce(BillingEvent.attempts, 0) + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return {}
+
+        events = BillingEvent.query.filter(BillingEvent.id.in_(ids), BillingEvent.status == 'processing')\
+            .order_by(BillingEvent.id).all()
+        payments = [(e.payload or {}).get('payment') or {} for e in events]
+
+        payment_ids = {p['id'] for p in payments if p.get('id')}
+        transactions = {t.asaas_id: t for t in Transaction.query.filter(Transaction.asaas_id.in_(payment_ids)).all()} if payment_ids else {}
+
+        customer_ids = {BillingEventService.customer_id(e.payload or {}) for e in events} - {None}
+        companies = {c.asaas_customer_id: c for c in Company.query.filter(Company.asaas_customer_id.in_(customer_ids)).all()} if customer_ids else {}
+
+        summary, activated = {}, []
+        for event in events:
+            try:
+                with db.session.begin_nested():
+                    target = BillingEventService.apply(event, transactions, companies)
+                    event.status = 'ignored' if target is None else 'processed'
+                    event.processed_at = datetime.utcnow()
+                    event.last_error = None
+                if isinstance(target, Company) and event.event_type in BillingEventService.PAID_EVENTS:
+                    activated.append((target, (event.payload or {}).get('payment') or {}))
+            except Exception as e:
+                event.status = 'failed' if (event.attempts or 0) >= BillingEventService.MAX_ATTEMPTS else 'received'
+                event.last_error = str(e)
+                app.logger.error(f"Billing event {event.id} ({event.event_type}) error: {e}")
+            summary[event.status] = summary.get(event.status, 0) + 1
+        db.session.commit()
+
+        if notify:
+            for company, payment in activated:
+                BillingEventService._send_activation_email(company, payment)
+        return summary
+
+    # --- Handlers ---
+    @staticmethod
+    def customer_id(data):
+        return ((data.get('payment') or {}).get('customer')
+                or (data.get('subscription') or {}).get('customer'))
+
+    @staticmethod
+    def apply(event, transactions=None, companies=None):
+        """
+        Applies one event. transactions / companies are optional preloaded maps
+        (asaas_id -> Transaction, asaas_customer_id -> Company).
+        Returns the Transaction or Company it changed, or None if the event matched neither.
+        """
+        data = event.payload or {}
+        payment_id = (data.get('payment') or {}).get('id')
+
+        # Tenant charge (contract installment / manual charge)
+        if transactions is not None:
+            transaction = transactions.get(payment_id)
+        else:
+            transaction = Transaction.query.filter_by(asaas_id=payment_id).first() if payment_id else None
+        if transaction:
+            event.company_id = transaction.company_id
+            BillingEventService._apply_transaction(transaction, event.event_type, data)
+            return transaction
+
+        # Platform subscription of a company
+        customer_id = BillingEventService.customer_id(data)
+        if companies is not None:
+            company = companies.get(customer_id)
+        else:
+            company = Company.query.filter_by(asaas_customer_id=customer_id).first() if customer_id else None
+        if not company:
+            return None
+        event.company_id = company.id
+        BillingEventService._apply_company(company, event.event_type)
+        return company
+
+    @staticmethod
+    def _apply_transaction(transaction, event_type, data):
+        db.session.add(NFSELog(
+            company_id=transaction.company_id,
+            transaction_id=transaction.id,
+            status=event_type[:20],
+            payload=data
+        ))
+
+        if event_type in BillingEventService.PAID_EVENTS:
+            transaction.status = 'paid'
+            transaction.paid_date = transaction.paid_date or get_now_br().date()
+
+            if transaction.contract and transaction.contract.emit_nfse \
+                    and transaction.nfse_status not in ('queued', 'issuing', 'issued'):
+                NFSeService.enqueue(transaction)
+
+        elif event_type in ['PAYMENT_REFUNDED', 'PAYMENT_REVERSED']:
+            transaction.status = 'refunded'
+            # TODO: Cancel NFS-e logic (Asaas doesn't always allow auto-cancel via API for all cities)
+
+        elif event_type == 'PAYMENT_OVERDUE':
+            transaction.status = 'overdue'
+
+    @staticmethod
+    def _apply_company(company, event_type):
+        if event_type in BillingEventService.PAID_EVENTS:
+            company.payment_status = 'active'
+            company.platform_inoperante = False
+            company.overdue_since = None
+            company.subscription_status = 'active'
+
+        elif event_type == 'PAYMENT_OVERDUE':
+            company.payment_status = 'overdue'
+            # Only set overdue_since if it's new
+            if not company.overdue_since:
+                company.overdue_since = datetime.utcnow()
+
+        elif event_type in ['SUBSCRIPTION_DELETED', 'SUBSCRIPTION_CANCELLED']:
+            company.payment_status = 'canceled'
+            company.platform_inoperante = True
+            company.subscription_status = 'canceled'
+
+    @staticmethod
+    def _send_activation_email(company, payment):
+        from services.email_service import EmailService
+        from models import EMAIL_TEMPLATES
+
+        admin_user = User.query.filter_by(company_id=company.id).first() # Notify first user/admin
+        if not admin_user:
+            return
+
+        plan_name = 'Plano Anual' if company.plan_type == 'annual' else 'Plano Mensal'
+        try:
+            # No request here: build the external link against the public app URL
+            with current_app.test_request_context(base_url=os.getenv('APP_URL', 'https://crm.northwaycompany.com.br')):
+                dashboard_url = url_for('dashboard.home', _external=True)
+
+            EmailService.send_email(
+                to=admin_user.email,
+                subject="Pagamento Confirmado - NorthWay",
+                template=EMAIL_TEMPLATES.subscription_active,
+                context={
+                    'user': admin_user,
+                    'plan_name': plan_name,
+                    'amount': f"R$ {payment.get('value', '')}",
+                    'next_billing_date': (datetime.now() + timedelta(days=365 if company.plan_type == 'annual' else 30)).strftime('%d/%m/%Y'),
+                    'dashboard_url': dashboard_url
+                },
+                company_id=company.id,
+                user_id=admin_user.id
+            )
+        except Exception as ex:
+            current_app.logger.warning(f"Failed to send activation email to company {company.id}: {ex}")
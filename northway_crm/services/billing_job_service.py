@@ -0,0 +1,322 @@
+import time
+import random
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import update
+from models import db, Transaction, BillingJob, Integration, RevenueRollup
+from services.asaas_service import create_customer, create_payment, find_payment_by_reference
+from utils import get_now_br, RateLimiter
+
+
+class BillingJobService:
+    """
+    Generates a contract's Asaas boletos outside the request.
+    Installments are inserted locally first (billing_status='queued'); the runner claims
+    each row atomically and creates the payment with externalReference = Transaction.id,
+    looking it up before any retry so an attempt that reached Asaas is never duplicated.
+    """
+
+    # Process-wide state: one limiter per Asaas API key, one runner per job
+    _limiters = {}
+    _active = set()
+    _lock = threading.Lock()
+
+    # --- Installments ---
+    @staticmethod
+    def add_months(sourcedate, months):
+        month = sourcedate.month - 1 + months
+        year = sourcedate.year + month // 12
+        month = month % 12 + 1
+        day = min(sourcedate.day, [31, 29 if year % 4 == 0 and not year % 100 == 0 or year % 400 == 0 else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
+        return date(year, month, day)
+
+    @staticmethod
+    def create_installments(contract, qtd_p, val_p, start_d, venc, queue):
+        """Bulk-inserts the contract's installments; queue=True marks them for boleto generation."""
+        today = date.today()
+        rows = []
+        for i in range(qtd_p):
+            target_m = BillingJobService.add_months(start_d, i)
+            try: due_d = date(target_m.year, target_m.month, venc)
+            except ValueError: due_d = date(target_m.year, target_m.month, 28)
+
+            # Asaas rejects past dates for new boletos
+            if due_d < today:
+                due_d = today
+
+            rows.append({
+                'contract_id': contract.id, 'client_id': contract.client_id, 'company_id': contract.company_id,
+                'description': f"Parcela {i+1}/{qtd_p}", 'amount': val_p, 'due_date': due_d, 'status': 'pending',
+                'installment_number': i+1, 'total_installments': qtd_p,
+                'nfse_status': 'pending' if contract.emit_nfse else 'not_supported',
+                'billing_status': 'queued' if queue else None,
+                'created_at': get_now_br()
+            })
+        db.session.bulk_insert_mappings(Transaction, rows)
+
+        # Bulk inserts skip the after_flush hook that keeps the goals rollup in sync
+        if current_app.config.get('GOALS_REVENUE_ROLLUP'):
+            for year in {r['due_date'].year for r in rows}:
+                RevenueRollup.refresh(contract.company_id, year, db.session.connection())
+        return len(rows)
+
+    @staticmethod
+    def get_api_key(company_id):
+        integration = Integration.query.filter_by(company_id=company_id, service='asaas', is_active=True).first()
+        return integration.api_key if integration and integration.api_key else None
+
+    # --- Lifecycle ---
+    @staticmethod
+    def enqueue(contract, user_id, kind):
+        """Creates (or reuses the active) job for the contract's queued installments. Returns None if nothing is queued."""
+        pending = Transaction.query.filter(
+            Transaction.contract_id == contract.id,
+            Transaction.billing_status.in_(['queued', 'verify'])
+        ).count()
+        if not pending:
+            return None
+
+        job = contract.billing_jobs.filter(BillingJob.status.in_(['queued', 'running'])).order_by(BillingJob.id.desc()).first()
+        if job:
+            job.total_count = (job.created_count or 0) + (job.failed_count or 0) + pending
+        else:
+            job = BillingJob(
+                company_id=contract.company_id, contract_id=contract.id, created_by_id=user_id,
+                kind=kind, status='queued', total_count=pending
+            )
+            db.session.add(job)
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def start(job_id):
+        """Starts the job runner in a background thread (no-op if already running here)."""
+        with BillingJobService._lock:
+            if job_id in BillingJobService._active:
+                return False
+            BillingJobService._active.add(job_id)
+
+        app = current_app._get_current_object()
+        threading.Thread(
+            target=BillingJobService._run, args=(app, job_id),
+            name=f'billing-{job_id}', daemon=True
+        ).start()
+        return True
+
+    @staticmethod
+    def resume_stalled():
+        """Restarts jobs whose worker died (deploy, serverless freeze) in background threads."""
+        ids = [j.id for j in BillingJob.query.filter(
+            BillingJob.status.in_(['queued', 'running'])
+        ).with_entities(BillingJob.id).all()]
+        return [jid for jid in ids if BillingJobService.start(jid)]
+
+    @staticmethod
+    def drain(app, budget_seconds):
+        """
+        Cron entry point: runs open jobs in the caller's request until they finish or the time
+        budget runs out (serverless: the threads started on sign/regenerate freeze once the
+        response is sent). A job cut by the budget stays 'running' for the next cron call.
+        Returns the ids of the jobs it worked on.
+        """
+        deadline = time.monotonic() + budget_seconds
+        ids = [j.id for j in BillingJob.query.filter(
+            BillingJob.status.in_(['queued', 'running'])
+        ).with_entities(BillingJob.id).order_by(BillingJob.id).all()]
+
+        ran = []
+        for job_id in ids:
+            if time.monotonic() >= deadline:
+                break
+            with BillingJobService._lock:
+                if job_id in BillingJobService._active:
+                    continue
+                BillingJobService._active.add(job_id)
+            BillingJobService._run(app, job_id, deadline)
+            ran.append(job_id)
+        return ran
+
+    @staticmethod
+    def progress(job):
+        transactions = Transaction.query.filter_by(contract_id=job.contract_id)\
+            .filter(Transaction.billing_status.isnot(None))\
+            .order_by(Transaction.due_date, Transaction.id).all()
+        return {
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'total': job.total_count or 0,
+            'created': job.created_count or 0,
+            'failed': job.failed_count or 0,
+            'pending': sum(1 for t in transactions if t.billing_status in ('queued', 'sending', 'verify')),
+            'last_error': job.last_error,
+            'transactions': [{
+                'id': t.id,
+                'description': t.description,
+                'due_date': t.due_date.strftime('%d/%m/%Y'),
+                'amount': t.amount,
+                'billing_status': t.billing_status,
+                'billing_error': t.billing_error,
+                'invoice_url': t.asaas_invoice_url
+            } for t in transactions],
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+
+    # --- Runner ---
+    @staticmethod
+    def get_limiter(api_key):
+        per_minute = current_app.config.get('ASAAS_RATE_PER_MINUTE', 60)
+        with BillingJobService._lock:
+            limiter = BillingJobService._limiters.get(api_key)
+            if limiter is None:
+                limiter = BillingJobService._limiters[api_key] = RateLimiter(per_minute)
+            return limiter
+
+    @staticmethod
+    def _bump(job_id, column):
+        col = getattr(BillingJob, column)
+        db.session.execute(update(BillingJob).where(BillingJob.id == job_id).values({column: col + 1}))
+
+    @staticmethod
+    def _finish(job, status, error=None):
+        job.status = status
+        job.last_error = error
+        job.finished_at = get_now_br()
+        db.session.commit()
+
+    @staticmethod
+    def _run(app, job_id, deadline=None):
+        try:
+            with app.app_context():
+                job = BillingJob.query.get(job_id)
+                if not job or job.status not in ('queued', 'running'):
+                    return
+
+                api_key = BillingJobService.get_api_key(job.company_id)
+                if not api_key:
+                    BillingJobService._finish(job, 'failed', 'Integração Asaas não configurada.')
+                    return
+
+                client = job.contract.client
+                customer_id, err = create_customer(
+                    name=client.name, email=client.email, cpf_cnpj=client.document,
+                    phone=client.phone, external_id=client.id, api_key=api_key
+                )
+                if not customer_id:
+                    # Rows stay queued: "Regerar Boletos" or the cron resumes the job
+                    BillingJobService._finish(job, 'failed', f"Erro ao criar cliente no Asaas: {err}")
+                    return
+
+                # Rows claimed by a worker that died mid-call may exist in Asaas: verify before creating
+                Transaction.query.filter_by(contract_id=job.contract_id, billing_status='sending')\
+                    .update({'billing_status': 'verify'}, synchronize_session=False)
+
+                job.status = 'running'
+                job.started_at = job.started_at or get_now_br()
+                job.last_error = None
+                db.session.commit()
+
+                limiter = BillingJobService.get_limiter(api_key)
+                workers = app.config.get('ASAAS_CONCURRENCY', 4)
+                contract_id = job.contract_id
+
+                # Rows that errored go back to 'verify'; each row is tried once per run
+                attempted = set()
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'billing-{job_id}') as pool:
+                    while True:
+                        if deadline and time.monotonic() >= deadline:
+                            return # Out of budget: the job stays 'running' for the next cron call
+                        query = Transaction.query.filter(
+                            Transaction.contract_id == contract_id,
+                            Transaction.billing_status.in_(['queued', 'verify'])
+                        )
+                        if attempted:
+                            query = query.filter(Transaction.id.notin_(attempted))
+                        batch = [r.id for r in query.with_entities(Transaction.id)
+                                 .order_by(Transaction.due_date, Transaction.id).limit(workers * 5).all()]
+                        if not batch:
+                            break
+                        attempted.update(batch)
+                        list(pool.map(lambda tid: BillingJobService._create_one(app, job_id, tid, customer_id, api_key, limiter), batch))
+                        db.session.expire_all()
+
+                job = BillingJob.query.get(job_id)
+                BillingJobService._finish(job, 'completed')
+        except Exception as e:
+            app.logger.error(f"Billing job {job_id} runner error: {e}")
+        finally:
+            with BillingJobService._lock:
+                BillingJobService._active.discard(job_id)
+
+    @staticmethod
+    def _create_one(app, job_id, transaction_id, customer_id, api_key, limiter):
+        with app.app_context():
+            claimed = 0
+            try:
+                previous = db.session.query(Transaction.billing_status).filter_by(id=transaction_id).scalar()
+                if previous not in ('queued', 'verify'):
+                    return
+
+                # Atomic claim: only one worker (in any process) calls Asaas for a given row
+                claimed = Transaction.query.filter_by(id=transaction_id, billing_status=previous)\
+                    .update({'billing_status': 'sending'}, synchronize_session=False)
+                db.session.commit()
+                if not claimed:
+                    return
+
+                t = Transaction.query.get(transaction_id)
+                max_retries = app.config.get('ASAAS_MAX_RETRIES', 3)
+                payment, error = None, None
+
+                for attempt in range(max_retries + 1):
+                    # Idempotency: a recovered row or a failed attempt may have been created anyway
+                    if previous == 'verify' or attempt > 0:
+                        limiter.acquire()
+                        payment, _ = find_payment_by_reference(t.id, api_key=api_key)
+                        if payment:
+                            break
+
+                    limiter.acquire()
+                    payment, error = create_payment(
+                        customer_id=customer_id,
+                        value=t.amount,
+                        due_date=t.due_date.strftime('%Y-%m-%d'),
+                        description=f"Contrato #{t.contract_id} - {t.description}",
+                        external_ref=t.id,
+                        api_key=api_key
+                    )
+                    if payment or attempt == max_retries:
+                        break
+                    # Exponential backoff with full jitter so workers don't retry in lockstep
+                    time.sleep(random.uniform(0, 2 ** attempt))
+
+                if payment:
+                    t.asaas_id = payment.get('id')
+                    t.asaas_invoice_url = payment.get('invoiceUrl') or payment.get('bankSlipUrl')
+                    t.billing_status = 'created'
+                    t.billing_error = None
+                else:
+                    t.billing_status = 'failed'
+                    t.billing_error = error
+                BillingJobService._bump(job_id, 'created_count' if payment else 'failed_count')
+                db.session.commit()
+
+                if not payment:
+                    app.logger.warning(f"Billing job {job_id} transaction {transaction_id} failed: {error}")
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Billing job {job_id} transaction {transaction_id} error: {e}")
+                if claimed:
+                    # The call may have reached Asaas: 'verify' makes the retry look the payment up first
+                    try:
+                        Transaction.query.filter_by(id=transaction_id, billing_status='sending')\
+                            .update({'billing_status': 'verify', 'billing_error': str(e)}, synchronize_session=False)
+                        BillingJobService._bump(job_id, 'failed_count')
+                        db.session.commit()
+                    except Exception as release_e:
+                        db.session.rollback()
+                        app.logger.error(f"Billing job {job_id} transaction {transaction_id} not released: {release_e}")
+            finally:
+                db.session.remove()
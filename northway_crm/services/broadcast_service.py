@@ -0,0 +1,378 @@
+import json
+import time
+import random
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import update, func
+from models import db, Lead, WhatsAppMessage, WhatsAppCampaign
+from services.whatsapp_service import WhatsAppService
+from services.zapi_client import ZApiClient
+from services.realtime_service import RealtimeService
+from utils import get_now_br, update_integration_health, RateLimiter, new_lease_owner
+
+
+class BroadcastService:
+    """
+    WhatsApp campaigns sent in the background, one runner per campaign under a DB lease.
+    Pacing (BROADCAST_RATE_PER_MINUTE) uses a per-process RateLimiter per Z-API instance:
+    it caps one campaign's rate (the lease keeps a campaign in one process), but campaigns
+    of the same instance running in different processes are paced independently.
+    """
+    FILTER_KEYS = ('q', 'status', 'source', 'assigned_to', 'stage_id')
+    LEASE_MINUTES = 5 # A runner whose heartbeat (locked_at) is older than this is considered dead
+
+    # Process-wide state: one limiter per Z-API instance, one runner per campaign
+    _limiters = {}
+    _active = set()
+    _lock = threading.Lock()
+
+    # --- Targeting ---
+    @staticmethod
+    def apply_lead_filters(query, filters):
+        """Applies the leads list filters (q, status, source, assigned_to, stage_id) to a Lead query."""
+        search_q = filters.get('q')
+        if search_q:
+            search_term = f"%{search_q}%"
+            query = query.filter(db.or_(
+                Lead.name.ilike(search_term),
+                Lead.email.ilike(search_term),
+                Lead.phone.ilike(search_term),
+                Lead.legal_name.ilike(search_term)
+            ))
+        if filters.get('status'):
+            query = query.filter(Lead.status == filters['status'])
+        if filters.get('source'):
+            query = query.filter(Lead.source == filters['source'])
+        if filters.get('assigned_to'):
+            query = query.filter(Lead.assigned_to_id == int(filters['assigned_to']))
+        if filters.get('stage_id'):
+            query = query.filter(Lead.pipeline_stage_id == int(filters['stage_id']))
+        return query
+
+    @staticmethod
+    def clean_filters(args):
+        return {k: args.get(k) for k in BroadcastService.FILTER_KEYS if args.get(k)}
+
+    @staticmethod
+    def resolve_targets(company_id, filters):
+        """Returns [(lead_id, first_name, normalized_phone, contact_uuid)], one per phone."""
+        query = BroadcastService.apply_lead_filters(Lead.query.filter(Lead.company_id == company_id), filters)
+        rows = query.filter(Lead.phone.isnot(None), Lead.phone != '')\
+            .with_entities(Lead.id, Lead.name, Lead.phone, Lead.contact_uuid)\
+            .order_by(Lead.id).all()
+
+        targets, seen = [], set()
+        for r in rows:
+            phone = WhatsAppService.normalize_phone(r.phone)
+            if not phone or phone in seen:
+                continue
+            seen.add(phone)
+            first_name = (r.name or '').strip().split(' ')[0]
+            targets.append((r.id, first_name, phone, r.contact_uuid))
+        return targets
+
+    @staticmethod
+    def render_message(template, first_name):
+        return template.replace('{nome}', first_name or '')
+
+    # --- Lifecycle ---
+    @staticmethod
+    def create_campaign(company_id, user_id, name, message, filters):
+        """Persists the campaign and one queued WhatsAppMessage per recipient."""
+        if not message or not message.strip():
+            raise Exception("Mensagem obrigatória.")
+
+        targets = BroadcastService.resolve_targets(company_id, filters)
+        if not targets:
+            raise Exception("Nenhum lead com telefone válido para este filtro.")
+
+        campaign = WhatsAppCampaign(
+            company_id=company_id,
+            created_by_id=user_id,
+            name=name or f"Disparo {get_now_br().strftime('%d/%m/%Y %H:%M')}",
+            message=message,
+            filters_json=json.dumps(filters),
+            status='queued',
+            total_count=len(targets)
+        )
+        db.session.add(campaign)
+        db.session.flush()
+
+        now = get_now_br()
+        db.session.bulk_insert_mappings(WhatsAppMessage, [{
+            'company_id': company_id,
+            'lead_id': lead_id,
+            'contact_uuid': contact_uuid,
+            'phone': phone,
+            'direction': 'out',
+            'type': 'text',
+            'content': BroadcastService.render_message(message, first_name),
+            'status': 'queued',
+            'campaign_id': campaign.id,
+            'attempts': 0,
+            'created_at': now
+        } for lead_id, first_name, phone, contact_uuid in targets])
+        db.session.commit()
+        return campaign
+
+    @staticmethod
+    def start(campaign_id):
+        """Starts the campaign runner in a background thread (no-op if already running here)."""
+        with BroadcastService._lock:
+            if campaign_id in BroadcastService._active:
+                return False
+            BroadcastService._active.add(campaign_id)
+
+        app = current_app._get_current_object()
+        threading.Thread(
+            target=BroadcastService._run, args=(app, campaign_id),
+            name=f'broadcast-{campaign_id}', daemon=True
+        ).start()
+        return True
+
+    @staticmethod
+    def set_status(campaign, status):
+        """pause / resume / cancel from the UI."""
+        if campaign.status in ('completed', 'cancelled'):
+            raise Exception("Campanha já finalizada.")
+
+        campaign.status = status
+        if status == 'cancelled':
+            campaign.finished_at = get_now_br()
+            WhatsAppMessage.query.filter_by(campaign_id=campaign.id, status='queued')\
+                .update({'status': 'cancelled'}, synchronize_session=False)
+        db.session.commit()
+
+        if status == 'running':
+            BroadcastService.start(campaign.id)
+
+    @staticmethod
+    def drain(app, budget_seconds):
+        """
+        Cron entry point: sends open campaigns in the caller's request until they finish or the
+        time budget runs out (serverless: runner threads freeze once the response is sent).
+        A campaign cut by the budget stays 'running' and its lease is released for the next call.
+        Returns the ids of the campaigns it worked on.
+        """
+        deadline = time.monotonic() + budget_seconds
+        ids = [c.id for c in WhatsAppCampaign.query.filter(
+            WhatsAppCampaign.status.in_(['queued', 'running']),
+            BroadcastService._lease_free()
+        ).with_entities(WhatsAppCampaign.id).order_by(WhatsAppCampaign.id).all()]
+
+        ran = []
+        for campaign_id in ids:
+            if time.monotonic() >= deadline:
+                break
+            with BroadcastService._lock:
+                if campaign_id in BroadcastService._active:
+                    continue
+                BroadcastService._active.add(campaign_id)
+            BroadcastService._run(app, campaign_id, deadline)
+            ran.append(campaign_id)
+        return ran
+
+    @staticmethod
+    def resume_stalled():
+        """Restarts running campaigns whose worker died (deploy, serverless freeze) in background threads."""
+        ids = [c.id for c in WhatsAppCampaign.query.filter(
+            WhatsAppCampaign.status.in_(['queued', 'running']),
+            BroadcastService._lease_free()
+        ).with_entities(WhatsAppCampaign.id).all()]
+        return [cid for cid in ids if BroadcastService.start(cid)]
+
+    @staticmethod
+    def progress(campaign):
+        counts = dict(db.session.query(WhatsAppMessage.status, func.count(WhatsAppMessage.id))
+                      .filter(WhatsAppMessage.campaign_id == campaign.id)
+                      .group_by(WhatsAppMessage.status).all())
+        return {
+            'id': campaign.id,
+            'name': campaign.name,
+            'status': campaign.status,
+            'total': campaign.total_count or 0,
+            'sent': campaign.sent_count or 0,
+            'failed': campaign.failed_count or 0,
+            'pending': counts.get('queued', 0) + counts.get('sending', 0),
+            'by_status': counts,
+            'created_at': campaign.created_at.isoformat() if campaign.created_at else None,
+            'finished_at': campaign.finished_at.isoformat() if campaign.finished_at else None
+        }
+
+    # --- Runner ---
+    @staticmethod
+    def _get_limiter(instance_id):
+        per_minute = current_app.config.get('BROADCAST_RATE_PER_MINUTE', 20)
+        with BroadcastService._lock:
+            limiter = BroadcastService._limiters.get(instance_id)
+            if limiter is None:
+                limiter = BroadcastService._limiters[instance_id] = RateLimiter(per_minute)
+            return limiter
+
+    @staticmethod
+    def _lease_free():
+        expired = get_now_br() - timedelta(minutes=BroadcastService.LEASE_MINUTES)
+        return db.or_(WhatsAppCampaign.locked_by.is_(None), WhatsAppCampaign.locked_at < expired)
+
+    @staticmethod
+    def _acquire(campaign_id, owner):
+        """Claims the campaign for this runner unless another live runner (any process) holds it."""
+        acquired = WhatsAppCampaign.query.filter(
+            WhatsAppCampaign.id == campaign_id,
+            WhatsAppCampaign.status.in_(['queued', 'running']),
+            BroadcastService._lease_free()
+        ).update({'locked_by': owner, 'locked_at': get_now_br()}, synchronize_session=False)
+        db.session.commit()
+        return bool(acquired)
+
+    @staticmethod
+    def _heartbeat(campaign_id, owner):
+        """Renews the lease (not committed); 0 means another runner took the campaign over."""
+        return db.session.execute(update(WhatsAppCampaign).where(
+            WhatsAppCampaign.id == campaign_id, WhatsAppCampaign.locked_by == owner
+        ).values(locked_at=get_now_br())).rowcount
+
+    @staticmethod
+    def _release(campaign_id, owner):
+        WhatsAppCampaign.query.filter_by(id=campaign_id, locked_by=owner)\
+            .update({'locked_by': None, 'locked_at': None}, synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def _bump(campaign_id, column):
+        col = getattr(WhatsAppCampaign, column)
+        db.session.execute(update(WhatsAppCampaign).where(WhatsAppCampaign.id == campaign_id).values({column: col + 1}))
+
+    @staticmethod
+    def _run(app, campaign_id, deadline=None):
+        owner = new_lease_owner()
+        try:
+            with app.app_context():
+                if not BroadcastService._acquire(campaign_id, owner):
+                    return
+                try:
+                    BroadcastService._send_campaign(app, campaign_id, owner, deadline)
+                finally:
+                    db.session.rollback()
+                    BroadcastService._release(campaign_id, owner)
+        except Exception as e:
+            app.logger.error(f"Broadcast {campaign_id} runner error: {e}")
+        finally:
+            with BroadcastService._lock:
+                BroadcastService._active.discard(campaign_id)
+
+    @staticmethod
+    def _send_campaign(app, campaign_id, owner, deadline=None):
+        """Sends the campaign's queued rows while this runner holds the lease."""
+        campaign = WhatsAppCampaign.query.get(campaign_id)
+        if not campaign or campaign.status not in ('queued', 'running'):
+            return
+
+        client = ZApiClient.for_company(campaign.company_id)
+        if not client:
+            app.logger.error(f"Broadcast {campaign_id}: WhatsApp não configurado, campanha pausada.")
+            campaign.status = 'paused'
+            db.session.commit()
+            return
+
+        # Rows left 'sending' by the previous lease holder, which is dead since its lease expired:
+        # fail them instead of risking a duplicate
+        interrupted = WhatsAppMessage.query.filter_by(campaign_id=campaign_id, status='sending')\
+            .update({'status': 'failed'}, synchronize_session=False)
+        if interrupted:
+            campaign.failed_count = (campaign.failed_count or 0) + interrupted
+
+        campaign.status = 'running'
+        campaign.started_at = campaign.started_at or get_now_br()
+        db.session.commit()
+
+        limiter = BroadcastService._get_limiter(client.config['instance_id'])
+        workers = app.config.get('BROADCAST_CONCURRENCY', 3)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'broadcast-{campaign_id}') as pool:
+            while True:
+                db.session.expire_all()
+                status = db.session.query(WhatsAppCampaign.status).filter_by(id=campaign_id).scalar()
+                if status != 'running':
+                    return
+                if deadline and time.monotonic() >= deadline:
+                    return # Out of budget: stays 'running' for the next cron call
+                if not BroadcastService._heartbeat(campaign_id, owner):
+                    app.logger.warning(f"Broadcast {campaign_id}: lease lost, stopping this runner.")
+                    return
+                db.session.commit()
+
+                size = workers * 5
+                if deadline:
+                    # Paced sends: take only what fits in the remaining budget
+                    per_minute = app.config.get('BROADCAST_RATE_PER_MINUTE', 20)
+                    size = max(1, min(size, int((deadline - time.monotonic()) * per_minute / 60)))
+                batch = [r.id for r in WhatsAppMessage.query
+                         .filter_by(campaign_id=campaign_id, status='queued')
+                         .with_entities(WhatsAppMessage.id)
+                         .order_by(WhatsAppMessage.id).limit(size).all()]
+                if not batch:
+                    break
+                list(pool.map(lambda mid: BroadcastService._send_one(app, campaign_id, mid, client, limiter, owner), batch))
+
+        campaign = WhatsAppCampaign.query.get(campaign_id)
+        campaign.status = 'completed'
+        campaign.finished_at = get_now_br()
+        db.session.commit()
+        update_integration_health(campaign.company_id, 'z_api')
+
+    @staticmethod
+    def _send_one(app, campaign_id, message_id, client, limiter, owner):
+        with app.app_context():
+            try:
+                # Atomic claim: only one worker (in any process) sends a given row
+                claimed = WhatsAppMessage.query.filter_by(id=message_id, status='queued')\
+                    .update({'status': 'sending'}, synchronize_session=False)
+                db.session.commit()
+                if not claimed:
+                    return
+
+                msg = WhatsAppMessage.query.get(message_id)
+                max_retries = app.config.get('BROADCAST_MAX_RETRIES', 3)
+                error = None
+
+                for attempt in range(max_retries + 1):
+                    limiter.acquire()
+                    msg.attempts = (msg.attempts or 0) + 1
+                    retryable = False
+                    try:
+                        res, data, error_msg = WhatsAppService.post_with_phone_fallback(
+                            client, 'send-text', {'phone': msg.phone, 'message': msg.content}, retry=False
+                        )
+                        if res.status_code < 400 and not error_msg:
+                            error = None
+                            msg.external_id = data.get('messageId')
+                            break
+                        error = f"Z-API Error ({res.status_code}): {error_msg}"
+                        retryable = res.status_code == 429 or res.status_code >= 500
+                    except Exception as e:
+                        error = str(e)
+                        retryable = True
+
+                    if not retryable or attempt == max_retries:
+                        break
+                    # Exponential backoff with full jitter so workers don't retry in lockstep
+                    time.sleep(random.uniform(0, 2 ** attempt))
+
+                msg.status = 'failed' if error else 'sent'
+                msg.created_at = get_now_br()
+                BroadcastService._bump(campaign_id, 'failed_count' if error else 'sent_count')
+                BroadcastService._heartbeat(campaign_id, owner)
+                db.session.commit()
+
+                if error:
+                    app.logger.warning(f"Broadcast {campaign_id} message {message_id} failed: {error}")
+                else:
+                    RealtimeService.publish_message(msg)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Broadcast {campaign_id} message {message_id} error: {e}")
+            finally:
+                db.session.remove()
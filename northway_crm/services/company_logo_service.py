@@ -0,0 +1,252 @@
+import base64
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from flask import current_app, url_for
+from models import db, Company
+
+try:
+    from PIL import Image
+except ImportError: # Optional: without Pillow thumbnails fall back to the original file
+    Image = None
+
+
+class CompanyLogoService:
+    """
+    Company logos in object storage, addressed by content hash: Company.logo_key is
+    "<sha256>.<ext>" and the logo URL embeds it, so a new logo is a new URL and responses
+    can be cached for a year. The Supabase bucket is the durable copy; local disk is only a
+    per-instance cache (/tmp on Vercel). Until a bucket upload succeeds the bytes also stay
+    in Company.logo_base64, which serves as the durable copy. Thumbnails have fixed widths and are cached
+    on disk plus a small per-process LRU.
+    """
+    BUCKET = 'company-assets'
+    CONTENT_TYPES = {
+        'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
+        'gif': 'image/gif', 'webp': 'image/webp'
+    } # No SVG: served from our origin it could carry scripts
+    MAX_BYTES = 2 * 1024 * 1024
+    CACHE_SECONDS = 365 * 24 * 3600 # URLs change with the content: safe to cache "forever"
+    THUMB_WIDTHS = (64, 160, 320)
+    MAX_THUMBS = 64
+    KEY_RE = re.compile(r'^[0-9a-f]{64}\.(png|jpg|jpeg|gif|webp)$')
+
+    _thumbs = OrderedDict() # (company_id, key, width) -> PNG bytes
+    _lock = threading.Lock()
+
+    # --- Keys & paths ---
+    @staticmethod
+    def key_for(data, ext):
+        return f"{hashlib.sha256(data).hexdigest()}.{ext}"
+
+    @staticmethod
+    def is_valid_key(key):
+        return bool(key and CompanyLogoService.KEY_RE.match(key))
+
+    @staticmethod
+    def content_type(key):
+        return CompanyLogoService.CONTENT_TYPES[key.rsplit('.', 1)[1]]
+
+    @staticmethod
+    def _object_path(company_id, key):
+        return f"logos/company_{company_id}/{key}"
+
+    @staticmethod
+    def _local_path(company_id, key, width=None):
+        folder = os.path.abspath(current_app.config.get('COMPANY_UPLOAD_FOLDER') or '/tmp/uploads/company')
+        name = f"{key.rsplit('.', 1)[0]}_{width}.png" if width else key
+        return os.path.join(folder, 'logos', f"company_{company_id}", name)
+
+    @staticmethod
+    def _bucket():
+        supabase = getattr(current_app, 'supabase', None)
+        return supabase.storage.from_(CompanyLogoService.BUCKET) if supabase else None
+
+    @staticmethod
+    def _write_local(path, data):
+        """Atomic write (temp file + rename) so concurrent requests never serve a partial image."""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            current_app.logger.warning(f"Logo cache write failed ({path}): {e}")
+            return False
+
+    # --- Upload ---
+    @staticmethod
+    def extension(filename, mimetype=None):
+        ext = filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ''
+        if ext not in CompanyLogoService.CONTENT_TYPES:
+            ext = next((e for e, ct in CompanyLogoService.CONTENT_TYPES.items() if ct == mimetype), '')
+        return ext
+
+    @staticmethod
+    def store(company, data, ext):
+        """
+        Saves logo bytes as the company's logo. Raises ValueError (user-facing message) on invalid files.
+        logo_base64 is cleared only after a successful bucket upload; without one it keeps the
+        bytes (Persistence Guarantee), since local disk does not survive across instances.
+        """
+        if ext not in CompanyLogoService.CONTENT_TYPES:
+            raise ValueError('Formato de logotipo não suportado. Use PNG, JPG, GIF ou WEBP.')
+        if not data:
+            raise ValueError('Arquivo de logotipo vazio.')
+        if len(data) > CompanyLogoService.MAX_BYTES:
+            raise ValueError('Logotipo muito grande (máximo 2 MB).')
+
+        key = CompanyLogoService.key_for(data, ext)
+        durable = CompanyLogoService._upload(company.id, key, data)
+        CompanyLogoService._write_local(CompanyLogoService._local_path(company.id, key), data)
+
+        company.logo_key = key
+        company.logo_filename = None
+        company.logo_base64 = None if durable else base64.b64encode(data).decode('utf-8')
+        return key
+
+    @staticmethod
+    def _upload(company_id, key, data):
+        """Uploads to the bucket; True only when the logo is durably stored there."""
+        bucket = CompanyLogoService._bucket()
+        if not bucket:
+            return False
+        object_path = CompanyLogoService._object_path(company_id, key)
+        try:
+            bucket.upload(path=object_path, file=data, file_options={
+                "content-type": CompanyLogoService.content_type(key),
+                "cache-control": str(CompanyLogoService.CACHE_SECONDS),
+                "upsert": "true"
+            })
+            return True
+        except Exception as e:
+            current_app.logger.error(f"Logo upload failed ({object_path}): {e}")
+            return False
+
+    @staticmethod
+    def migrate_base64(company):
+        """
+        Moves a base64 logo into the bucket; returns True if the row no longer holds the bytes.
+        Without a bucket (or when the upload fails) the row is left untouched.
+        """
+        if not company.logo_base64 or not CompanyLogoService._bucket():
+            return False
+        data = base64.b64decode(company.logo_base64)
+        ext = company.logo_key.rsplit('.', 1)[1] if company.logo_key else CompanyLogoService._sniff_ext(data)
+        key = CompanyLogoService.key_for(data, ext)
+        if not CompanyLogoService._upload(company.id, key, data):
+            return False
+        company.logo_key = key
+        company.logo_filename = None
+        company.logo_base64 = None
+        return True
+
+    @staticmethod
+    def _sniff_ext(data):
+        if data.startswith(b'\xff\xd8'):
+            return 'jpg'
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return 'gif'
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return 'webp'
+        return 'png' # The legacy column was always served as image/png
+
+    # --- URLs ---
+    @staticmethod
+    def url(company, width=None, external=False):
+        """URL of the company logo (None if there is none). Legacy logos keep their old form until migrated."""
+        if not company:
+            return None
+        if company.logo_key:
+            params = {'w': width} if width else {}
+            return url_for('branding.company_logo', company_id=company.id, key=company.logo_key, _external=external, **params)
+        if company.logo_filename:
+            if company.logo_filename.startswith('http'):
+                return company.logo_filename
+            return url_for('static', filename='uploads/company/' + company.logo_filename, _external=external)
+        if company.logo_base64:
+            return f"data:image/png;base64,{company.logo_base64}"
+        return None
+
+    # --- Serving ---
+    @staticmethod
+    def load(company_id, key):
+        """Local path of the logo, fetched from the bucket or the row's base64 copy on a local miss (None if unknown)."""
+        path = CompanyLogoService._local_path(company_id, key)
+        if os.path.exists(path):
+            return path
+
+        data = CompanyLogoService._download(company_id, key)
+        if data is None:
+            # Not uploaded yet: the row still holds the bytes for the current key
+            encoded = db.session.query(Company.logo_base64).filter(
+                Company.id == company_id, Company.logo_key == key
+            ).scalar()
+            data = base64.b64decode(encoded) if encoded else None
+        if data is None:
+            return None
+        if hashlib.sha256(data).hexdigest() != key.rsplit('.', 1)[0]:
+            current_app.logger.error(f"Logo content does not match its key (company {company_id}, {key})")
+            return None
+        return path if CompanyLogoService._write_local(path, data) else io.BytesIO(data)
+
+    @staticmethod
+    def _download(company_id, key):
+        bucket = CompanyLogoService._bucket()
+        if not bucket:
+            return None
+        object_path = CompanyLogoService._object_path(company_id, key)
+        try:
+            return bucket.download(object_path)
+        except Exception as e:
+            current_app.logger.info(f"Logo not in storage ({object_path}): {e}")
+            return None
+
+    @staticmethod
+    def thumb_width(requested):
+        """Smallest cached width that covers the requested one."""
+        return next((w for w in CompanyLogoService.THUMB_WIDTHS if w >= requested), CompanyLogoService.THUMB_WIDTHS[-1])
+
+    @staticmethod
+    def thumbnail(company_id, key, width):
+        """PNG thumbnail bytes, or None when it cannot be made (no Pillow, unreadable file)."""
+        if Image is None:
+            return None
+        cache_key = (company_id, key, width)
+        with CompanyLogoService._lock:
+            data = CompanyLogoService._thumbs.get(cache_key)
+            if data is not None:
+                CompanyLogoService._thumbs.move_to_end(cache_key)
+                return data
+
+        thumb_path = CompanyLogoService._local_path(company_id, key, width)
+        if os.path.exists(thumb_path):
+            with open(thumb_path, 'rb') as f:
+                data = f.read()
+        else:
+            source = CompanyLogoService.load(company_id, key)
+            if source is None:
+                return None
+            try:
+                with Image.open(source) as img:
+                    img = img.convert('RGBA')
+                    img.thumbnail((width, width * 4)) # Width-bound; never upscales
+                    out = io.BytesIO()
+                    img.save(out, format='PNG', optimize=True)
+                    data = out.getvalue()
+            except Exception as e:
+                current_app.logger.warning(f"Logo thumbnail failed ({key}, {width}px): {e}")
+                return None
+            CompanyLogoService._write_local(thumb_path, data)
+
+        with CompanyLogoService._lock:
+            CompanyLogoService._thumbs[cache_key] = data
+            while len(CompanyLogoService._thumbs) > CompanyLogoService.MAX_THUMBS:
+                CompanyLogoService._thumbs.popitem(last=False)
+        return data
@@ -0,0 +1,388 @@
+import csv
+import io
+import os
+import threading
+import zipfile
+import tempfile
+import multiprocessing
+from datetime import timedelta
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from types import SimpleNamespace
+from flask import current_app
+from sqlalchemy.orm import joinedload, undefer
+from werkzeug.utils import secure_filename
+from models import db, Contract, ContractExportJob
+from services.pdf_artifact_service import PdfArtifactService
+from utils import get_now_br, new_lease_owner
+
+
+def _init_worker(root_path):
+    """Render process initializer: PdfService only needs an app context for root_path and the logger."""
+    from flask import Flask
+    Flask('contract_export', root_path=root_path).app_context().push()
+
+
+class LeaseLost(Exception):
+    """Another runner took the export over (this one stalled past LEASE_MINUTES)."""
+
+
+def _render(payload):
+    """Runs in a render process; gets plain data, never ORM objects."""
+    from services.pdf_service import PdfService
+    company = SimpleNamespace(**payload['company']) if payload['company'] else None
+    contract = SimpleNamespace(
+        id=payload['id'], code=payload['code'], company=company,
+        generated_content=payload['generated_content']
+    )
+    return PdfService.generate_pdf(contract)
+
+
+class ContractExportService:
+    """
+    Exports a company's contracts (content already includes annexes and the summary sheet) as one ZIP.
+    PDFs are rendered in a process pool and written into the ZIP as each one finishes, so memory
+    holds at most one batch of PDFs; contracts already in the artifact store are copied, not rendered.
+    The finished ZIP goes to the private artifact bucket, so any instance can serve the download;
+    one runner (in any process) builds a job at a time, under a DB lease.
+    """
+    STATUSES = ('issued', 'signed', 'active', 'cancelled')
+    DEFAULT_STATUSES = ('signed', 'active')
+    LEASE_MINUTES = 5 # A runner whose heartbeat (locked_at) is older than this is considered dead
+    DOWNLOAD_URL_SECONDS = 300
+
+    _active = set()
+    _lock = threading.Lock()
+
+    # --- Lifecycle ---
+    @staticmethod
+    def parse_statuses(values):
+        statuses = [s for s in (values or []) if s in ContractExportService.STATUSES]
+        return statuses or list(ContractExportService.DEFAULT_STATUSES)
+
+    @staticmethod
+    def enqueue(company_id, user_id, statuses):
+        """Creates the export job, or returns the company's export still in progress."""
+        job = ContractExportJob.query.filter(
+            ContractExportJob.company_id == company_id,
+            ContractExportJob.status.in_(['queued', 'running'])
+        ).order_by(ContractExportJob.id.desc()).first()
+        if job:
+            return job
+
+        job = ContractExportJob(
+            company_id=company_id, created_by_id=user_id,
+            statuses=','.join(statuses), status='queued'
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def start(job_id, inline=False):
+        """
+        Starts the export in a background thread (no-op if already running here).
+        inline=True runs it in the caller's request instead (serverless cron: threads freeze
+        once the response is sent).
+        """
+        with ContractExportService._lock:
+            if job_id in ContractExportService._active:
+                return False
+            ContractExportService._active.add(job_id)
+
+        app = current_app._get_current_object()
+        if inline:
+            ContractExportService._run(app, job_id)
+            return True
+        threading.Thread(
+            target=ContractExportService._run, args=(app, job_id),
+            name=f'contract-export-{job_id}', daemon=True
+        ).start()
+        return True
+
+    @staticmethod
+    def resume_stalled():
+        """Cron entry point: restarts exports whose worker died (the ZIP is rebuilt from scratch)."""
+        ids = [j.id for j in ContractExportJob.query.filter(
+            ContractExportJob.status.in_(['queued', 'running']),
+            ContractExportService._lease_free()
+        ).with_entities(ContractExportJob.id).order_by(ContractExportJob.id).all()]
+        inline = current_app.config.get('PDF_EXPORT_INLINE', False)
+        return [jid for jid in ids if ContractExportService.start(jid, inline=inline)]
+
+    @staticmethod
+    def progress(job):
+        return {
+            'id': job.id,
+            'status': job.status,
+            'statuses': (job.statuses or '').split(','),
+            'total': job.total_count or 0,
+            'done': job.done_count or 0,
+            'failed': job.failed_count or 0,
+            'last_error': job.last_error,
+            'file_size': job.file_size,
+            'download_ready': job.status == 'completed' and (
+                bool(job.storage_path) or (bool(job.file_path) and os.path.exists(job.file_path))
+            ),
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+
+    @staticmethod
+    def download_url(job):
+        """Short-lived signed URL of the ZIP in the bucket (None without storage)."""
+        bucket = PdfArtifactService._bucket()
+        if not bucket or not job.storage_path:
+            return None
+        try:
+            signed = bucket.create_signed_url(job.storage_path, ContractExportService.DOWNLOAD_URL_SECONDS)
+            return signed.get('signedURL') or signed.get('signedUrl')
+        except Exception as e:
+            current_app.logger.error(f"Contract export {job.id}: signed URL failed: {e}")
+            return None
+
+    # --- Runner ---
+    @staticmethod
+    def export_path(job):
+        folder = os.path.abspath(current_app.config.get('PDF_CACHE_FOLDER') or '/tmp/pdf_cache')
+        return os.path.join(folder, 'exports', f"company_{job.company_id}", f"contratos_{job.id}.zip")
+
+    @staticmethod
+    def _object_path(job):
+        return f"company_{job.company_id}/exports/contratos_{job.id}.zip"
+
+    @staticmethod
+    def _upload(job, path):
+        """Uploads the finished ZIP to the artifact bucket; returns the object path (None without storage)."""
+        bucket = PdfArtifactService._bucket()
+        if not bucket:
+            return None
+        object_path = ContractExportService._object_path(job)
+        bucket.upload(path=object_path, file=path, file_options={"content-type": "application/zip", "upsert": "true"})
+        return object_path
+
+    @staticmethod
+    def _lease_free():
+        expired = get_now_br() - timedelta(minutes=ContractExportService.LEASE_MINUTES)
+        return db.or_(ContractExportJob.locked_by.is_(None), ContractExportJob.locked_at < expired)
+
+    @staticmethod
+    def _acquire(job_id, owner):
+        """Claims the job for this runner unless another live runner (any process) holds it."""
+        acquired = ContractExportJob.query.filter(
+            ContractExportJob.id == job_id,
+            ContractExportJob.status.in_(['queued', 'running']),
+            ContractExportService._lease_free()
+        ).update({'locked_by': owner, 'locked_at': get_now_br()}, synchronize_session=False)
+        db.session.commit()
+        return bool(acquired)
+
+    @staticmethod
+    def _heartbeat(job_id, owner):
+        """Renews the lease (not committed); raises LeaseLost if another runner took the job."""
+        renewed = ContractExportJob.query.filter_by(id=job_id, locked_by=owner)\
+            .update({'locked_at': get_now_br()}, synchronize_session=False)
+        if not renewed:
+            raise LeaseLost()
+
+    @staticmethod
+    def _release(job_id, owner):
+        ContractExportJob.query.filter_by(id=job_id, locked_by=owner)\
+            .update({'locked_by': None, 'locked_at': None}, synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def _pool(app):
+        workers = app.config.get('PDF_EXPORT_WORKERS', 1)
+        if workers <= 0:
+            return None
+        try:
+            # spawn: a forked copy of this process would inherit DB connections and held locks
+            return ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=(app.root_path,)
+            )
+        except (OSError, NotImplementedError, ImportError) as e:
+            # Serverless runtimes have no /dev/shm semaphores
+            app.logger.warning(f"Contract export: process pool unavailable, rendering in thread ({e})")
+            return None
+
+    @staticmethod
+    def _payload(contract):
+        company = contract.company
+        return {
+            'id': contract.id,
+            'code': contract.code,
+            'generated_content': contract.generated_content,
+            'company': {
+                'name': company.name, 'document': company.document, 'cpf_cnpj': company.cpf_cnpj
+            } if company else None
+        }
+
+    @staticmethod
+    def _entry_name(contract, used):
+        folder = secure_filename(contract.client.name if contract.client else '') or 'cliente'
+        name = f"{folder}/Contrato_{secure_filename(contract.code or '') or contract.id}.pdf"
+        if name in used:
+            name = f"{name[:-4]}_{contract.id}.pdf"
+        used.add(name)
+        return name
+
+    @staticmethod
+    def _run(app, job_id):
+        owner = new_lease_owner()
+        try:
+            with app.app_context():
+                if not ContractExportService._acquire(job_id, owner):
+                    return
+                try:
+                    ContractExportService._export(app, job_id, owner)
+                except LeaseLost:
+                    db.session.rollback()
+                    app.logger.warning(f"Contract export {job_id}: lease lost, stopping this runner.")
+                except Exception as e:
+                    app.logger.error(f"Contract export {job_id} runner error: {e}")
+                    db.session.rollback()
+                    ContractExportJob.query.filter_by(id=job_id, locked_by=owner).update({
+                        'status': 'failed', 'last_error': str(e), 'finished_at': get_now_br()
+                    }, synchronize_session=False)
+                    db.session.commit()
+                finally:
+                    db.session.rollback()
+                    ContractExportService._release(job_id, owner)
+        except Exception as e:
+            app.logger.error(f"Contract export {job_id} runner error: {e}")
+        finally:
+            with ContractExportService._lock:
+                ContractExportService._active.discard(job_id)
+
+    @staticmethod
+    def _export(app, job_id, owner):
+        job = db.session.get(ContractExportJob, job_id)
+        if not job or job.status not in ('queued', 'running'):
+            return
+
+        query = Contract.query.filter(
+            Contract.company_id == job.company_id,
+            Contract.status.in_((job.statuses or '').split(',')),
+            Contract.generated_content.isnot(None)
+        )
+        contract_ids = [r.id for r in query.with_entities(Contract.id).order_by(Contract.id).all()]
+
+        job.status = 'running'
+        job.started_at = job.started_at or get_now_br()
+        job.total_count = len(contract_ids)
+        job.done_count = 0
+        job.failed_count = 0
+        job.last_error = None
+        db.session.commit()
+
+        path = ContractExportService.export_path(job)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Own temp file: a stalled runner that lost the lease never writes into this one
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        os.close(fd)
+        pool = ContractExportService._pool(app)
+        batch_size = max(app.config.get('PDF_EXPORT_WORKERS', 1) * 2, 4)
+
+        manifest = io.StringIO()
+        writer = csv.writer(manifest, delimiter=';')
+        writer.writerow(['contrato_id', 'codigo', 'cliente', 'status', 'arquivo', 'erro'])
+        used = set()
+
+        try:
+            # PDFs are already compressed: store them as-is
+            with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf, \
+                    (pool or nullcontext()):
+                for start in range(0, len(contract_ids), batch_size):
+                    ids = contract_ids[start:start + batch_size]
+                    contracts = Contract.query.options(
+                        joinedload(Contract.company), joinedload(Contract.client),
+                        undefer(Contract.generated_content) # Deferred by default; every row here is rendered
+                    ).filter(Contract.id.in_(ids)).order_by(Contract.id).all()
+                    ContractExportService._export_batch(app, pool, zf, writer, used, job, contracts, owner)
+                    db.session.expire_all()
+
+                zf.writestr('indice.csv', '\ufeff' + manifest.getvalue()) # BOM: Excel opens it as UTF-8
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        # The local file only lives on this instance: downloads are served from the bucket
+        storage_path = ContractExportService._upload(job, path)
+
+        ContractExportService._heartbeat(job_id, owner)
+        ContractExportService._cleanup_previous(job)
+        job = db.session.get(ContractExportJob, job_id)
+        job.file_path = path
+        job.storage_path = storage_path
+        job.file_size = os.path.getsize(path)
+        job.status = 'completed'
+        job.finished_at = get_now_br()
+        db.session.commit()
+
+    @staticmethod
+    def _export_batch(app, pool, zf, writer, used, job, contracts, owner):
+        done, failed, pending = 0, 0, []
+        for contract in contracts:
+            cached = PdfArtifactService.cached_path(contract)
+            if cached:
+                name = ContractExportService._entry_name(contract, used)
+                zf.write(cached, name)
+                writer.writerow([contract.id, contract.code, contract.client.name, contract.status, name, ''])
+                done += 1
+            else:
+                pending.append(contract)
+
+        if pool:
+            futures = {pool.submit(_render, ContractExportService._payload(c)): c for c in pending}
+            results = ((futures[f], f) for f in as_completed(futures))
+        else:
+            results = ((c, None) for c in pending)
+
+        for contract, future in results:
+            try:
+                data = future.result() if future else _render(ContractExportService._payload(contract))
+                name = ContractExportService._entry_name(contract, used)
+                zf.writestr(name, data)
+                # Single downloads of the same version are served from the store afterwards
+                PdfArtifactService.store(contract, PdfArtifactService.cache_key(contract), data, upload=False)
+                writer.writerow([contract.id, contract.code, contract.client.name, contract.status, name, ''])
+                done += 1
+            except Exception as e:
+                app.logger.error(f"Contract export {job.id}: contract {contract.id} failed: {e}")
+                writer.writerow([contract.id, contract.code, contract.client.name, contract.status, '', str(e)])
+                failed += 1
+
+        ContractExportService._heartbeat(job.id, owner)
+        job.done_count = (job.done_count or 0) + done
+        job.failed_count = (job.failed_count or 0) + failed
+        db.session.commit()
+
+    @staticmethod
+    def _cleanup_previous(job):
+        """Only the latest export ZIP of a company is kept (on disk and in the bucket)."""
+        previous = ContractExportJob.query.filter(
+            ContractExportJob.company_id == job.company_id,
+            ContractExportJob.id < job.id,
+            db.or_(ContractExportJob.file_path.isnot(None), ContractExportJob.storage_path.isnot(None))
+        ).all()
+        bucket = PdfArtifactService._bucket()
+        for old in previous:
+            if old.file_path:
+                try:
+                    os.remove(old.file_path)
+                except OSError:
+                    pass
+            if old.storage_path and bucket:
+                try:
+                    bucket.remove([old.storage_path])
+                except Exception as e:
+                    current_app.logger.warning(f"Contract export {old.id}: ZIP removal failed: {e}")
+            old.file_path = None
+            old.storage_path = None
+        db.session.commit()
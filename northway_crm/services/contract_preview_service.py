@@ -0,0 +1,255 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import markdown
+from services.company_logo_service import CompanyLogoService
+from services.template_engine import CompiledTemplate, TemplateEngine
+from utils import get_date_extenso_br
+
+
+class ContractPreviewService:
+    """
+    Editor preview of a contract draft.
+    The ETag is derived from the inputs (template versions, branding, date and replacement values),
+    so an unchanged preview is answered with 304 before anything is rendered. On a miss, the
+    branding parts (header, footer, summary sheet skeleton) come from a per-company cache and the
+    markdown body is only re-rendered when a placeholder it actually uses has changed.
+    """
+    MAX_DRAFTS = 512
+    MAX_BRANDINGS = 128
+
+    _drafts = OrderedDict() # (company_id, client_id, template_id, attachment_id) -> {'key', 'content', 'unknown'}
+    _brandings = OrderedDict() # branding signature -> (header_html, footer_html, summary CompiledTemplate)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def branding_signature(company):
+        logo = company.logo_key or company.logo_filename
+        if not logo and company.logo_base64: # Legacy row not migrated yet
+            logo = hashlib.sha1(company.logo_base64.encode()).hexdigest()
+        return (
+            company.id, company.name, company.document, company.address, company.primary_color,
+            company.secondary_color, logo, get_date_extenso_br()
+        )
+
+    @staticmethod
+    def etag(company, template, attachment, replacements):
+        parts = [
+            repr(ContractPreviewService.branding_signature(company)),
+            f"{template.id}:{template.updated_at}",
+            f"{attachment.id}:{attachment.updated_at}" if attachment else '-'
+        ]
+        parts.extend(f"{key}={value}" for key, value in sorted(replacements.items()))
+        return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def render(client, template, attachment, replacements):
+        """Returns (html, unknown placeholders) for the editor preview."""
+        header_html, footer_html, summary = ContractPreviewService._branding(client.company)
+        content, unknown = ContractPreviewService._body(client, template, attachment, replacements)
+        summary_sheet = summary.render(ContractPreviewService.summary_values(replacements))
+        return header_html + content + footer_html + summary_sheet, unknown
+
+    @staticmethod
+    def _body(client, template, attachment, replacements):
+        compiled = TemplateEngine.compile(template)
+        att_compiled = TemplateEngine.compile(attachment) if attachment else None
+
+        # Only the values of placeholders present in the templates affect the body
+        used = sorted(compiled.placeholders | (att_compiled.placeholders if att_compiled else frozenset()))
+        key = (compiled, att_compiled, tuple(str(replacements.get(k, k)) for k in used))
+        draft = (client.company_id, client.id, template.id, attachment.id if attachment else None)
+
+        with ContractPreviewService._lock:
+            cached = ContractPreviewService._drafts.get(draft)
+            if cached and cached['key'] == key:
+                ContractPreviewService._drafts.move_to_end(draft)
+                return cached['content'], cached['unknown']
+
+        content = compiled.render(replacements)
+        unknown = compiled.unknown_placeholders(replacements)
+        try:
+            content = markdown.markdown(content)
+        except Exception as e:
+            print(f"Markdown Error: {e}")
+
+        if att_compiled:
+            att_content = att_compiled.render(replacements)
+            unknown = sorted(set(unknown) | set(att_compiled.unknown_placeholders(replacements)))
+            try:
+                att_content = markdown.markdown(att_content)
+                content += f"<br><hr><br><div class='attachment-section'>{att_content}</div>"
+            except:
+                pass
+
+        with ContractPreviewService._lock:
+            ContractPreviewService._drafts[draft] = {'key': key, 'content': content, 'unknown': unknown}
+            ContractPreviewService._drafts.move_to_end(draft)
+            while len(ContractPreviewService._drafts) > ContractPreviewService.MAX_DRAFTS:
+                ContractPreviewService._drafts.popitem(last=False)
+        return content, unknown
+
+    @staticmethod
+    def summary_values(replacements):
+        get = replacements.get
+        return {
+            '{{RESUMO_CONTRATANTE}}': get('{{nome_empresarial_contratante}}', ''),
+            '{{RESUMO_DOCUMENTO}}': get('{{cnpj_contratante}}', ''),
+            '{{RESUMO_RESPONSAVEL}}': get('{{representante_legal_contratante}}', ''),
+            '{{RESUMO_INICIO}}': get('{{DATA_INICIO}}', get('{{data_inicio}}', '')),
+            '{{RESUMO_TERMINO}}': get('{{DATA_FIM}}', get('{{data_fim}}', 'Indeterminado')),
+            '{{RESUMO_DURACAO}}': get('{{VIGENCIA_MESES}}', get('{{vigencia_meses}}', '')),
+            '{{RESUMO_VALOR_TOTAL}}': get('{{valor_total}}', get('{{VALOR_TOTAL}}', '0,00')),
+            '{{RESUMO_IMPLANTACAO}}': get('{{VALOR_IMPLANTACAO}}', '0,00'),
+            '{{RESUMO_PARCELAS}}': get('{{NUMERO_PARCELAS}}', '0'),
+            '{{RESUMO_MENSAL}}': get('{{VALOR_MENSAL}}', '0,00'),
+            '{{RESUMO_VENCIMENTO}}': get('{{DIA_VENCIMENTO}}', ''),
+            '{{RESUMO_TRAFEGO}}': get('{{VALOR_MINIMO_TRAFEGO}}', '0,00'),
+            '{{RESUMO_PERIODO_TRAFEGO}}': get('{{PERIODO_TRAFEGO}}', 'mês'),
+            '{{RESUMO_ASSINATURA}}': get('{{nome_empresarial_contratante}}', 'CONTRATANTE')
+        }
+
+    @staticmethod
+    def _branding(company):
+        signature = ContractPreviewService.branding_signature(company)
+        with ContractPreviewService._lock:
+            parts = ContractPreviewService._brandings.get(signature)
+            if parts:
+                ContractPreviewService._brandings.move_to_end(signature)
+                return parts
+
+        parts = ContractPreviewService._build_branding(company, signature[-1])
+        with ContractPreviewService._lock:
+            ContractPreviewService._brandings[signature] = parts
+            while len(ContractPreviewService._brandings) > ContractPreviewService.MAX_BRANDINGS:
+                ContractPreviewService._brandings.popitem(last=False)
+        return parts
+
+    @staticmethod
+    def _build_branding(company, date_extenso):
+        # --- PREMIUM HEADER LOGIC ---
+        logo_img_tag = ""
+        logo_url = CompanyLogoService.url(company)
+        if logo_url:
+            logo_img_tag = f'<img src="{logo_url}" alt="Logo" style="max-height: 80px; object-fit: contain;">'
+
+        primary_col = company.primary_color or '#fa0102'
+        second_col = company.secondary_color or '#111827'
+
+        header_html = f"""
+        <!-- Header -->
+        <div style="font-family: 'Inter', 'Helvetica Neue', Helvetica, Arial, sans-serif; color: #111827; display: flex; justify-content: space-between; align-items: center; padding-bottom: 25px; border-bottom: 1px solid #e5e7eb; margin-bottom: 40px;">
+            <div style="flex: 1;">
+                {logo_img_tag}
+            </div>
+            <div style="text-align: right;">
+                <h2 style="margin: 0; font-size: 20px; font-weight: 800; color: {second_col}; text-transform: uppercase; letter-spacing: 2px;">{company.name}</h2>
+                <p style="margin: 4px 0 0; color: #6b7280; font-size: 13px; font-weight: 500;">CNPJ: {company.document or 'N/A'}</p>
+                <div style="margin-top: 8px; font-size: 11px; font-weight: 600; color: #9ca3af; text-transform: uppercase; letter-spacing: 1px;">{date_extenso}</div>
+            </div>
+        </div>
+    """
+
+        # Footer Logic
+        footer_html = f"""
+        <!-- Footer -->
+        <div style="font-family: 'Inter', 'Helvetica Neue', Helvetica, Arial, sans-serif; margin-top: 60px; padding-top: 25px; border-top: 1px solid #f3f4f6; text-align: center;">
+            <p style="margin: 0; font-size: 11px; font-weight: 700; color: #374151; text-transform: uppercase; letter-spacing: 1.5px;">{company.name}</p>
+            <p style="margin: 4px 0; font-size: 10px; color: #9ca3af; line-height: 1.6;">{company.address or ''}</p>
+            <div style="margin-top: 10px; width: 40px; height: 2px; background-color: {primary_col}; margin-left: auto; margin-right: auto; opacity: 0.3;"></div>
+        </div>
+    """
+
+        # --- ANEXO I: QUADRO RESUMO (Mandatory) ---
+        # Skeleton with {{RESUMO_*}} slots, filled per preview from summary_values()
+        summary_html = f"""
+        <div style="page-break-before: always; font-family: 'Inter', 'Helvetica Neue', Helvetica, Arial, sans-serif; padding: 40px; color: #111827;">
+            <div style="text-align: center; margin-bottom: 40px;">
+                <h1 style="font-size: 20px; font-weight: 800; color: {primary_col}; margin: 0; text-transform: uppercase; letter-spacing: 2px;">ANEXO I - QUADRO RESUMO</h1>
+                <div style="width: 60px; height: 3px; background-color: {primary_col}; margin: 15px auto 0;"></div>
+            </div>
+
+            <p style="margin-bottom: 25px; font-size: 13px; color: #6b7280; line-height: 1.6; text-align: center; max-width: 80%; margin-left: auto; margin-right: auto;">
+                Este documento consolida as principais condições comerciais acordadas.
+                Sua validade está vinculada ao contrato principal.
+            </p>
+
+            <h3 style="font-size: 12px; font-weight: 700; color: #374151; text-transform: uppercase; letter-spacing: 1px; margin-bottom: 12px; display: flex; align-items: center; gap: 8px;">
+                <span style="width: 8px; height: 8px; border-radius: 50%; background-color: {primary_col}; display: inline-block; margin-right: 8px;"></span>
+                1. Informações das Partes
+            </h3>
+            <table style="width: 100%; border-collapse: collapse; font-size: 13px; margin-bottom: 30px; border: 1px solid #f3f4f6; border-radius: 8px; overflow: hidden;">
+                <tr style="background-color: #fafafa;">
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; width: 30%; color: #6b7280;"><strong>CONTRATANTE</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; font-weight: 600;">{{{{RESUMO_CONTRATANTE}}}}</td>
+                </tr>
+                 <tr>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>CNPJ/CPF</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">{{{{RESUMO_DOCUMENTO}}}}</td>
+                </tr>
+                 <tr>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Responsável</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">{{{{RESUMO_RESPONSAVEL}}}}</td>
+                </tr>
+            </table>
+
+            <h3 style="font-size: 12px; font-weight: 700; color: #374151; text-transform: uppercase; letter-spacing: 1px; margin: 25px 0 12px; display: flex; align-items: center; gap: 8px;">
+                <span style="width: 8px; height: 8px; border-radius: 50%; background-color: {primary_col}; display: inline-block; margin-right: 8px;"></span>
+                2. Vigência e Prazo
+            </h3>
+            <table style="width: 100%; border-collapse: collapse; font-size: 13px; margin-bottom: 30px; border: 1px solid #f3f4f6; border-radius: 8px; overflow: hidden;">
+                <tr style="background-color: #fafafa;">
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; width: 30%; color: #6b7280;"><strong>Início</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; font-weight: 600;">{{{{RESUMO_INICIO}}}}</td>
+                </tr>
+                <tr>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Término</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">{{{{RESUMO_TERMINO}}}}</td>
+                </tr>
+                 <tr>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Duração</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; font-weight: 600; color: {primary_col};">{{{{RESUMO_DURACAO}}}} meses</td>
+                </tr>
+            </table>
+
+            <h3 style="font-size: 12px; font-weight: 700; color: #374151; text-transform: uppercase; letter-spacing: 1px; margin: 25px 0 12px; display: flex; align-items: center; gap: 8px;">
+                <span style="width: 8px; height: 8px; border-radius: 50%; background-color: {primary_col}; display: inline-block; margin-right: 8px;"></span>
+                3. Condições Comerciais
+            </h3>
+            <table style="width: 100%; border-collapse: collapse; font-size: 13px; margin-bottom: 40px; border: 1px solid #f3f4f6; border-radius: 8px; overflow: hidden;">
+                <tr style="background-color: #fafafa;">
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; width: 30%; color: #6b7280;"><strong>Valor Total</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; font-size: 15px; font-weight: 800; color: {primary_col};">R$ {{{{RESUMO_VALOR_TOTAL}}}}</td>
+                </tr>
+                <tr>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Implantação</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">R$ {{{{RESUMO_IMPLANTACAO}}}}</td>
+                </tr>
+                 <tr>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6; color: #6b7280;"><strong>Mensalidade</strong></td>
+                    <td style="padding: 12px 15px; border-bottom: 1px solid #f3f4f6;">
+                        <span style="font-weight: 600;">{{{{RESUMO_PARCELAS}}}}x de R$ {{{{RESUMO_MENSAL}}}}</span>
+                        <br><small style="color: #9ca3af;">Vencimento: dia {{{{RESUMO_VENCIMENTO}}}}</small>
+                    </td>
+                </tr>
+                <tr style="background-color: #fafafa;">
+                    <td style="padding: 12px 15px; color: #6b7280;"><strong>Tráfego Mínimo</strong></td>
+                    <td style="padding: 12px 15px; font-weight: 500;">R$ {{{{RESUMO_TRAFEGO}}}} / {{{{RESUMO_PERIODO_TRAFEGO}}}}</td>
+                </tr>
+            </table>
+
+            <div style="margin-top: 60px; display: flex; justify-content: space-between; gap: 40px; text-align: center;">
+                 <div style="flex: 1;">
+                    <div style="height: 1px; background-color: #374151; margin-bottom: 12px;"></div>
+                    <p style="margin: 0; font-size: 11px; font-weight: 700; color: #111827; text-transform: uppercase; letter-spacing: 0.5px;">{{{{RESUMO_ASSINATURA}}}}</p>
+                    <p style="margin-top: 4px; font-size: 10px; color: #9ca3af; text-transform: uppercase;">Contratante</p>
+                </div>
+                <div style="flex: 1;">
+                    <div style="height: 1px; background-color: #374151; margin-bottom: 12px;"></div>
+                    <p style="margin: 0; font-size: 11px; font-weight: 700; color: #111827; text-transform: uppercase; letter-spacing: 0.5px;">{company.name}</p>
+                    <p style="margin-top: 4px; font-size: 10px; color: #9ca3af; text-transform: uppercase;">Contratada</p>
+                </div>
+            </div>
+        </div>
+        """
+        return header_html, footer_html, CompiledTemplate(summary_html)
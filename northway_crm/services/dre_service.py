@@ -0,0 +1,172 @@
+from datetime import date
+from sqlalchemy import func, extract
+from sqlalchemy.exc import IntegrityError
+from models import db, Transaction, Expense, FinancialCategory, DRESnapshot
+from utils import get_now_br
+
+MONTH_LABELS = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+
+
+class DREService:
+    """
+    Income statement (competence regime, by due_date).
+    Revenue and expenses are aggregated in SQL per month and category; closed months
+    are stored in DRESnapshot and reused until a record dated in that month changes
+    (see _invalidate_dre_snapshots in models.py).
+    """
+
+    MAX_PERIODS = 60
+    LINES = ('gross_revenue', 'taxes', 'net_revenue', 'variable_costs', 'gross_profit',
+             'fixed_expenses', 'ebitda', 'net_result')
+
+    @staticmethod
+    def is_closed(year, month):
+        today = get_now_br().date()
+        return (year, month) < (today.year, today.month)
+
+    @staticmethod
+    def month_range(start, end):
+        """[(year, month), ...] from start to end inclusive; both are (year, month)."""
+        periods = []
+        y, m = start
+        while (y, m) <= end:
+            periods.append((y, m))
+            y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        return periods
+
+    @staticmethod
+    def build(gross_revenue, expense_rows):
+        """expense_rows: [(category_name, category_type, total)] for one period."""
+        taxes = 0
+        variable_costs = 0
+        fixed_expenses = 0
+        breakdown = {}
+
+        for name, cat_type, val in expense_rows:
+            val = float(val or 0)
+            breakdown[name] = breakdown.get(name, 0) + val
+
+            if "imposto" in name.lower():
+                taxes += val
+            elif cat_type == 'cost':
+                variable_costs += val
+            else:
+                fixed_expenses += val
+
+        gross_revenue = float(gross_revenue or 0)
+        net_revenue = gross_revenue - taxes
+        gross_profit = net_revenue - variable_costs # Margem de Contribuição
+        ebitda = gross_profit - fixed_expenses
+
+        return {
+            'gross_revenue': gross_revenue,
+            'taxes': taxes,
+            'net_revenue': net_revenue,
+            'variable_costs': variable_costs,
+            'gross_profit': gross_profit,
+            'fixed_expenses': fixed_expenses,
+            'ebitda': ebitda,
+            'net_result': ebitda, # No depreciation/interest in this model
+            'breakdown': breakdown
+        }
+
+    @staticmethod
+    def combine(dres):
+        """Sums several period DREs (e.g. the months of a year); every line is additive."""
+        total = {key: sum(d[key] for d in dres) for key in DREService.LINES}
+        total['breakdown'] = {}
+        for dre in dres:
+            for name, val in dre['breakdown'].items():
+                total['breakdown'][name] = total['breakdown'].get(name, 0) + val
+        return total
+
+    @staticmethod
+    def compute(company_id, periods):
+        """Two grouped queries over the due_date range covering every requested period."""
+        first, last = min(periods), max(periods)
+        start = date(first[0], first[1], 1)
+        end = date(last[0] + 1, 1, 1) if last[1] == 12 else date(last[0], last[1] + 1, 1)
+        wanted = set(periods)
+
+        rev_year, rev_month = extract('year', Transaction.due_date), extract('month', Transaction.due_date)
+        revenue = {}
+        for y, m, total in db.session.query(rev_year, rev_month, func.sum(Transaction.amount)).filter(
+            Transaction.company_id == company_id,
+            Transaction.due_date >= start,
+            Transaction.due_date < end
+        ).group_by(rev_year, rev_month).all():
+            revenue[(int(y), int(m))] = total
+
+        exp_year, exp_month = extract('year', Expense.due_date), extract('month', Expense.due_date)
+        expenses = {}
+        for y, m, name, cat_type, total in db.session.query(
+            exp_year, exp_month, FinancialCategory.name, FinancialCategory.type, func.sum(Expense.amount)
+        ).join(FinancialCategory, Expense.category_id == FinancialCategory.id).filter(
+            Expense.company_id == company_id,
+            Expense.due_date >= start,
+            Expense.due_date < end
+        ).group_by(exp_year, exp_month, FinancialCategory.id, FinancialCategory.name, FinancialCategory.type).all():
+            expenses.setdefault((int(y), int(m)), []).append((name, cat_type, total))
+
+        return {p: DREService.build(revenue.get(p), expenses.get(p, [])) for p in wanted}
+
+    @staticmethod
+    def get_months(company_id, periods):
+        """{(year, month): dre}, serving closed months from DRESnapshot."""
+        periods = list(dict.fromkeys(periods))
+        closed = {p for p in periods if DREService.is_closed(*p)}
+
+        results = {}
+        if closed:
+            years = {y for y, _ in closed}
+            for snap in DRESnapshot.query.filter(
+                DRESnapshot.company_id == company_id,
+                DRESnapshot.year.in_(years)
+            ).all():
+                if (snap.year, snap.month) in closed:
+                    results[(snap.year, snap.month)] = snap.data
+
+        missing = [p for p in periods if p not in results]
+        if not missing:
+            return results
+
+        computed = DREService.compute(company_id, missing)
+        results.update(computed)
+
+        to_store = [p for p in missing if p in closed]
+        if to_store:
+            try:
+                db.session.bulk_insert_mappings(DRESnapshot, [{
+                    'company_id': company_id, 'year': y, 'month': m,
+                    'data': computed[(y, m)], 'computed_at': get_now_br()
+                } for y, m in to_store])
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback() # Concurrent request stored the same month first
+        return results
+
+    @staticmethod
+    def compare(company_id, start, end, group='month'):
+        """Comparative DRE: one column per month (or per year) between start and end, plus the total."""
+        periods = DREService.month_range(start, end)
+        if not periods:
+            raise ValueError("Período inválido.")
+        if len(periods) > DREService.MAX_PERIODS:
+            raise ValueError(f"Período máximo de {DREService.MAX_PERIODS} meses.")
+
+        months = DREService.get_months(company_id, periods)
+
+        columns = []
+        if group == 'year':
+            for year in sorted({y for y, _ in periods}):
+                dre = DREService.combine([months[p] for p in periods if p[0] == year])
+                columns.append({'key': str(year), 'label': str(year), **dre})
+        else:
+            for y, m in periods:
+                columns.append({'key': f"{y}-{m:02d}", 'label': f"{MONTH_LABELS[m - 1]}/{y}", **months[(y, m)]})
+
+        return {
+            'group': group,
+            'periods': columns,
+            'total': DREService.combine([months[p] for p in periods])
+        }
@@ -0,0 +1,192 @@
+import random
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, or_
+from models import db, Transaction, NFSELog
+from services.asaas_service import issue_nfse, find_nfse_by_payment
+from services.billing_job_service import BillingJobService
+from utils import get_now_br
+
+
+class NFSeService:
+    """
+    NFS-e issuance queue, fed by the Asaas webhook processor (BillingEventService).
+    Paid transactions are marked nfse_status='queued'; each round issues up to NFSE_BATCH_SIZE
+    invoices per tenant (tenants in parallel), sharing the tenant's Asaas rate limit with
+    boleto generation. Failures are retried with backoff up to NFSE_MAX_ATTEMPTS, and a retry
+    first looks the invoice up in Asaas so an attempt that went through is never issued twice.
+    """
+
+    LEASE_MINUTES = 5 # A row stuck in 'issuing' longer than this had its worker die
+    MAX_BACKOFF = 3600
+    BACKLOG_STATUSES = ('queued', 'issuing', 'error')
+
+    @staticmethod
+    def enqueue(transaction):
+        transaction.nfse_status = 'queued'
+        transaction.nfse_attempts = 0
+        transaction.nfse_error = None
+        transaction.nfse_next_attempt_at = None
+
+    @staticmethod
+    def retry(company_id, transaction_ids=None):
+        """Re-queues failed invoices (all of the tenant's, or the given ids). Returns how many."""
+        query = Transaction.query.filter(Transaction.company_id == company_id, Transaction.nfse_status == 'error')
+        if transaction_ids:
+            query = query.filter(Transaction.id.in_(transaction_ids))
+        count = query.update({
+            'nfse_status': 'queued', 'nfse_attempts': 0, 'nfse_error': None, 'nfse_next_attempt_at': None
+        }, synchronize_session=False)
+        db.session.commit()
+        return count
+
+    # --- Worker ---
+    @staticmethod
+    def process_pending(app):
+        """One round over every tenant with due invoices. Returns how many invoices were attempted."""
+        now = get_now_br()
+        Transaction.query.filter(
+            Transaction.nfse_status == 'issuing',
+            Transaction.nfse_next_attempt_at < now
+        ).update({'nfse_status': 'queued'}, synchronize_session=False)
+        db.session.commit()
+
+        company_ids = [r[0] for r in db.session.query(Transaction.company_id).filter(
+            Transaction.nfse_status == 'queued',
+            or_(Transaction.nfse_next_attempt_at.is_(None), Transaction.nfse_next_attempt_at <= now)
+        ).distinct().all()]
+        if not company_ids:
+            return 0
+
+        batch_size = app.config.get('NFSE_BATCH_SIZE', 20)
+        workers = min(app.config.get('ASAAS_CONCURRENCY', 4), len(company_ids))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nfse') as pool:
+            return sum(pool.map(lambda cid: NFSeService._process_company(app, cid, batch_size), company_ids))
+
+    @staticmethod
+    def _process_company(app, company_id, batch_size):
+        with app.app_context():
+            try:
+                now = get_now_br()
+                due = Transaction.query.filter(
+                    Transaction.company_id == company_id,
+                    Transaction.nfse_status == 'queued',
+                    or_(Transaction.nfse_next_attempt_at.is_(None), Transaction.nfse_next_attempt_at <= now)
+                )
+
+                api_key = BillingJobService.get_api_key(company_id)
+                if not api_key:
+                    failed = due.update({
+                        'nfse_status': 'error', 'nfse_error': 'Integração Asaas não configurada.'
+                    }, synchronize_session=False)
+                    db.session.commit()
+                    return failed
+
+                ids = [r.id for r in due.with_entities(Transaction.id).order_by(Transaction.id).limit(batch_size).all()]
+                limiter = BillingJobService.get_limiter(api_key)
+                for transaction_id in ids:
+                    NFSeService._issue_one(app, transaction_id, api_key, limiter)
+                return len(ids)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"NFS-e worker error for company {company_id}: {e}")
+                return 0
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def _issue_one(app, transaction_id, api_key, limiter):
+        now = get_now_br()
+        # Atomic claim with a lease: only one worker (in any process) calls Asaas for a given row
+        claimed = Transaction.query.filter_by(id=transaction_id, nfse_status='queued').update({
+            'nfse_status': 'issuing',
+            'nfse_attempts': func.coalesce(Transaction.nfse_attempts, 0) + 1,
+            'nfse_next_attempt_at': now + timedelta(minutes=NFSeService.LEASE_MINUTES)
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return
+
+        t = Transaction.query.get(transaction_id)
+        contract = t.contract
+        nfse, err = None, None
+
+        # Idempotency: a previous attempt may have been accepted even though we saw an error
+        if t.nfse_attempts > 1:
+            limiter.acquire()
+            nfse, _ = find_nfse_by_payment(t.asaas_id, api_key=api_key)
+
+        if not nfse:
+            limiter.acquire()
+            nfse, err = issue_nfse(
+                payment_id=t.asaas_id,
+                service_code=(contract.nfse_service_code if contract else None) or '1.03',
+                iss_rate=(contract.nfse_iss_rate if contract else None) or 2.0,
+                description=f"Serviços ref. {t.description}",
+                api_key=api_key
+            )
+
+        if nfse:
+            t.nfse_status = 'issued'
+            t.nfse_id = nfse.get('id')
+            t.nfse_number = str(nfse.get('number') or '') or 'PENDING'
+            t.nfse_issued_at = get_now_br()
+            t.nfse_error = None
+            t.nfse_next_attempt_at = None
+            db.session.add(NFSELog(
+                company_id=t.company_id, transaction_id=t.id,
+                status='NFSE_REQUESTED', message=f"ID: {nfse.get('id')}"
+            ))
+        else:
+            max_attempts = app.config.get('NFSE_MAX_ATTEMPTS', 5)
+            t.nfse_error = str(err)
+            if t.nfse_attempts >= max_attempts:
+                t.nfse_status = 'error'
+                t.nfse_next_attempt_at = None
+            else:
+                # Exponential backoff (1, 2, 4... min) with jitter so tenants don't retry in lockstep
+                delay = min(60 * 2 ** (t.nfse_attempts - 1), NFSeService.MAX_BACKOFF)
+                t.nfse_status = 'queued'
+                t.nfse_next_attempt_at = get_now_br() + timedelta(seconds=random.uniform(delay / 2, delay))
+            db.session.add(NFSELog(
+                company_id=t.company_id, transaction_id=t.id,
+                status='NFSE_ERROR' if t.nfse_status == 'error' else 'NFSE_RETRY',
+                message=f"Tentativa {t.nfse_attempts}: {err}"
+            ))
+            app.logger.warning(f"NFS-e for transaction {t.id} failed (attempt {t.nfse_attempts}): {err}")
+        db.session.commit()
+
+    # --- Dashboard ---
+    @staticmethod
+    def backlog(company_id):
+        counts = dict(db.session.query(Transaction.nfse_status, func.count(Transaction.id)).filter(
+            Transaction.company_id == company_id,
+            Transaction.nfse_status.in_(NFSeService.BACKLOG_STATUSES)
+        ).group_by(Transaction.nfse_status).all())
+
+        issued_recent = db.session.query(func.count(Transaction.id)).filter(
+            Transaction.company_id == company_id,
+            Transaction.nfse_status == 'issued',
+            Transaction.nfse_issued_at >= get_now_br() - timedelta(days=30)
+        ).scalar() or 0
+
+        items = Transaction.query.filter(
+            Transaction.company_id == company_id,
+            Transaction.nfse_status.in_(NFSeService.BACKLOG_STATUSES)
+        ).order_by(Transaction.id).limit(200).all()
+
+        return {
+            'counts': {s: counts.get(s, 0) for s in NFSeService.BACKLOG_STATUSES},
+            'issued_30d': issued_recent,
+            'items': [{
+                'id': t.id,
+                'description': t.description,
+                'client': t.client.name if t.client else None,
+                'amount': t.amount,
+                'paid_date': t.paid_date.strftime('%d/%m/%Y') if t.paid_date else None,
+                'nfse_status': t.nfse_status,
+                'attempts': t.nfse_attempts or 0,
+                'error': t.nfse_error,
+                'next_attempt_at': t.nfse_next_attempt_at.strftime('%d/%m %H:%M') if t.nfse_status == 'queued' and t.nfse_next_attempt_at else None
+            } for t in items]
+        }
@@ -0,0 +1,132 @@
+import hashlib
+import io
+import os
+import tempfile
+from flask import current_app
+from models import db
+
+
+class PdfArtifactService:
+    """
+    Rendered contract PDFs, stored by a hash of everything that goes into them
+    (generated_content, contract code, company branding, renderer version).
+    Local disk is the first tier; when Supabase is configured the private bucket keeps
+    artifacts across instances (serverless /tmp is per instance). Edits change the key,
+    so a stale PDF is never served; invalidate() only frees the storage of the old one.
+    """
+    RENDER_VERSION = 2 # Bump when PdfService output changes for the same input
+    BUCKET = "contract_pdfs"
+
+    @staticmethod
+    def cache_key(contract):
+        company = contract.company
+        parts = [
+            f"v{PdfArtifactService.RENDER_VERSION}",
+            contract.code or str(contract.id),
+            company.name if company else '',
+            (getattr(company, 'document', None) or getattr(company, 'cpf_cnpj', None) or '') if company else '',
+            contract.generated_content or ''
+        ]
+        return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _object_path(contract, key):
+        return f"company_{contract.company_id}/contract_{contract.id}_{key}.pdf"
+
+    @staticmethod
+    def _local_path(contract, key):
+        folder = os.path.abspath(current_app.config.get('PDF_CACHE_FOLDER') or '/tmp/pdf_cache')
+        return os.path.join(folder, PdfArtifactService._object_path(contract, key))
+
+    @staticmethod
+    def _bucket():
+        supabase = getattr(current_app, 'supabase', None)
+        return supabase.storage.from_(PdfArtifactService.BUCKET) if supabase else None
+
+    @staticmethod
+    def _write_local(path, data):
+        """Atomic write (temp file + rename) so concurrent downloads never see a partial PDF."""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            current_app.logger.warning(f"PDF cache write failed ({path}): {e}")
+            return False
+
+    @staticmethod
+    def cached_path(contract, key=None):
+        """Local file of the current version, or None."""
+        path = PdfArtifactService._local_path(contract, key or PdfArtifactService.cache_key(contract))
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def store(contract, key, data, upload=True):
+        """Saves a rendered PDF as the contract's current artifact; returns the local path (None if not writable)."""
+        bucket = PdfArtifactService._bucket() if upload else None
+        if bucket:
+            object_path = PdfArtifactService._object_path(contract, key)
+            try:
+                bucket.upload(path=object_path, file=data, file_options={"content-type": "application/pdf", "upsert": "true"})
+            except Exception as e:
+                current_app.logger.error(f"PDF artifact upload failed ({object_path}): {e}")
+
+        if contract.pdf_key != key:
+            PdfArtifactService.invalidate(contract, commit=False)
+            contract.pdf_key = key
+            db.session.commit()
+
+        local_path = PdfArtifactService._local_path(contract, key)
+        return local_path if PdfArtifactService._write_local(local_path, data) else None
+
+    @staticmethod
+    def get_or_render(contract):
+        """
+        Returns (source, key): source is a local file path, or a BytesIO when the
+        local tier is not writable. Renders and stores the PDF on a miss.
+        """
+        from services.pdf_service import PdfService
+
+        key = PdfArtifactService.cache_key(contract)
+        local_path = PdfArtifactService.cached_path(contract, key)
+        if local_path:
+            return local_path, key
+
+        data, downloaded = None, False
+        bucket = PdfArtifactService._bucket()
+        if bucket and contract.pdf_key == key:
+            object_path = PdfArtifactService._object_path(contract, key)
+            try:
+                data, downloaded = bucket.download(object_path), True
+            except Exception as e:
+                current_app.logger.info(f"PDF artifact not in storage ({object_path}): {e}")
+
+        if data is None:
+            data = PdfService.generate_pdf(contract)
+
+        local_path = PdfArtifactService.store(contract, key, data, upload=not downloaded)
+        return (local_path or io.BytesIO(data)), key
+
+    @staticmethod
+    def invalidate(contract, commit=True):
+        """Drops the stored artifact of the contract (call when generated_content changes)."""
+        key = contract.pdf_key
+        if not key:
+            return
+        contract.pdf_key = None
+        if commit:
+            db.session.commit()
+
+        try:
+            os.remove(PdfArtifactService._local_path(contract, key))
+        except OSError:
+            pass
+        bucket = PdfArtifactService._bucket()
+        if bucket:
+            try:
+                bucket.remove([PdfArtifactService._object_path(contract, key)])
+            except Exception as e:
+                current_app.logger.warning(f"PDF artifact removal failed for contract {contract.id}: {e}")
@@ -1,14 +1,241 @@
 import io
 import os
+import re
+import hashlib
+import tempfile
+import threading
+from html import unescape
 from fpdf import FPDF
+from fpdf.html import HTML2FPDF
+from fpdf.image_parsing import preload_image
+from fontTools import subset as ftsubset
+from fontTools import ttLib
 from flask import current_app
 
+
+class HeaderLogoCache:
+    """
+    Header logo resolved and decoded once per process instead of on every page.
+    The candidate path is probed once per app root; the decoded image (fpdf's image info,
+    i.e. compressed pixel data) is keyed by path + mtime and seeded into each new
+    document's image cache, so fpdf never re-reads or re-decodes the PNG.
+    """
+    CANDIDATES = (
+        ('static', 'img', 'logo_1.png'),
+        ('static', 'images', 'logo.png'),
+        ('static', 'img', 'logo.png')
+    )
+
+    _paths = {} # root_path -> logo path (None = no logo)
+    _infos = {} # (path, mtime) -> decoded fpdf image info
+    _lock = threading.Lock()
+
+    @staticmethod
+    def resolve(root_path):
+        if root_path not in HeaderLogoCache._paths:
+            found = None
+            for parts in HeaderLogoCache.CANDIDATES:
+                path = os.path.join(root_path, *parts)
+                if os.path.exists(path):
+                    found = path
+                    break
+            HeaderLogoCache._paths[root_path] = found
+        return HeaderLogoCache._paths[root_path]
+
+    @staticmethod
+    def load(image_cache, root_path):
+        """Makes the logo available in a document's image cache; returns its name (None = no logo)."""
+        path = HeaderLogoCache.resolve(root_path)
+        if not path:
+            return None
+        key = (path, os.path.getmtime(path))
+
+        with HeaderLogoCache._lock:
+            info = HeaderLogoCache._infos.get(key)
+        if info is not None:
+            # Same bookkeeping preload_image() does for a first use in this document
+            seeded = type(info)(info)
+            seeded['i'] = len(image_cache.images) + 1
+            seeded['usages'] = 0
+            seeded['iccp_i'] = None
+            image_cache.images[path] = seeded
+            return path
+
+        _, _, info = preload_image(image_cache, path)
+        if not info.get('iccp'): # ICC profiles are registered per document
+            cached = type(info)(info)
+            for field in ('i', 'usages', 'iccp_i'):
+                cached.pop(field, None)
+            with HeaderLogoCache._lock:
+                for stale in [k for k in HeaderLogoCache._infos if k[0] == path]:
+                    del HeaderLogoCache._infos[stale]
+                HeaderLogoCache._infos[key] = cached
+        info['usages'] = 0 # Counted when header() places it
+        return path
+
+
+class PdfFontManager:
+    """
+    Unicode body font for contract PDFs (DejaVu Sans, static/fonts) instead of the
+    Latin-1-only core Helvetica. Each document registers a subset of the font holding only
+    the characters it uses: subsets are cached on disk by a hash of the character set, so
+    fpdf parses a few hundred glyphs instead of ~6000 per style and embeds (compressed)
+    only what is drawn. Without the font files the Helvetica + Latin-1 path is used.
+    """
+    FAMILY = 'contractsans'
+    FOLDER = ('static', 'fonts')
+    STYLES = {
+        '': 'DejaVuSans.ttf',
+        'B': 'DejaVuSans-Bold.ttf',
+        'I': 'DejaVuSans-Oblique.ttf',
+        'BI': 'DejaVuSans-BoldOblique.ttf'
+    }
+    # Always in the subset (header/footer, digits, Portuguese accents), so most contracts share one
+    BASE_CHARS = frozenset(range(0x20, 0x7f)) | frozenset(range(0xa0, 0x100)) | frozenset(map(ord, '\u2013\u2014\u2018\u2019\u201c\u201d\u2022\u2026'))
+    # Same tables fpdf drops when it embeds a TTF (no text shaping)
+    DROP_TABLES = ['FFTM', 'GDEF', 'GPOS', 'GSUB', 'MATH', 'hdmx', 'meta']
+
+    _fonts = {} # root_path -> {style: font path} (None = font files missing)
+    _subsets = {} # (font path, mtime, charset hash) -> subset file path
+    _lock = threading.Lock()
+
+    @staticmethod
+    def resolve(root_path):
+        if root_path not in PdfFontManager._fonts:
+            folder = os.path.join(root_path, *PdfFontManager.FOLDER)
+            paths = {style: os.path.join(folder, name) for style, name in PdfFontManager.STYLES.items()}
+            PdfFontManager._fonts[root_path] = paths if all(os.path.exists(p) for p in paths.values()) else None
+        return PdfFontManager._fonts[root_path]
+
+    @staticmethod
+    def charset(*texts):
+        """Code points a document needs (text as the HTML parser will see it, entities decoded)."""
+        chars = set(PdfFontManager.BASE_CHARS)
+        for text in texts:
+            if text:
+                chars.update(map(ord, unescape(text)))
+        return chars
+
+    @staticmethod
+    def _subset_folder():
+        folder = os.path.abspath(current_app.config.get('PDF_CACHE_FOLDER') or '/tmp/pdf_cache')
+        return os.path.join(folder, 'fonts')
+
+    @staticmethod
+    def _subset(font_path, chars):
+        """Subset TTF of font_path with the given code points, written once per character set."""
+        digest = hashlib.sha1(','.join(map(str, sorted(chars - PdfFontManager.BASE_CHARS))).encode()).hexdigest()[:16]
+        key = (font_path, os.path.getmtime(font_path), digest)
+        with PdfFontManager._lock:
+            cached = PdfFontManager._subsets.get(key)
+        if cached and os.path.exists(cached):
+            return cached
+
+        name = os.path.splitext(os.path.basename(font_path))[0]
+        path = os.path.join(PdfFontManager._subset_folder(), f"{name}-{int(key[1])}-{digest}.ttf")
+        if not os.path.exists(path):
+            options = ftsubset.Options(notdef_outline=True, recommended_glyphs=True, glyph_names=True)
+            options.drop_tables += PdfFontManager.DROP_TABLES
+            font = ttLib.TTFont(font_path, recalcTimestamp=False)
+            subsetter = ftsubset.Subsetter(options)
+            subsetter.populate(unicodes=chars)
+            subsetter.subset(font)
+
+            # Atomic write: documents rendered concurrently may ask for the same subset
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                font.save(f)
+            os.replace(tmp_path, path)
+
+        with PdfFontManager._lock:
+            PdfFontManager._subsets[key] = path
+        return path
+
+    @staticmethod
+    def register(pdf, root_path, chars):
+        """Adds the Unicode family to the document; returns its name, or None to stay on Helvetica."""
+        fonts = PdfFontManager.resolve(root_path)
+        if not fonts:
+            return None
+        try:
+            for style, font_path in fonts.items():
+                pdf.add_font(PdfFontManager.FAMILY, style, PdfFontManager._subset(font_path, chars))
+            return PdfFontManager.FAMILY
+        except Exception as e:
+            current_app.logger.warning(f"Unicode PDF font unavailable, using Helvetica: {e}")
+            return None
+
+
+class ContractHTML2FPDF(HTML2FPDF):
+    """
+    fpdf's HTML parser with the contract normalization applied to each token as it is parsed,
+    instead of regex/replace passes over the whole document before parsing:
+    <img> src resolved to a file (src dropped if missing, so nothing is drawn), <p> justified
+    unless aligned, width attributes/styles removed (fpdf rejects % widths), and text nodes
+    coerced to Latin-1 when the document is on the Helvetica fallback.
+    """
+    SIZED_TAGS = ('table', 'td', 'th')
+    STYLE_WIDTH = re.compile(r'width:\s*[^;]+;?', re.IGNORECASE)
+    LATIN1 = str.maketrans({
+        '\u2013': '-', '\u2014': '-',
+        '\u2018': "'", '\u2019': "'",
+        '\u201c': '"', '\u201d': '"',
+        '\u2022': '-', '\u2026': '...',
+        '\u00a0': ' ', '\u200b': '',
+    })
+
+    def __init__(self, pdf, *args, **kwargs):
+        super().__init__(pdf, *args, **kwargs)
+        self.latin1 = pdf.font_name == 'Helvetica'
+        if not self.latin1 and self.ul_bullet_char == '\x95': # Windows-1252 bullet, not Unicode
+            self.ul_bullet_char = '\u2022'
+
+    @staticmethod
+    def to_latin1(text):
+        if text.isascii():
+            return text
+        return text.translate(ContractHTML2FPDF.LATIN1).encode('latin-1', 'replace').decode('latin-1')
+
+    @staticmethod
+    def normalize_attrs(tag, attrs):
+        """Attribute list of a start tag, normalized for fpdf."""
+        if not attrs: # Most tags of an editor-produced contract
+            return [('align', 'justify')] if tag == 'p' else attrs
+
+        normalized = []
+        for name, value in attrs:
+            if name == 'width' and tag in ContractHTML2FPDF.SIZED_TAGS:
+                continue
+            if name == 'style' and value and 'width' in value.lower():
+                value = ContractHTML2FPDF.STYLE_WIDTH.sub('', value)
+            elif name == 'src' and tag == 'img':
+                value = PdfService._resolve_img_path(value or '')
+                if not value:
+                    current_app.logger.warning(f"Could not resolve image: {dict(attrs).get('src')}")
+                    continue
+            normalized.append((name, value))
+        if tag == 'p' and not any(name == 'align' for name, _ in normalized):
+            normalized.insert(0, ('align', 'justify'))
+        return normalized
+
+    def handle_starttag(self, tag, attrs):
+        super().handle_starttag(tag, self.normalize_attrs(tag, attrs))
+
+    def handle_data(self, data):
+        super().handle_data(self.to_latin1(data) if self.latin1 else data)
+
+
 class ContractPDF(FPDF):
+    HTML2FPDF_CLASS = ContractHTML2FPDF
+
     def __init__(self, contract_code, company_name="NORTHWAY", company_subtext=""):
         super().__init__()
         self.contract_code = contract_code
         self.company_name = company_name
         self.company_subtext = company_subtext
+        self.logo_name = None # Resolved on the first page, then reused from the image cache
+        self.font_name = 'Helvetica' # PdfFontManager.FAMILY once registered
         self.set_auto_page_break(auto=True, margin=20)
 
     def header(self):
@@ -16,28 +243,23 @@ class ContractPDF(FPDF):
         
         logo_loaded = False
         try:
-            # Try multiple common paths for the logo
-            possible_paths = [
-                os.path.join(current_app.root_path, 'static', 'img', 'logo_1.png'),
-                os.path.join(current_app.root_path, 'static', 'images', 'logo.png'),
-                os.path.join(current_app.root_path, 'static', 'img', 'logo.png')
-            ]
-            
-            for logo_path in possible_paths:
-                if os.path.exists(logo_path):
-                    # Fixed width 33mm, auto height
-                    self.image(logo_path, 10, 8, w=33)
-                    logo_loaded = True
-                    break
+            if self.logo_name is None:
+                self.logo_name = HeaderLogoCache.load(self.image_cache, current_app.root_path) or ''
+
+            if self.logo_name:
+                # Fixed width 33mm, auto height
+                self.image(self.logo_name, 10, 8, w=33)
+                logo_loaded = True
                     
         except Exception as e:
             current_app.logger.warning(f"Logo load failed (Pillow missing?): {e}")
+            self.logo_name = ''
             logo_loaded = False
 
         # If logo failed, use the Text Brand (Fallback)
         if not logo_loaded: 
             # 1. Main Brand (Company Name)
-            self.set_font('Helvetica', 'B', 20)
+            self.set_font(self.font_name, 'B', 20)
             self.set_text_color(0, 0, 0) # Black
             # Fallback if empty
             display_name = self.company_name if self.company_name else "NORTHWAY"
@@ -53,14 +275,14 @@ class ContractPDF(FPDF):
              # We just need to ensure we don't write over the logo.
              self.set_xy(10, 25) # Below logo
         else:
-             self.set_font('Helvetica', '', 9)
+             self.set_font(self.font_name, '', 9)
              self.set_text_color(100, 100, 100) # Gray
              if self.company_subtext:
                 self.cell(0, 5, self.company_subtext, 0, 1, 'L')
 
         # 3. Document Title (Right Aligned)
         self.set_y(15) # Top area
-        self.set_font('Helvetica', 'B', 12)
+        self.set_font(self.font_name, 'B', 12)
         self.set_text_color(0)
         self.cell(0, 10, 'CONTRATO DE SERVIÇOS', 0, 1, 'R')
         
@@ -73,7 +295,7 @@ class ContractPDF(FPDF):
         # 5. Reference Code
         if self.contract_code:
             self.set_xy(10, 33)
-            self.set_font('Helvetica', 'I', 8)
+            self.set_font(self.font_name, 'I', 8)
             self.set_text_color(128)
             self.cell(0, 4, f"Ref: {self.contract_code}", 0, 1, 'R')
             
@@ -82,7 +304,7 @@ class ContractPDF(FPDF):
     def footer(self):
         # Position at 1.5 cm from bottom
         self.set_y(-15)
-        self.set_font('Helvetica', 'I', 8)
+        self.set_font(self.font_name, 'I', 8)
         self.set_text_color(128)
         footer_text = f"{self.company_name} - Documento Confidencial | Página " + str(self.page_no()) + " de {nb}"
         self.cell(0, 10, footer_text, 0, 0, 'C')
@@ -135,79 +357,30 @@ class PdfService:
                 else:
                      company_subtext = contract.company.name
 
+            html = contract.generated_content
+
             current_app.logger.info("Initializing ContractPDF...")
             pdf = ContractPDF(
                 contract_code=contract.code or str(contract.id),
                 company_name=company_name,
                 company_subtext=company_subtext
             )
-            
+            chars = PdfFontManager.charset(html, company_name, company_subtext, pdf.contract_code)
+            pdf.font_name = PdfFontManager.register(pdf, current_app.root_path, chars) or 'Helvetica'
+
             pdf.alias_nb_pages()
             pdf.add_page()
             
             # Set basic font
-            pdf.set_font('Helvetica', '', 10)
+            pdf.set_font(pdf.font_name, '', 10)
             
             # Write HTML content
-            if contract.generated_content:
-                html = contract.generated_content
-                import re
-                
-                # --- A. IMAGE PATH CORRECTION ---
-                # FPDF2 requires absolute paths. We must find <img src="..."> and fix it.
-                def replace_img_src(match):
-                    full_tag = match.group(0)
-                    src_match = re.search(r'src=["\']([^"\']+)["\']', full_tag)
-                    if src_match:
-                        original_src = src_match.group(1)
-                        abs_path = PdfService._resolve_img_path(original_src)
-                        if abs_path:
-                            # Replace the src with absolute path
-                            return full_tag.replace(original_src, abs_path)
-                    # If resolving fails, strip the image to prevent crash
-                    current_app.logger.warning(f"Could not resolve image: {full_tag}")
-                    return "" 
-                
-                # Execute replacement
-                html = re.sub(r'<img[^>]+>', replace_img_src, html, flags=re.IGNORECASE)
-
-                # --- B. LAYOUT PRESERVATION ---
-                # REMOVED aggressive flattening (div/p -> br) to allow FPDF2 to handle structure.
-                
-                # Ensure all paragraphs are justified
-                # This helps with the professional look
-                if '<p' in html:
-                    html = re.sub(r'<p([^>]*)>', r'<p align="justify"\1>', html, flags=re.IGNORECASE)
-                
-                # Ensure Divs don't merge (FPDF2 sometimes needs help with inline-block divs)
-                # We inject a small separator if needed, but standard block behavior should work.
-                # If the user has <div align="right">, we want to keep that.
-                    
-                # --- C. CLEANUP ---
-                # Strip Table Widths (Critical: FPDF2 often crashes on % or relative widths)
-                html = re.sub(r'(<table[^>]*?)\swidth="[^"]*"', r'\1', html, flags=re.IGNORECASE)
-                html = re.sub(r'(<td[^>]*?)\swidth="[^"]*"', r'\1', html, flags=re.IGNORECASE)
-                html = re.sub(r'(<th[^>]*?)\swidth="[^"]*"', r'\1', html, flags=re.IGNORECASE)
-                html = re.sub(r'width:\s*[^;"\']+[;"\']?', '', html, flags=re.IGNORECASE)
-
-                # Latin-1 Sanitization
-                replacements = {
-                    '\u2013': '-', '\u2014': '-',
-                    '\u2018': "'", '\u2019': "'",
-                    '\u201c': '"', '\u201d': '"',
-                    '\u2022': '-', '\u2026': '...',
-                    '\u00a0': ' ', '\u200b': '',
-                }
-                for src, dst in replacements.items():
-                    html = html.replace(src, dst)
-                
-                # Force Encoding
-                html = html.encode('latin-1', 'replace').decode('latin-1')
-
-                # --- D. WRITE ---
+            if html:
+                # Image paths, justification, width cleanup and Latin-1 coercion happen
+                # per tag/text node inside ContractHTML2FPDF while fpdf parses the HTML.
                 # Wrap in a container that enforces font and alignment
                 sty_html = f"""
-                <div style="font-family: Helvetica; font-size: 10pt; text-align: justify; line-height: 1.5;">
+                <div style="font-family: {pdf.font_name}; font-size: 10pt; text-align: justify; line-height: 1.5;">
                 {html}
                 </div>
                 """
@@ -0,0 +1,200 @@
+import time
+import threading
+from datetime import date, timedelta
+from sqlalchemy import func, extract, case, and_, or_
+from models import db, Contract, Transaction
+
+MONTH_LABELS = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+
+
+class ProjectionService:
+    """
+    Cash-flow "what if" projection (12-36 months) under several scenarios.
+    The tenant's inputs - pending installments per month, active MRR/ticket, overdue backlog and
+    historical late-payment rate - come from a few grouped queries, cached per tenant for
+    CACHE_TTL seconds. Each scenario is then one pass over the month vector, so comparing
+    scenarios costs no extra queries regardless of how many contracts the tenant has.
+    """
+
+    MAX_MONTHS = 36
+    MAX_SCENARIOS = 6
+    CACHE_TTL = 300
+
+    _cache = {} # (company_id, months, first month) -> (expires_at, base)
+    _cache_lock = threading.Lock()
+
+    @staticmethod
+    def add_months(d, months):
+        month = d.month - 1 + months
+        return date(d.year + month // 12, month % 12 + 1, 1)
+
+    # --- Inputs ---
+    @staticmethod
+    def load_base(company_id, months, today=None):
+        today = today or date.today()
+        start = today.replace(day=1)
+        key = (company_id, months, start)
+
+        with ProjectionService._cache_lock:
+            cached = ProjectionService._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+
+        base = ProjectionService._query_base(company_id, months, start, today)
+        with ProjectionService._cache_lock:
+            ProjectionService._cache[key] = (time.monotonic() + ProjectionService.CACHE_TTL, base)
+        return base
+
+    @staticmethod
+    def _query_base(company_id, months, start, today):
+        periods = [ProjectionService.add_months(start, i) for i in range(months)]
+        end = ProjectionService.add_months(start, months)
+
+        # Contracted schedule: pending charges per due month (range scan on ix_transaction_company_status_due)
+        due_year, due_month = extract('year', Transaction.due_date), extract('month', Transaction.due_date)
+        sums = {(int(y), int(m)): float(total or 0) for y, m, total in db.session.query(
+            due_year, due_month, func.sum(Transaction.amount)
+        ).filter(
+            Transaction.company_id == company_id,
+            Transaction.status == 'pending',
+            Transaction.due_date >= today,
+            Transaction.due_date < end
+        ).group_by(due_year, due_month).all()}
+
+        overdue = db.session.query(func.coalesce(func.sum(Transaction.amount), 0)).filter(
+            Transaction.company_id == company_id,
+            Transaction.status.in_(['pending', 'overdue']),
+            Transaction.due_date < today
+        ).scalar()
+
+        mrr, active = db.session.query(
+            func.coalesce(func.sum(Contract.installment_value), 0),
+            func.count(Contract.id)
+        ).filter(
+            Contract.company_id == company_id,
+            Contract.status.in_(['signed', 'active'])
+        ).one()
+
+        # Historical late rate: share of the last 12 months' billed amount paid after (or still open past) the due date
+        last_year = today - timedelta(days=365)
+        late_amount, billed_amount = db.session.query(
+            func.coalesce(func.sum(case((or_(
+                and_(Transaction.status == 'paid', Transaction.paid_date > Transaction.due_date),
+                Transaction.status.in_(['pending', 'overdue'])
+            ), Transaction.amount), else_=0)), 0),
+            func.coalesce(func.sum(Transaction.amount), 0)
+        ).filter(
+            Transaction.company_id == company_id,
+            Transaction.status.in_(['paid', 'pending', 'overdue']),
+            Transaction.due_date >= last_year,
+            Transaction.due_date < today
+        ).one()
+
+        mrr = float(mrr)
+        return {
+            'labels': [f"{MONTH_LABELS[p.month - 1]}/{p.year}" for p in periods],
+            'schedule': [round(sums.get((p.year, p.month), 0), 2) for p in periods],
+            'overdue': float(overdue),
+            'mrr': mrr,
+            'active_contracts': active,
+            'avg_ticket': mrr / active if active else 0,
+            'late_rate': round(float(late_amount) / float(billed_amount) * 100, 2) if billed_amount else 0
+        }
+
+    # --- Scenarios ---
+    @staticmethod
+    def default_scenarios(base):
+        late = base['late_rate']
+        return [
+            {'key': 'base', 'label': 'Base', 'churn': 0, 'new_sales': 0, 'late_rate': late},
+            {'key': 'pessimistic', 'label': 'Pessimista', 'churn': 3, 'new_sales': 0, 'late_rate': min(late + 10, 100)},
+            {'key': 'optimistic', 'label': 'Otimista', 'churn': 1, 'new_sales': 2, 'late_rate': late / 2}
+        ]
+
+    @staticmethod
+    def parse_scenario(data, index=0):
+        """Validates one scenario dict; percentages are 0-100, new_sales is contracts per month."""
+        if not isinstance(data, dict):
+            raise ValueError(f"Cenário {index + 1}: formato inválido.")
+
+        def number(field, minimum, maximum, default=0):
+            value = data.get(field, default)
+            try:
+                value = float(value if value not in (None, '') else default)
+            except (TypeError, ValueError):
+                raise ValueError(f"Cenário {index + 1}: '{field}' deve ser numérico.")
+            if not minimum <= value <= maximum:
+                raise ValueError(f"Cenário {index + 1}: '{field}' deve estar entre {minimum} e {maximum}.")
+            return value
+
+        ticket = data.get('ticket')
+        return {
+            'key': str(data.get('key') or f"scenario_{index + 1}")[:30],
+            'label': str(data.get('label') or f"Cenário {index + 1}")[:50],
+            'churn': number('churn', 0, 100),
+            'new_sales': number('new_sales', 0, 10000),
+            'late_rate': number('late_rate', 0, 100),
+            'ticket': number('ticket', 0, 10 ** 9) if ticket not in (None, '') else None
+        }
+
+    @staticmethod
+    def simulate(base, scenario):
+        """
+        Month by month:
+          contracted = scheduled installments x survival (monthly churn compounds)
+          new sales  = cohorts from month 1 on (new_sales x ticket), churned like the base
+          received   = (contracted + new sales) x (1 - late_rate) + last month's late share
+        """
+        keep = 1 - scenario['churn'] / 100
+        late = scenario['late_rate'] / 100
+        ticket = scenario['ticket'] if scenario.get('ticket') is not None else base['avg_ticket']
+        new_per_month = scenario['new_sales'] * ticket
+
+        survival, new_mrr, carry, cumulative = 1.0, 0.0, 0.0, 0.0
+        rows = []
+        for i, scheduled in enumerate(base['schedule']):
+            contracted = scheduled * survival
+            if i > 0:
+                new_mrr = new_mrr * keep + new_per_month
+            expected = contracted + new_mrr
+            received = expected * (1 - late) + carry
+            carry = expected * late
+            cumulative += received
+            rows.append({
+                'contracted': round(contracted, 2),
+                'new_sales': round(new_mrr, 2),
+                'expected': round(expected, 2),
+                'received': round(received, 2),
+                'cumulative': round(cumulative, 2)
+            })
+            survival *= keep
+
+        return {
+            **scenario,
+            'ticket': round(ticket, 2),
+            'months': rows,
+            'totals': {
+                'expected': round(sum(r['expected'] for r in rows), 2),
+                'received': round(cumulative, 2),
+                'late_after_horizon': round(carry, 2)
+            }
+        }
+
+    @staticmethod
+    def project(company_id, months=12, scenarios=None):
+        if not 1 <= months <= ProjectionService.MAX_MONTHS:
+            raise ValueError(f"Horizonte deve estar entre 1 e {ProjectionService.MAX_MONTHS} meses.")
+
+        base = ProjectionService.load_base(company_id, months)
+        if scenarios is None:
+            scenarios = ProjectionService.default_scenarios(base)
+        if not scenarios or len(scenarios) > ProjectionService.MAX_SCENARIOS:
+            raise ValueError(f"Informe de 1 a {ProjectionService.MAX_SCENARIOS} cenários.")
+        parsed = [ProjectionService.parse_scenario(s, i) for i, s in enumerate(scenarios)]
+
+        return {
+            'months': months,
+            'labels': base['labels'],
+            'base': {k: base[k] for k in ('schedule', 'overdue', 'mrr', 'active_contracts', 'avg_ticket', 'late_rate')},
+            'scenarios': [ProjectionService.simulate(base, s) for s in parsed]
+        }
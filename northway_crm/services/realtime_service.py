@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import select
+import threading
+from collections import deque
+from flask import current_app
+from models import db
+
+
+class InProcessBroker:
+    """
+    Single-node pub/sub for inbox events.
+    Keeps a small ring buffer per company so reconnecting clients (SSE Last-Event-ID
+    or long-poll cursor) can catch up without touching the database.
+    """
+
+    def __init__(self, buffer_size=200):
+        self.buffer_size = buffer_size
+        self._cond = threading.Condition()
+        self._buffers = {}  # company_id -> deque[(event_id, event)]
+        self._seq = 0
+
+    def publish(self, company_id, event):
+        self._deliver(company_id, event)
+
+    def _deliver(self, company_id, event, event_id=None):
+        """Buffers an event; event_id comes from the publisher when ids are global (Postgres)."""
+        with self._cond:
+            self._seq = max(self._seq, event_id) if event_id else self._seq + 1
+            buf = self._buffers.get(company_id)
+            if buf is None:
+                buf = self._buffers[company_id] = deque(maxlen=self.buffer_size)
+            buf.append((event_id or self._seq, event))
+            self._cond.notify_all()
+
+    def last_id(self):
+        with self._cond:
+            return self._seq
+
+    def wait(self, company_id, since, timeout):
+        """
+        Blocks until the company has events newer than `since` or `timeout` elapses.
+        Returns a list of (event_id, event) tuples (empty on timeout).
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            since = self._clamp(since)
+            while True:
+                events = [(i, e) for i, e in self._buffers.get(company_id, ()) if i > since]
+                if events:
+                    return events
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+
+    def _clamp(self, since):
+        # Ids are per process here: a cursor issued by another process/restart resumes from "now"
+        return min(since, self._seq)
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    Multi-instance pub/sub on top of Postgres LISTEN/NOTIFY.
+    Publishing takes the event id from a database sequence and sends it in the NOTIFY
+    payload, so ids (SSE Last-Event-ID, long-poll cursors) mean the same on every instance;
+    a single listener thread per process feeds notifications into the local ring buffers.
+    """
+    CHANNEL = 'northway_inbox'
+    SEQUENCE = 'northway_inbox_event_seq'
+
+    def __init__(self, dsn, buffer_size=200):
+        super().__init__(buffer_size)
+        self.dsn = dsn
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        self._sequence_ready = False
+
+    def _ensure_sequence(self, conn):
+        from sqlalchemy import text
+        if not self._sequence_ready:
+            conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {self.SEQUENCE}"))
+            self._sequence_ready = True
+
+    def publish(self, company_id, event):
+        from sqlalchemy import text
+        with db.engine.connect() as conn:
+            self._ensure_sequence(conn)
+            event_id = conn.execute(text(f"SELECT nextval('{self.SEQUENCE}')")).scalar()
+            payload = json.dumps({'id': event_id, 'company_id': company_id, 'event': event}, default=str)
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {'channel': self.CHANNEL, 'payload': payload})
+            conn.commit()
+
+    def last_id(self):
+        """Latest id issued on any instance (the cursor of a client connecting now)."""
+        from sqlalchemy import text
+        with db.engine.connect() as conn:
+            self._ensure_sequence(conn)
+            row = conn.execute(text(f"SELECT last_value, is_called FROM {self.SEQUENCE}")).first()
+            conn.commit()
+        last = row.last_value if row.is_called else 0
+        with self._cond:
+            self._seq = max(self._seq, last)
+        return last
+
+    def _clamp(self, since):
+        # Global ids: a cursor from another instance is valid here as-is
+        return since
+
+    def wait(self, company_id, since, timeout):
+        self._ensure_listener()
+        return super().wait(company_id, since, timeout)
+
+    def _ensure_listener(self):
+        if self._listener and self._listener.is_alive():
+            return
+        with self._listener_lock:
+            if self._listener and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen_forever, name='realtime-pg-listener', daemon=True)
+            self._listener.start()
+
+    def _listen_forever(self):
+        import psycopg2
+        import psycopg2.extensions
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.CHANNEL};")
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            data = json.loads(notify.payload)
+                            self._deliver(data['company_id'], data['event'], data.get('id'))
+                        except Exception as e:
+                            print(f"Realtime: bad notification payload: {e}")
+            except Exception as e:
+                print(f"Realtime: Postgres listener error, reconnecting: {e}")
+                time.sleep(2)
+            finally:
+                if conn is not None:
+                    try: conn.close()
+                    except: pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Returns the process-wide broker, choosing the backend from REALTIME_BACKEND
+    (auto | memory | postgres); auto uses Postgres whenever the database is PostgreSQL.
+
+    Both brokers assume a long-lived process. The Postgres LISTEN thread holds its own DB
+    connection and freezes between serverless invocations, dropping whatever was notified
+    meanwhile; NOTIFY is sent after the caller's commit on a separate connection, so a failed
+    publish loses the event. The inbox polling covers both gaps, which is why serverless
+    deployments default to 'memory' with long-poll only (see REALTIME_SSE in app.py).
+    """
+    global _broker
+    if _broker is not None:
+        return _broker
+
+    with _broker_lock:
+        if _broker is not None:
+            return _broker
+
+        backend = current_app.config.get('REALTIME_BACKEND') or os.environ.get('REALTIME_BACKEND', 'auto')
+        buffer_size = int(current_app.config.get('REALTIME_BUFFER_SIZE', 200))
+
+        if backend in ('postgres', 'auto') and db.engine.dialect.name == 'postgresql':
+            dsn = db.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+            _broker = PostgresBroker(dsn, buffer_size=buffer_size)
+        else:
+            if backend == 'postgres':
+                current_app.logger.warning("REALTIME_BACKEND=postgres but database is not PostgreSQL. Using in-process broker.")
+            _broker = InProcessBroker(buffer_size=buffer_size)
+        return _broker
+
+
+class RealtimeService:
+    # Event types pushed to the inbox
+    EVENT_MESSAGE = 'message'
+    EVENT_STATUS = 'status'
+    EVENT_READ = 'read'
+
+    @staticmethod
+    def publish(company_id, event_type, **data):
+        """Publishes an inbox event for a tenant. Never raises: realtime is best-effort."""
+        try:
+            event = dict(data, type=event_type)
+            get_broker().publish(int(company_id), event)
+        except Exception as e:
+            current_app.logger.error(f"Realtime publish error: {e}")
+
+    @staticmethod
+    def publish_message(msg):
+        """Publishes a new-message event from a WhatsAppMessage row (content trimmed to keep NOTIFY payloads small)."""
+        content = msg.content or ''
+        RealtimeService.publish(
+            msg.company_id, RealtimeService.EVENT_MESSAGE,
+            contact_uuid=msg.contact_uuid,
+            phone=msg.phone,
+            lead_id=msg.lead_id,
+            client_id=msg.client_id,
+            message={
+                'id': msg.id,
+                'content': content[:500],
+                'direction': msg.direction,
+                'status': msg.status,
+                'type': msg.type or 'text',
+                'attachment_url': msg.attachment_url,
+                'timestamp': msg.created_at.isoformat() if msg.created_at else None
+            }
+        )
+
+    @staticmethod
+    def last_event_id():
+        return get_broker().last_id()
+
+    @staticmethod
+    def wait_for_events(company_id, since, timeout=25):
+        """Returns a list of (event_id, event) newer than `since` for the tenant, blocking up to `timeout` seconds."""
+        return get_broker().wait(int(company_id), since, timeout)
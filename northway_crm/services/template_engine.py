@@ -0,0 +1,76 @@
+import re
+import threading
+from collections import OrderedDict
+
+PLACEHOLDER_RE = re.compile(r'\{\{([^{}]*)\}\}')
+_MISSING = object()
+
+
+class CompiledTemplate:
+    """
+    Template content split once into literal / placeholder segments.
+    Rendering is a single join; replacement values are inserted verbatim (never rescanned),
+    and placeholders without a replacement are kept as written.
+    """
+    __slots__ = ('source', 'literals', 'keys', 'placeholders')
+
+    def __init__(self, source):
+        self.source = source
+        self.literals = [] # len(keys) + 1: literal, key, literal, key, ..., literal
+        self.keys = [] # Full '{{NAME}}' tokens, the form used by get_contract_replacements()
+        pos = 0
+        for match in PLACEHOLDER_RE.finditer(source):
+            self.literals.append(source[pos:match.start()])
+            self.keys.append(match.group(0))
+            pos = match.end()
+        self.literals.append(source[pos:])
+        self.placeholders = frozenset(self.keys)
+
+    def render(self, replacements):
+        parts = [self.literals[0]]
+        for key, literal in zip(self.keys, self.literals[1:]):
+            value = replacements.get(key, _MISSING)
+            parts.append(key if value is _MISSING else str(value))
+            parts.append(literal)
+        return ''.join(parts)
+
+    def unknown_placeholders(self, replacements):
+        return sorted(self.placeholders.difference(replacements))
+
+
+class TemplateEngine:
+    """
+    Compiled ContractTemplate cache, keyed by template id + updated_at.
+    The cached source is compared on hit, so content changed without touching
+    updated_at (bulk updates, unsaved objects) is recompiled instead of served stale.
+    """
+    MAX_CACHED = 256
+
+    _cache = OrderedDict() # (template_id, updated_at) -> CompiledTemplate
+    _lock = threading.Lock()
+
+    @classmethod
+    def compile(cls, template):
+        content = template.content or ''
+        key = (template.id, template.updated_at)
+
+        with cls._lock:
+            compiled = cls._cache.get(key)
+            if compiled is not None and compiled.source == content:
+                cls._cache.move_to_end(key)
+                return compiled
+
+        compiled = CompiledTemplate(content)
+        if template.id is not None:
+            with cls._lock:
+                cls._cache[key] = compiled
+                cls._cache.move_to_end(key)
+                while len(cls._cache) > cls.MAX_CACHED:
+                    cls._cache.popitem(last=False)
+        return compiled
+
+    @classmethod
+    def render(cls, template, replacements):
+        """Returns (content, unknown placeholders)."""
+        compiled = cls.compile(template)
+        return compiled.render(replacements), compiled.unknown_placeholders(replacements)
@@ -1,6 +1,8 @@
 from models import db, Integration, WhatsAppMessage, Lead, Client
 from flask import current_app
 from utils import update_integration_health, retry_request
+from services.realtime_service import RealtimeService
+from services.zapi_client import ZApiClient
 import requests
 import json
 import re
@@ -10,42 +12,8 @@ import base64
 class WhatsAppService:
     @staticmethod
     def get_config(company_id):
-        """Retrieves and validates Z-API configuration for a company."""
-        try:
-            cid = int(company_id)
-        except:
-            current_app.logger.error(f"Z-API ERROR: Invalid company_id: {company_id}")
-            return None
-
-        integration = Integration.query.filter_by(company_id=cid, service='z_api').first()
-        
-        if not integration:
-            current_app.logger.warning(f"Z-API ERROR: No integration record found for company {cid} in service 'z_api'")
-            return None
-            
-        if not integration.is_active:
-            current_app.logger.warning(f"Z-API ERROR: Integration found but NOT ACTIVE for company {cid}")
-            return None
-
-        
-        try:
-            config = json.loads(integration.config_json) if integration.config_json else {}
-            api_url = config.get('api_url', 'https://api.z-api.io')
-            
-            # Robustness: Remove instance/token/method if user pasted full URL
-            if '/instances/' in api_url:
-                api_url = api_url.split('/instances/')[0]
-            api_url = api_url.rstrip('/')
-                
-            return {
-                'instance_id': config.get('instance_id'),
-                'api_url': api_url,
-                'client_token': config.get('client_token'),
-                'token': integration.api_key
-            }
-        except Exception as e:
-            current_app.logger.error(f"Error parsing Z-API config: {e}")
-            return None
+        """Retrieves and validates Z-API configuration for a company (cached per process, see ZApiClient)."""
+        return ZApiClient.get_config(company_id)
 
     @staticmethod
     def normalize_phone(phone):
@@ -113,11 +81,85 @@ class WhatsAppService:
             
         return None, None
 
+    @staticmethod
+    def get_or_create_contact(company_id, norm_phone):
+        """Returns the Contact for a canonical phone, creating it if needed (flushed, not committed)."""
+        from models import Contact
+        import uuid
+
+        contact = Contact.query.filter_by(company_id=company_id, phone=norm_phone).first()
+        if not contact:
+            contact = Contact(
+                uuid=str(uuid.uuid4()),
+                company_id=company_id,
+                phone=norm_phone,
+                created_at=datetime.utcnow()
+            )
+            db.session.add(contact)
+            db.session.flush()
+        return contact
+
+    @staticmethod
+    def get_thread_messages(company_id, contact_uuids=None, legacy_filters=None, before=None, limit=50):
+        """
+        Returns one page of a thread, newest first in the DB and ascending in the result.
+        Keyset pagination on id. A thread is every message linked to one of `contact_uuids`,
+        read through the (company_id, contact_uuid, id) index. `legacy_filters` (lead_id /
+        client_id / phone) are only added while the thread still has rows with no contact_uuid
+        (before maintenance/backfill_message_contacts.py has run), and only match those rows.
+        Returns (messages, has_more).
+        """
+        cols = db.session.query(
+            WhatsAppMessage.id,
+            WhatsAppMessage.content,
+            WhatsAppMessage.direction,
+            WhatsAppMessage.status,
+            WhatsAppMessage.type,
+            WhatsAppMessage.attachment_url,
+            WhatsAppMessage.created_at
+        ).filter(WhatsAppMessage.company_id == company_id)
+
+        thread_filters = []
+        uuids = [u for u in (contact_uuids or []) if u]
+        if uuids:
+            thread_filters.append(WhatsAppMessage.contact_uuid.in_(uuids))
+        if legacy_filters:
+            unlinked = db.and_(WhatsAppMessage.contact_uuid.is_(None), db.or_(*legacy_filters))
+            # Cheap probe on the lead/client/phone indexes; false for every thread once backfilled
+            has_unlinked = db.session.query(
+                db.session.query(WhatsAppMessage.id)
+                .filter(WhatsAppMessage.company_id == company_id, unlinked).exists()
+            ).scalar()
+            if has_unlinked:
+                thread_filters.append(unlinked)
+        if not thread_filters:
+            return [], False
+        cols = cols.filter(db.or_(*thread_filters)) if len(thread_filters) > 1 else cols.filter(thread_filters[0])
+
+        if before:
+            cols = cols.filter(WhatsAppMessage.id < before)
+
+        # Fetch one extra row to know if there is another page
+        rows = cols.order_by(WhatsAppMessage.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+
+        return [{
+            'id': r.id,
+            'content': r.content,
+            'direction': r.direction,
+            'status': r.status,
+            'type': r.type or 'text',
+            'attachment_url': r.attachment_url,
+            'timestamp': r.created_at.isoformat() if r.created_at else None
+        } for r in rows], has_more
+
     @staticmethod
     def send_message(company_id, target_type, target_id, content, media_file=None):
         """Sends a text or media message via Z-API."""
-        config = WhatsAppService.get_config(company_id)
-        if not config:
+        client = ZApiClient.for_company(company_id)
+        if not client:
             raise Exception("WhatsApp não configurado para esta empresa.")
 
         # Get Target
@@ -135,60 +177,52 @@ class WhatsAppService:
         if not phone:
              raise Exception("Contato sem telefone válido.")
 
-        # Prepare Headers
-        headers = {}
-        if config.get('client_token'):
-            headers['Client-Token'] = config['client_token']
+        # Link outgoing messages to the thread so history can be read by contact_uuid
+        contact_uuid = target.contact_uuid or WhatsAppService.get_or_create_contact(company_id, phone).uuid
+        if not target.contact_uuid:
+            target.contact_uuid = contact_uuid
 
-        # API Base
-        base_url = f"{config['api_url']}/instances/{config['instance_id']}/token/{config['token']}"
-        
         payload = {"phone": phone}
         endpoint = "send-text"
         
+        media_url = None
+        msg_type = 'text'
         if media_file:
             # Handle Media
-            file_content = media_file.read()
-            b64_data = "data:{};base64,{}".format(
-                media_file.mimetype or 'application/octet-stream',
-                base64.b64encode(file_content).decode('utf-8')
-            )
+            max_mb = current_app.config.get('WHATSAPP_MEDIA_MAX_MB', 16)
+            if WhatsAppService.get_media_size(media_file) > max_mb * 1024 * 1024:
+                raise Exception(f"Arquivo excede o limite de {max_mb} MB.")
+
+            # Preferred: send Z-API a URL. Legacy base64 data URI only when no storage is reachable.
+            media_url = WhatsAppService.upload_outgoing_media(company_id, media_file)
+            if media_url:
+                media_ref = media_url
+            else:
+                media_file.stream.seek(0)
+                media_ref = "data:{};base64,{}".format(
+                    media_file.mimetype or 'application/octet-stream',
+                    base64.b64encode(media_file.read()).decode('utf-8')
+                )
             
             if media_file.mimetype and media_file.mimetype.startswith('audio'):
                  endpoint = "send-audio"
-                 payload["audio"] = b64_data
+                 payload["audio"] = media_ref
+                 msg_type = 'audio'
             elif media_file.mimetype and media_file.mimetype.startswith('image'):
                  endpoint = "send-image"
-                 payload["image"] = b64_data
+                 payload["image"] = media_ref
                  payload["caption"] = content or media_file.filename
+                 msg_type = 'image'
             else:
                  endpoint = "send-document"
-                 payload["document"] = b64_data
+                 payload["document"] = media_ref
                  payload["fileName"] = media_file.filename
+                 msg_type = 'document'
         else:
             payload["message"] = content
 
         try:
-            url = f"{base_url}/{endpoint}"
-            
-            @retry_request()
-            def perform_send(payload_data):
-                return requests.post(url, json=payload_data, headers=headers, timeout=15)
-            
-            res = perform_send(payload)
-            data = res.json()
-            
-            # 9th Digit Fallback (Brazil)
-            # If fail or if it's a 13-digit BR number, Z-API sometimes accepts but doesn't deliver
-            # To be safe, if the first try returns an error or if we want to ensure delivery:
-            error_msg = data.get('error') or data.get('errorMessage')
-            if (res.status_code >= 400 or error_msg) and len(phone) == 13 and phone.startswith('55'):
-                # Try without the 9 (e.g., 55 42 9 8888 8888 -> 55 42 8888 8888)
-                phone_no_9 = phone[:4] + phone[5:]
-                payload["phone"] = phone_no_9
-                res = perform_send(payload)
-                data = res.json()
-                error_msg = data.get('error') or data.get('errorMessage')
+            res, data, error_msg = WhatsAppService.post_with_phone_fallback(client, endpoint, payload)
 
             # Z-API error handling
             if res.status_code >= 400 or error_msg:
@@ -197,9 +231,12 @@ class WhatsAppService:
                     company_id=company_id,
                     lead_id=target.id if target_type == 'lead' else None,
                     client_id=target.id if target_type == 'client' else None,
+                    contact_uuid=contact_uuid,
                     phone=WhatsAppService.normalize_phone(target.phone),
                     direction='out',
                     content=content if not media_file else f"[{'FOTO' if 'image' in endpoint else 'ARQUIVO'}] {media_file.filename}",
+                    type=msg_type,
+                    attachment_url=media_url,
                     status='failed'
                 )
                 db.session.add(msg)
@@ -214,9 +251,12 @@ class WhatsAppService:
                 company_id=company_id,
                 lead_id=target.id if target_type == 'lead' else None,
                 client_id=target.id if target_type == 'client' else None,
+                contact_uuid=contact_uuid,
                 phone=WhatsAppService.normalize_phone(target.phone),
                 direction='out',
                 content=content if not media_file else f"[{'FOTO' if 'image' in endpoint else 'ARQUIVO'}] {media_file.filename}",
+                type=msg_type,
+                attachment_url=media_url,
                 status='sent',
                 external_id=data.get('messageId')
             )
@@ -224,6 +264,7 @@ class WhatsAppService:
             db.session.commit()
             
             update_integration_health(company_id, 'z_api')
+            RealtimeService.publish_message(msg)
             return msg
             
         except Exception as e:
@@ -233,21 +274,46 @@ class WhatsAppService:
                 update_integration_health(company_id, 'z_api', error=str(e))
             raise e
     @staticmethod
+    def post_with_phone_fallback(client, endpoint, payload, retry=True):
+        """
+        POSTs a send payload to Z-API. Returns (response, data, error_msg).
+        `retry=False` skips the transport-level retry for callers that schedule their own.
+        """
+        def perform_send(payload_data):
+            return client.post(endpoint, json=payload_data, timeout=15)
+        if retry:
+            perform_send = retry_request()(perform_send)
+
+        phone = payload.get('phone') or ''
+        res = perform_send(payload)
+        data = res.json()
+        
+        # 9th Digit Fallback (Brazil)
+        # If fail or if it's a 13-digit BR number, Z-API sometimes accepts but doesn't deliver
+        # To be safe, if the first try returns an error or if we want to ensure delivery:
+        error_msg = data.get('error') or data.get('errorMessage')
+        if (res.status_code >= 400 or error_msg) and len(phone) == 13 and phone.startswith('55'):
+            # Try without the 9 (e.g., 55 42 9 8888 8888 -> 55 42 8888 8888)
+            payload = dict(payload, phone=phone[:4] + phone[5:])
+            res = perform_send(payload)
+            data = res.json()
+            error_msg = data.get('error') or data.get('errorMessage')
+
+        return res, data, error_msg
+
+    @staticmethod
     def fetch_profile_picture(company_id, phone):
         """Fetches the profile picture URL from Z-API."""
-        config = WhatsAppService.get_config(company_id)
-        if not config: return None
+        client = ZApiClient.for_company(company_id)
+        if not client: return None
 
         clean_phone = WhatsAppService.normalize_phone(phone)
         if not clean_phone: return None
 
-        url = f"{config['api_url']}/instances/{config['instance_id']}/token/{config['token']}/profile-picture"
-        headers = {'Client-Token': config['client_token']} if config.get('client_token') else {}
-        
         try:
             @retry_request()
             def perform_fetch(p):
-                return requests.get(url, params={'phone': p}, headers=headers, timeout=10)
+                return client.get('profile-picture', params={'phone': p}, timeout=10)
             
             # 1. Try standard phone
             res = perform_fetch(clean_phone)
@@ -296,35 +362,43 @@ class WhatsAppService:
             update_integration_health(company_id, 'z_api', error=e)
             return None
 
+    MEDIA_BUCKET = "whatsapp_media"
+    MEDIA_CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def _upload_to_supabase(supabase, company_id, local_path, file_extension, content_type):
+        """Uploads a file from disk (streamed by the client) and returns its public URL."""
+        import uuid
+        path = f"company_{company_id}/{uuid.uuid4()}.{file_extension}"
+        bucket = supabase.storage.from_(WhatsAppService.MEDIA_BUCKET)
+        bucket.upload(path=path, file=local_path, file_options={"content-type": content_type})
+        return bucket.get_public_url(path)
+
     @staticmethod
     def store_media_in_supabase(company_id, media_url, file_extension):
         """Downloads media from Z-API and stores it in Supabase for persistence."""
         from flask import current_app
+        import os
+        import shutil
+        import tempfile
         supabase = getattr(current_app, 'supabase', None)
         if not supabase:
             return media_url
 
+        tmp_path = None
         try:
-            # 1. Download from Z-API
-            res = requests.get(media_url, timeout=20)
-            if res.status_code != 200:
-                return media_url
-            
-            # 2. Prepare Path
-            import uuid
-            filename = f"{uuid.uuid4()}.{file_extension}"
-            path = f"company_{company_id}/{filename}"
-            bucket = "whatsapp_media"
-            
-            # 3. Upload to Supabase
-            supabase.storage.from_(bucket).upload(
-                path=path,
-                file=res.content,
-                file_options={"content-type": res.headers.get('Content-Type', 'application/octet-stream')}
-            )
-            
-            # 4. Get Public URL
-            public_url = supabase.storage.from_(bucket).get_public_url(path)
+            # 1. Download from Z-API (streamed to disk, never fully in memory)
+            with requests.get(media_url, timeout=20, stream=True) as res:
+                if res.status_code != 200:
+                    return media_url
+                content_type = res.headers.get('Content-Type', 'application/octet-stream')
+                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as tmp:
+                    tmp_path = tmp.name
+                    res.raw.decode_content = True
+                    shutil.copyfileobj(res.raw, tmp, WhatsAppService.MEDIA_CHUNK_SIZE)
+
+            # 2. Upload to Supabase
+            public_url = WhatsAppService._upload_to_supabase(supabase, company_id, tmp_path, file_extension, content_type)
             current_app.logger.info(f"WhatsApp media stored successfully: {public_url}")
             return public_url
         except Exception as e:
@@ -333,6 +407,67 @@ class WhatsAppService:
             if hasattr(e, 'response') and hasattr(e.response, 'text'):
                 current_app.logger.error(f"Supabase Response: {e.response.text}")
             return media_url
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def get_media_size(media_file):
+        """Size in bytes of an uploaded FileStorage without reading it into memory."""
+        stream = media_file.stream
+        pos = stream.tell()
+        stream.seek(0, 2)
+        size = stream.tell()
+        stream.seek(pos)
+        return size
+
+    @staticmethod
+    def upload_outgoing_media(company_id, media_file):
+        """
+        Stores an outgoing attachment so Z-API can fetch it by URL.
+        Copies the upload in fixed-size chunks (Supabase, or the local static folder when it is
+        publicly reachable). Returns None when there is no storage Z-API can reach.
+        """
+        from flask import request, url_for
+        from werkzeug.utils import secure_filename
+        import os
+        import mimetypes
+        import shutil
+        import tempfile
+        import uuid
+
+        content_type = media_file.mimetype or 'application/octet-stream'
+        ext = os.path.splitext(secure_filename(media_file.filename or ''))[1].lstrip('.').lower()
+        if not ext:
+            ext = (mimetypes.guess_extension(content_type) or '.bin').lstrip('.')
+
+        media_file.stream.seek(0)
+        supabase = getattr(current_app, 'supabase', None)
+        if supabase:
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}") as tmp:
+                    tmp_path = tmp.name
+                    shutil.copyfileobj(media_file.stream, tmp, WhatsAppService.MEDIA_CHUNK_SIZE)
+                return WhatsAppService._upload_to_supabase(supabase, company_id, tmp_path, ext, content_type)
+            except Exception as e:
+                current_app.logger.error(f"Supabase upload failed for outgoing media: {e}")
+                media_file.stream.seek(0)
+            finally:
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        # Local fallback: only usable when served from /static on a public host
+        folder = current_app.config.get('WHATSAPP_MEDIA_FOLDER', '')
+        root = request.url_root.rstrip('/')
+        if not folder.startswith('static/') or 'localhost' in root or '127.0.0.1' in root:
+            return None
+
+        rel_dir = os.path.join(folder[len('static/'):], f"company_{company_id}")
+        filename = f"{uuid.uuid4()}.{ext}"
+        os.makedirs(os.path.join(current_app.static_folder, rel_dir), exist_ok=True)
+        media_file.save(os.path.join(current_app.static_folder, rel_dir, filename), buffer_size=WhatsAppService.MEDIA_CHUNK_SIZE)
+        return url_for('static', filename=f"{rel_dir}/{filename}", _external=True, _scheme='https')
 
     @staticmethod
     def get_inbox_conversations(company_id, limit=300):
@@ -406,20 +541,8 @@ class WhatsAppService:
                         'profile_pic_url': pic_url
                     }
                     
-            # 4. Fill Unread Counts (by Contact UUID)
-            unread_stats = db.session.query(
-                WhatsAppMessage.contact_uuid,
-                db.func.count(WhatsAppMessage.id)
-            ).filter(
-                WhatsAppMessage.company_id == company_id,
-                WhatsAppMessage.direction == 'in',
-                WhatsAppMessage.status != 'read',
-                WhatsAppMessage.contact_uuid != None
-            ).group_by(
-                WhatsAppMessage.contact_uuid
-            ).all()
-            
-            unread_map = {u: c for u, c in unread_stats}
+            # 4. Fill Unread Counts (per-contact counters, already loaded with the messages)
+            unread_map = {m.contact_uuid: (m.contact.unread_count or 0) for m in messages if m.contact}
 
             # 4b. Fill Unread Counts for Unlinked Messages (by Phone)
             unread_stats_phone = db.session.query(
@@ -462,32 +585,52 @@ class WhatsAppService:
         result = sorted(conversations.values(), key=lambda x: x['last_message_at'], reverse=True)
         return result
 
+    # Per-contact unread counters (Contact.unread_count / unread_tab) rebuilt from messages.
+    # Used when the columns are first added and by maintenance/recount_unread.py.
+    UNREAD_RECOUNT_SQL = """
+        UPDATE contact SET
+            unread_count = (
+                SELECT COUNT(*) FROM whats_app_message m
+                WHERE m.company_id = contact.company_id AND m.contact_uuid = contact.uuid
+                  AND m.direction = 'in' AND m.status != 'read'
+            ),
+            unread_tab = CASE
+                WHEN EXISTS (SELECT 1 FROM lead WHERE lead.contact_uuid = contact.uuid) THEN 'lead'
+                WHEN EXISTS (SELECT 1 FROM client WHERE client.contact_uuid = contact.uuid) THEN 'client'
+                ELSE 'atendimento'
+            END
+    """
+
+    @staticmethod
+    def unread_tab_for(lead_id, client_id):
+        """Inbox tab a message is counted under (same precedence as the conversation list filters)."""
+        if lead_id: return 'lead'
+        if client_id: return 'client'
+        return 'atendimento'
+
+    @staticmethod
+    def recount_unread():
+        """Rebuilds every contact's unread counter from whats_app_message."""
+        from sqlalchemy import text
+        db.session.execute(text(WhatsAppService.UNREAD_RECOUNT_SQL))
+        db.session.commit()
+
     @staticmethod
     def get_unread_summary(company_id):
-        """Returns total unread count and count by tab efficiently (no N+1)."""
+        """Returns total unread count and count by tab from the per-contact counters."""
         try:
-            type_case = db.case(
-                (WhatsAppMessage.lead_id != None, 'lead'),
-                (WhatsAppMessage.client_id != None, 'client'),
-                else_='atendimento'
-            )
-            
-            counts = db.session.query(
-                type_case.label('type'),
-                db.func.count(WhatsAppMessage.id)
-            ).filter(
-                WhatsAppMessage.company_id == company_id,
-                WhatsAppMessage.direction == 'in',
-                WhatsAppMessage.status != 'read'
-            ).group_by(type_case).all()
+            from models import Contact
+            rows = db.session.query(Contact.unread_tab, Contact.unread_count).filter(
+                Contact.company_id == company_id,
+                Contact.unread_count > 0
+            ).all()
             
             total = 0
             by_tab = {'lead': 0, 'client': 0, 'atendimento': 0}
             
-            for c_type, count in counts:
+            for c_type, count in rows:
                 total += count
-                if c_type in by_tab:
-                    by_tab[c_type] = count
+                by_tab[c_type if c_type in by_tab else 'atendimento'] += count
             
             return total, by_tab
         except Exception as e:
@@ -495,39 +638,58 @@ class WhatsAppService:
             return 0, {'lead': 0, 'client': 0, 'atendimento': 0}
 
     @staticmethod
-    def mark_as_read(company_id, phone):
-        """Marks all incoming messages from a contact as read (resilient matching)."""
+    def mark_as_read(company_id, phone=None, contact_uuid=None):
+        """
+        Marks all incoming messages of a conversation as read.
+        Keyed on contact_uuid; the contact's counter drops by the rows actually marked, so a
+        message that arrives meanwhile stays counted. Unlinked legacy rows of the same phone are
+        cleared by a separate (company_id, phone) update, a no-op once
+        maintenance/backfill_message_contacts.py has run.
+        """
         try:
-            # 1. Normalize phone to ensure consistency
+            from models import Contact
             norm_phone = WhatsAppService.normalize_phone(phone)
-            
-            # 2. Find Contact/Lead/Client
-            c_type, contact_obj = WhatsAppService.find_contact(norm_phone, company_id)
-            
-            # 3. Build Query
-            query = WhatsAppMessage.query.filter_by(company_id=company_id, direction='in')
-            
-            # 4. Filter by ID if available (Strong Match)
-            if c_type == 'lead':
-                query = query.filter(db.or_(WhatsAppMessage.lead_id == contact_obj.id, WhatsAppMessage.phone == norm_phone))
-                # Update lead profile pic if missing and message has one
-                last_msg = WhatsAppMessage.query.filter_by(lead_id=contact_obj.id).order_by(WhatsAppMessage.created_at.desc()).first()
-                if last_msg and last_msg.profile_pic_url and not contact_obj.profile_pic_url:
-                    contact_obj.profile_pic_url = last_msg.profile_pic_url
-            elif c_type == 'client':
-                query = query.filter(db.or_(WhatsAppMessage.client_id == contact_obj.id, WhatsAppMessage.phone == norm_phone))
+
+            contact_filter = [Contact.company_id == company_id]
+            if contact_uuid:
+                contact_filter.append(Contact.uuid == contact_uuid)
+            elif norm_phone:
+                contact_filter.append(Contact.phone == norm_phone)
             else:
-                # Fallback to Phone/Contact UUID (Loose Match)
-                from models import Contact
-                contact = Contact.query.filter_by(company_id=company_id, phone=norm_phone).first()
-                if contact:
-                    query = query.filter(db.or_(WhatsAppMessage.contact_uuid == contact.uuid, WhatsAppMessage.phone == norm_phone))
-                else:
-                    query = query.filter_by(phone=norm_phone)
+                return False
+            contact = db.session.query(Contact.uuid, Contact.phone).filter(*contact_filter).first()
 
-            # 5. Execute Update
-            query.filter(WhatsAppMessage.status != 'read').update({WhatsAppMessage.status: 'read'}, synchronize_session=False)
+            unread = WhatsAppMessage.query.filter(
+                WhatsAppMessage.company_id == company_id,
+                WhatsAppMessage.direction == 'in',
+                WhatsAppMessage.status != 'read'
+            )
+            updated = 0
+            if contact:
+                linked = unread.filter(WhatsAppMessage.contact_uuid == contact.uuid)\
+                    .update({WhatsAppMessage.status: 'read'}, synchronize_session=False)
+                if linked:
+                    # GREATEST(unread_count - linked, 0), portable
+                    Contact.query.filter(Contact.uuid == contact.uuid).update({
+                        Contact.unread_count: db.case(
+                            (Contact.unread_count > linked, Contact.unread_count - linked), else_=0
+                        )
+                    }, synchronize_session=False)
+                updated += linked
+
+            # Legacy messages never linked to a contact (not part of any counter)
+            legacy_phone = contact.phone if contact else norm_phone
+            if legacy_phone:
+                updated += unread.filter(WhatsAppMessage.contact_uuid == None, WhatsAppMessage.phone == legacy_phone)\
+                    .update({WhatsAppMessage.status: 'read'}, synchronize_session=False)
             db.session.commit()
+
+            if updated:
+                RealtimeService.publish(
+                    company_id, RealtimeService.EVENT_READ,
+                    phone=contact.phone if contact else norm_phone,
+                    contact_uuid=contact.uuid if contact else None
+                )
             return True
         except Exception as e:
             db.session.rollback()
@@ -557,6 +719,10 @@ class WhatsAppService:
             if msg:
                 msg.status = final_status
                 db.session.commit()
+                RealtimeService.publish(
+                    company_id, RealtimeService.EVENT_STATUS,
+                    message_id=msg.id, contact_uuid=msg.contact_uuid, phone=msg.phone, status=final_status
+                )
                 return {'success': True, 'type': 'status_update'}
 
         # 2. Extract Phone and Body
@@ -617,19 +783,7 @@ class WhatsAppService:
             return {'ignored': True, 'reason': 'missing_data'}
             
         # 3. Find or Create Contact
-        from models import Contact
-        import uuid
-        
-        contact = Contact.query.filter_by(company_id=company_id, phone=norm_phone).first()
-        if not contact:
-            contact = Contact(
-                uuid=str(uuid.uuid4()),
-                company_id=company_id,
-                phone=norm_phone,
-                created_at=datetime.utcnow()
-            )
-            db.session.add(contact)
-            db.session.flush()
+        contact = WhatsAppService.get_or_create_contact(company_id, norm_phone)
 
         # 4. Profile Picture
         incoming_pic = data.get('senderImage') or data.get('photo')
@@ -644,10 +798,12 @@ class WhatsAppService:
              c_type, found_obj = WhatsAppService.find_contact(norm_phone, company_id)
              if c_type == 'lead':
                  lead_id = found_obj.id
-                 found_obj.contact_uuid = contact.uuid # Sync UUID
+                 if not found_obj.contact_uuid: # Never move an existing thread to another phone form
+                     found_obj.contact_uuid = contact.uuid
              elif c_type == 'client':
                  client_id = found_obj.id
-                 found_obj.contact_uuid = contact.uuid # Sync UUID
+                 if not found_obj.contact_uuid: # Never move an existing thread to another phone form
+                     found_obj.contact_uuid = contact.uuid
 
         # 6. Save Message
         sender_name = data.get('senderName')
@@ -668,9 +824,17 @@ class WhatsAppService:
                 external_id=data.get('messageId')
             )
             db.session.add(msg)
+            if not from_me:
+                # Incremental unread counter (atomic, no recount)
+                from models import Contact
+                Contact.query.filter(Contact.id == contact.id).update({
+                    Contact.unread_count: db.func.coalesce(Contact.unread_count, 0) + 1,
+                    Contact.unread_tab: WhatsAppService.unread_tab_for(lead_id, client_id)
+                }, synchronize_session=False)
             db.session.commit()
             
             update_integration_health(company_id, 'z_api')
+            RealtimeService.publish_message(msg)
             # Return UUID to allow frontend to update the correct thread
             return {'success': True, 'msg_id': msg.id, 'contact_uuid': contact.uuid}
         except Exception as e:
@@ -684,13 +848,10 @@ class WhatsAppService:
         Configures the Z-API webhooks programmatically.
         Updates all relevant webhook endpoints.
         """
-        config = WhatsAppService.get_config(company_id)
-        if not config:
+        client = ZApiClient.for_company(company_id)
+        if not client:
             raise Exception("WhatsApp não configurado.")
 
-        base_url = f"{config['api_url']}/instances/{config['instance_id']}/token/{config['token']}"
-        headers = {'Client-Token': config['client_token']} if config.get('client_token') else {}
-        
         # Endpoints to update
         endpoints = [
             "update-webhook-received",
@@ -704,12 +865,11 @@ class WhatsAppService:
         failed_endpoints = []
         for endp in endpoints:
             try:
-                url = f"{base_url}/{endp}"
                 payload = {"value": webhook_url}
                 
                 @retry_request()
                 def perform_put():
-                    return requests.put(url, json=payload, headers=headers, timeout=10)
+                    return client.put(endp, json=payload, timeout=10)
                 
                 res = perform_put()
                 if res.status_code not in [200, 201]:
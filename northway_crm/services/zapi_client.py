@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from models import Integration
+
+
+class ZApiClient:
+    """
+    Thin Z-API client shared by the whole process.
+    - One pooled requests.Session (keep-alive) instead of a TLS handshake per call.
+    - Per-company config cache (TTL + explicit invalidation on config save).
+    - Per-endpoint latency/error counters.
+    """
+    POOL_SIZE = int(os.environ.get('ZAPI_POOL_SIZE', 20))
+    CONFIG_TTL = int(os.environ.get('ZAPI_CONFIG_TTL', 300))
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    _config_cache = {}  # company_id -> (config, expires_at)
+    _config_lock = threading.Lock()
+
+    _metrics = {}  # endpoint -> {'count', 'errors', 'total_ms', 'max_ms'}
+    _metrics_lock = threading.Lock()
+
+    def __init__(self, config):
+        self.config = config
+        self.base_url = f"{config['api_url']}/instances/{config['instance_id']}/token/{config['token']}"
+        self.headers = {'Client-Token': config['client_token']} if config.get('client_token') else {}
+
+    # --- Factory / Config ---
+    @classmethod
+    def for_company(cls, company_id):
+        """Returns a client for the company or None if Z-API is not configured."""
+        config = cls.get_config(company_id)
+        return cls(config) if config else None
+
+    @classmethod
+    def get_config(cls, company_id):
+        """Cached equivalent of loading the 'z_api' Integration row and parsing config_json."""
+        try:
+            cid = int(company_id)
+        except (TypeError, ValueError):
+            current_app.logger.error(f"Z-API ERROR: Invalid company_id: {company_id}")
+            return None
+
+        now = time.monotonic()
+        with cls._config_lock:
+            cached = cls._config_cache.get(cid)
+            if cached and cached[1] > now:
+                return dict(cached[0])
+
+        config = cls._load_config(cid)
+        # Misses are not cached so a freshly saved integration works right away
+        if config:
+            with cls._config_lock:
+                cls._config_cache[cid] = (config, now + cls.CONFIG_TTL)
+            return dict(config)
+        return None
+
+    @classmethod
+    def invalidate(cls, company_id):
+        with cls._config_lock:
+            cls._config_cache.pop(int(company_id), None)
+
+    @staticmethod
+    def _load_config(cid):
+        integration = Integration.query.filter_by(company_id=cid, service='z_api').first()
+
+        if not integration:
+            current_app.logger.warning(f"Z-API ERROR: No integration record found for company {cid} in service 'z_api'")
+            return None
+
+        if not integration.is_active:
+            current_app.logger.warning(f"Z-API ERROR: Integration found but NOT ACTIVE for company {cid}")
+            return None
+
+        try:
+            config = json.loads(integration.config_json) if integration.config_json else {}
+            api_url = config.get('api_url', 'https://api.z-api.io')
+
+            # Robustness: Remove instance/token/method if user pasted full URL
+            if '/instances/' in api_url:
+                api_url = api_url.split('/instances/')[0]
+            api_url = api_url.rstrip('/')
+
+            return {
+                'instance_id': config.get('instance_id'),
+                'api_url': api_url,
+                'client_token': config.get('client_token'),
+                'token': integration.api_key
+            }
+        except Exception as e:
+            current_app.logger.error(f"Error parsing Z-API config: {e}")
+            return None
+
+    # --- HTTP ---
+    @classmethod
+    def get_session(cls):
+        if cls._session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=cls.POOL_SIZE)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    cls._session = session
+        return cls._session
+
+    def request(self, method, endpoint, **kwargs):
+        """Performs a call to `{base_url}/{endpoint}` recording latency under the endpoint name."""
+        kwargs.setdefault('timeout', 15)
+        headers = dict(self.headers, **kwargs.pop('headers', {}))
+
+        started = time.perf_counter()
+        failed = True
+        try:
+            res = self.get_session().request(method, f"{self.base_url}/{endpoint}", headers=headers, **kwargs)
+            failed = res.status_code >= 400
+            return res
+        finally:
+            self._record(endpoint, (time.perf_counter() - started) * 1000, failed)
+
+    def get(self, endpoint, **kwargs):
+        return self.request('GET', endpoint, **kwargs)
+
+    def post(self, endpoint, **kwargs):
+        return self.request('POST', endpoint, **kwargs)
+
+    def put(self, endpoint, **kwargs):
+        return self.request('PUT', endpoint, **kwargs)
+
+    # --- Metrics ---
+    @classmethod
+    def _record(cls, endpoint, elapsed_ms, failed):
+        with cls._metrics_lock:
+            m = cls._metrics.get(endpoint)
+            if m is None:
+                m = cls._metrics[endpoint] = {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            m['count'] += 1
+            m['errors'] += 1 if failed else 0
+            m['total_ms'] += elapsed_ms
+            m['max_ms'] = max(m['max_ms'], elapsed_ms)
+
+    @classmethod
+    def metrics(cls):
+        """Snapshot of per-endpoint timings for this process."""
+        with cls._metrics_lock:
+            return {
+                endpoint: {
+                    'count': m['count'],
+                    'errors': m['errors'],
+                    'avg_ms': round(m['total_ms'] / m['count'], 1) if m['count'] else 0,
+                    'max_ms': round(m['max_ms'], 1)
+                } for endpoint, m in cls._metrics.items()
+            }
@@ -2,9 +2,14 @@ from datetime import datetime, timedelta
 from flask import jsonify
 from flask_login import current_user
 from models import db, Notification, Interaction, Integration
+import os
 import time
+import uuid
+import socket
+import threading
 import functools
 import requests
+from decimal import Decimal, InvalidOperation
 
 def get_now_br():
     """Returns the current time in Brasília (UTC-3)"""
@@ -29,6 +34,28 @@ def api_response(success=True, data=None, error=None, status=200):
     }
     return jsonify(response), status
 
+def parse_brl_amount(value):
+    """
+    Parses a money string as typed in the contract form ("1.500,00", "R$ 1500,00", "5000.00")
+    into a Decimal. Returns None if empty or invalid.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+
+    s = str(value).replace('R$', '').replace(' ', '').strip()
+    if not s:
+        return None
+    if ',' in s:
+        s = s.replace('.', '').replace(',', '.')
+    elif s.count('.') > 1 or (s.count('.') == 1 and len(s.split('.')[1]) == 3):
+        s = s.replace('.', '') # "1.500" / "1.500.000" thousand separators
+    try:
+        return Decimal(s).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+
 def create_notification(user_id, company_id, type, title, message):
     try:
         notification = Notification(
@@ -300,3 +327,23 @@ def update_integration_health(company_id, service, error=None):
     except Exception as e:
         print(f"Error updating integration health: {e}")
         db.session.rollback()
+
+class RateLimiter:
+    """Spaces calls evenly (N per minute). Share one instance per external account/instance."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / max(per_minute, 1)
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def new_lease_owner():
+    """Identifies one background runner (host, process, run) in DB leases (locked_by columns)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"